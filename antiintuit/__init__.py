@@ -1,4 +1,4 @@
 from antiintuit import (config, database)
 from antiintuit import logger
 from antiintuit.exceptions import AntiintuitException
-from antiintuit.jobs import courses_manager, accounts_manager, tests_manager, tests_solver
+from antiintuit.jobs import courses_manager, accounts_manager, tests_manager, tests_solver, consistency_checker
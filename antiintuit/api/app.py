@@ -1,4 +1,7 @@
-from flask import Flask, abort, request, send_from_directory
+from datetime import datetime
+from time import perf_counter
+
+from flask import Flask, abort, g, request, send_file
 from flask.logging import default_handler
 from peewee import BackrefAccessor, Database
 
@@ -6,7 +9,10 @@ from antiintuit.api.functions import *
 from antiintuit.basic import get_publish_id_from_link
 from antiintuit.config import Config
 from antiintuit.database import *
+from antiintuit.images_store import find_image_path, get_thumbnail_path
+from antiintuit.jobs.tests_manager import get_courses_scans_queue_query
 from antiintuit.logger import get_logger
+from antiintuit.metrics import STAGE_DURATION, is_metrics_enabled, start_metrics_server
 
 __all__ = [
     "app",
@@ -14,6 +20,8 @@ __all__ = [
 ]
 
 logger = get_logger("antiintuit", "api")
+# Names of images are hashes of their contents, so a response of an image never changes
+IMAGE_MAX_AGE = 60 * 60 * 24 * 365
 app = Flask(logger.name, static_folder=Config.STATIC_DIRECTORY)
 app.logger.removeHandler(default_handler)
 
@@ -24,6 +32,21 @@ allow_models = {
 }
 
 
+@app.before_request
+def start_request_timer():
+    if is_metrics_enabled():
+        g.request_started_at = perf_counter()
+
+
+@app.after_request
+def observe_request_duration(response):
+    """Observes the duration of the request by the rule of the route (or its status code if there isn't one)"""
+    if "request_started_at" in g:
+        stage = request.url_rule.rule if request.url_rule is not None else str(response.status_code)
+        STAGE_DURATION.observe(perf_counter() - g.request_started_at, "api", stage)
+    return response
+
+
 @app.route("/<string:model_name>/<int:model_id>", defaults={'attr': None}, methods=["GET"])
 @app.route("/<string:model_name>/<int:model_id>/<string:attr>", methods=["GET"])
 def get_model_data_by_id(model_name, model_id, attr):
@@ -62,9 +85,42 @@ def find_model(model_name):
     return jsonify(result_data)
 
 
+@app.route("/stats/scans", methods=["GET"])
+def get_scans_stats():
+    """Returns the number of courses which are due to scan and the queue of the next scans of courses tests"""
+    limit = min(request.args.get("limit", Config.DEFAULT_API_LIST_LIMIT, type=int), Config.MAX_API_LIST_LIMIT)
+    scanned_at = datetime.utcnow()
+    upcoming_scans = [{
+        "id": course.id,
+        "title": course.title,
+        "link": course.link,
+        "last_scan_at": course.last_scan_at.isoformat(),
+        "next_scan_at": course.next_scan_at.isoformat(),
+        "scan_interval": course.scan_interval
+    } for course in get_courses_scans_queue_query().limit(limit)]
+    return jsonify({
+        "due": Course.select().where(Course.next_scan_at <= scanned_at).count(),
+        "total": Course.select().count(),
+        "upcoming": upcoming_scans
+    })
+
+
 @app.route("/image/<string:image_name>", methods=["GET"])
-def send_file(image_name):
-    return send_from_directory(Config.STATIC_DIRECTORY, image_name)
+def send_image(image_name):
+    """Sends the image (or its thumbnail with ?thumbnail=1 if there is one) with the strong ETag, Range and 304 support.
+    The response is cached as immutable."""
+    image_path = find_image_path(image_name)
+    if image_path is None:
+        abort(404)
+    etag = image_name.split(".")[0]
+    if request.args.get("thumbnail", "0") not in ("", "0", "false"):
+        thumbnail_path = get_thumbnail_path(image_name)
+        if thumbnail_path.is_file():
+            image_path, etag = thumbnail_path, etag + "-thumbnail"
+    response = send_file(str(image_path.absolute()), conditional=True, etag=etag, max_age=IMAGE_MAX_AGE)
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
 
 
 @app.route("/health")
@@ -77,4 +133,5 @@ def health_check():
 
 def run_server(host: str = None, port: int = None, debug: bool = None, **kwargs):
     host, port = host or "0.0.0.0", port or 5000
+    start_metrics_server()
     app.run(host, port, debug, **kwargs)
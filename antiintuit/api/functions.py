@@ -1,13 +1,16 @@
 import math
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from binascii import Error as BinasciiError
 from datetime import date, datetime, time
 
 import ujson
 from flask import request, abort, Response
-from peewee import ModelBase, ModelSelect, fn
+from peewee import (BooleanField, DateField, DateTimeField, DecimalField, FloatField, ForeignKeyField, IntegerField,
+                    ModelBase, ModelSelect, MySQLDatabase, PostgresqlDatabase, TimeField, fn)
 from playhouse.shortcuts import model_to_dict
 
 from antiintuit.config import Config
-from antiintuit.database import Course, Test, Question
+from antiintuit.database import Course, Test, Question, Answer
 
 __all__ = [
     "get_model_dict",
@@ -15,14 +18,23 @@ __all__ = [
     "jsonify_model",
     "get_fields_by_names",
     "get_data_for_sending",
-    "get_like_query"
+    "get_like_query",
+    "get_estimated_count",
+    "encode_cursor",
+    "decode_cursor",
+    "attach_questions"
 ]
 
+COUNT_MODES = ("exact", "estimate", "none")
+
 basic_exceptions = {
-    Course: [Course.last_scan_at, Course.created_at],
+    Course: [Course.last_scan_at, Course.created_at, Course.next_eligible_at, Course.next_scan_at,
+             Course.scan_interval],
     Test: [Test.watcher, Test.created_at, Test.last_scan_at],
     Question: [Question._variants, Question.original_html, Question.last_update_at,
-               Question.locked_at, Question.locked_by, Question.created_at]
+               Question.locked_at, Question.locked_by, Question.created_at, Question.answers_cursor,
+               Question._eliminated_candidates],
+    Answer: [Answer.mask, Answer.candidate_index]
 }
 
 
@@ -79,8 +91,90 @@ def get_expression_by_operator(field, value: str, operator=None):
     return None
 
 
+def get_estimated_count(query: ModelSelect) -> int:
+    """Returns the number of rows of the query estimated by statistics of the planner.
+    Databases without the estimation (SQLite) count rows exactly."""
+    database = query.model._meta.database
+    sql, params = query.order_by().sql()
+    if isinstance(database, PostgresqlDatabase):
+        plan = database.execute_sql("EXPLAIN (FORMAT JSON) " + sql, params).fetchone()[0]
+        plan = ujson.loads(plan) if isinstance(plan, str) else plan
+        return int(plan[0]["Plan"]["Plan Rows"])
+    elif isinstance(database, MySQLDatabase):
+        cursor = database.execute_sql("EXPLAIN " + sql, params)
+        rows_index = [column[0] for column in cursor.description].index("rows")
+        return int(cursor.fetchone()[rows_index] or 0)
+    return query.count()
+
+
+def encode_cursor(position: list) -> str:
+    """Returns the opaque token of the position in a list (values of the order field and id of the last row)"""
+    return urlsafe_b64encode(bytes(ujson.dumps(position, ensure_ascii=False), "utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_cursor(token: str) -> list:
+    """Returns the position in a list by the token or aborts the request if the token is invalid"""
+    try:
+        position = ujson.loads(urlsafe_b64decode(token + "=" * (-len(token) % 4)))
+    except (BinasciiError, ValueError):
+        abort(400)
+    if not isinstance(position, list) or len(position) not in (1, 2) or not isinstance(position[-1], int) or \
+            isinstance(position[-1], bool):
+        abort(400)
+    return position
+
+
+def is_cursor_value_valid(order_field, value) -> bool:
+    """Returns True if the value of the order field from a token has the type of the field"""
+    if isinstance(order_field, ForeignKeyField):
+        order_field = order_field.rel_field
+    if isinstance(order_field, BooleanField):
+        return isinstance(value, bool)
+    if isinstance(value, bool):
+        return False
+    if isinstance(order_field, IntegerField):
+        return isinstance(value, int)
+    if isinstance(order_field, (FloatField, DecimalField)):
+        return isinstance(value, (int, float))
+    if not isinstance(value, str):
+        return False
+    # Datetime values are given in the format of peewee (see get_cursor_position)
+    for field_class, parse in ((DateTimeField, datetime.fromisoformat), (DateField, date.fromisoformat),
+                               (TimeField, time.fromisoformat)):
+        if isinstance(order_field, field_class):
+            try:
+                parse(value)
+            except ValueError:
+                return False
+    return True
+
+
+def get_cursor_position(model, order_field, order_field_name: str or None) -> list:
+    if order_field_name is None:
+        return [model.id]
+    # A foreign key is compared by the id, not by the related row
+    value = getattr(model, order_field.object_id_name if isinstance(order_field, ForeignKeyField) else order_field_name)
+    # Datetime values are compared in the format of peewee
+    return [str(value) if isinstance(value, (datetime, date, time)) else value, model.id]
+
+
+def attach_questions(answers: list):
+    """Sets questions of the answers by one query, so masks of the answers are decoded without a query per answer"""
+    questions = (Question
+                 .select(Question.id, Question._variants)
+                 .where(Question.id.in_(set(answer.question_id for answer in answers))))
+    questions_by_ids = {question.id: question for question in questions}
+    for answer in answers:
+        answer.question = questions_by_ids[answer.question_id]
+
+
 def get_data_for_sending(query: ModelSelect, require_where=False):
-    page, limit, where_count = 1, Config.DEFAULT_API_LIST_LIMIT, 0
+    """Returns the list of the query by arguments of the request.
+    Pages are selected by the 'next' token of the previous response (keyset pagination by the order field and id)
+    or by the 'page' number. The 'count' argument is one of 'exact', 'estimate' (by statistics of the planner)
+    and 'none' (by default, it's 'exact' only if the 'page' is given)."""
+    page, limit, where_count = None, Config.DEFAULT_API_LIST_LIMIT, 0
+    order_field, descending, cursor, count_mode = None, False, None, None
     for arg_name, arg_value in request.args.items():
         if len(arg_value) == 0:
             continue
@@ -88,10 +182,15 @@ def get_data_for_sending(query: ModelSelect, require_where=False):
             fields = get_fields_by_names(query.model, [arg_value])
             if len(fields) == 0:
                 abort(400)
-            field = fields[0] if "order_by" == arg_name else fields[0].desc()
-            query = query.order_by(field)
+            order_field, descending = fields[0], arg_name == "order_by_desc"
         elif arg_name == "page":
             page = int(arg_value)
+        elif arg_name == "next":
+            cursor = decode_cursor(arg_value)
+        elif arg_name == "count":
+            if arg_value not in COUNT_MODES:
+                abort(400)
+            count_mode = arg_value
         elif arg_name == "limit":
             limit = int(arg_value)
             limit = limit if limit <= Config.MAX_API_LIST_LIMIT else Config.MAX_API_LIST_LIMIT
@@ -117,15 +216,59 @@ def get_data_for_sending(query: ModelSelect, require_where=False):
             where_count += 1
     if require_where and where_count == 0:
         abort(400)
-    count = query.count()
+    count_mode = count_mode or ("exact" if page is not None else "none")
+    count = None
+    if count_mode == "exact":
+        count = query.count()
+    elif count_mode == "estimate":
+        count = get_estimated_count(query)
     if count == 0:
         abort(404)
-    pages_count = math.ceil(count / limit)
-    data = [get_model_dict(sm) for sm in query.paginate(page, limit)]
-    return {
-        "data": data,
-        "page": page,
-        "pages": pages_count,
+    id_field = query.model.id
+    if order_field is None or order_field is id_field:
+        order_field, order_field_name = id_field, None
+    else:
+        order_field_name = order_field.name
+    # Rows with NULL can't be compared, so nullable fields are paginated by offsets
+    keyset = order_field_name is None or not order_field.null
+    query = query.order_by(*(field.desc() if descending else field
+                             for field in ((order_field, id_field) if order_field_name else (id_field,))))
+    offset = 0
+    if page is not None:
+        offset = (max(page, 1) - 1) * limit
+    elif cursor is not None and not keyset:
+        # The token of an offset is the only non-negative number
+        if len(cursor) != 1 or cursor[0] < 0:
+            abort(400)
+        offset = cursor[0]
+    elif cursor is not None:
+        if len(cursor) != (2 if order_field_name else 1):
+            abort(400)
+        after = (id_field < cursor[-1]) if descending else (id_field > cursor[-1])
+        if order_field_name:
+            value = cursor[0]
+            if not is_cursor_value_valid(order_field, value):
+                abort(400)
+            after = ((order_field < value) if descending else (order_field > value)) | ((order_field == value) & after)
+        query = query.where(after)
+    models = list(query.offset(offset).limit(limit + 1))
+    if query.model is Answer and models:
+        attach_questions(models)
+    if len(models) == 0 and offset == 0 and cursor is None:
+        abort(404)
+    next_token = None
+    if len(models) > limit:
+        models = models[:limit]
+        if page is None:
+            position = get_cursor_position(models[-1], order_field, order_field_name) if keyset else [offset + limit]
+            next_token = encode_cursor(position)
+    result = {
+        "data": [get_model_dict(sm) for sm in models],
+        "next": next_token,
         "count": count,
         "limit": limit
     }
+    if page is not None:
+        result["page"] = page
+        result["pages"] = math.ceil(count / limit) if count is not None else None
+    return result
@@ -17,7 +17,12 @@ logger = logging.getLogger("antiintuit.config_reader")
 
 class Config:
     ACCOUNTS_COUNT = 300
+    ANSWERS_INSERT_BATCH_SIZE = 100  # Rows in one INSERT (in tests_solver.create_answers)
     ACCOUNT_RESERVE_TIMEOUT = 15  # Minutes
+    CLAIM_TESTS_IN_DATABASE = False  # Tests are claimed by the database instead of the Session Queue
+    COMPLETE_TEST_ATTEMPTS = 3  # Attempts in a row without new questions before a test can be complete
+    COURSES_FULL_SCAN_INTERVAL = 60 * 24 * 7  # Minutes (other scans stop at a page of known courses)
+    COURSE_MAX_SCAN_INTERVAL = 60 * 24 * 240  # Minutes (scans of courses without changes are postponed up to it)
     COURSE_SCAN_INTERVAL = 60 * 24 * 15  # Minutes
     DATABASE_HOST = None
     DATABASE_NAME = "database.db"
@@ -26,20 +31,26 @@ class Config:
     DATABASE_TYPE = "SQLite"
     DATABASE_USER = None
     DEFAULT_API_LIST_LIMIT = 20
+    IMAGE_REVALIDATE_INTERVAL = 60 * 24 * 30  # Minutes (older images are revalidated by conditional requests)
     INTERVAL_BETWEEN_QUESTIONS = 7  # Seconds (in tests_solver.wait_timeout)
     INTERVAL_BETWEEN_SESSION_CHECK = 5  # Seconds (in tests_solver.get_or_create_question)
     INTUIT_SSL_VERIFY = True
     GRAYLOG_HOST = None
     LATENCY_STEP_INCREASE_BETWEEN_SIMILAR_QUESTIONS = 10  # seconds
+    LAZY_ANSWERS_GENERATION = False  # Answers of new questions are recorded only when they are needed
     MAX_ACCOUNT_AGE = 60 * 24 * 1000  # Minutes
     MAX_API_LIST_LIMIT = 50
     MAX_ITERATIONS_OF_RECEIVING_QUESTIONS = 10  # tests_solver.get_passed_questions_and_answers
     MAX_LATENCY_FOR_OUT_OF_SYNC = 30  # Seconds
-    MAX_LATENCY_FOR_SESSION_CHECKS = 300  # Seconds (after this time question will be forcibly selected)
+    METRICS_PORT = None  # Port of the Prometheus metrics endpoint (metrics aren't collected if it isn't set)
+    QUESTION_LOCK_LEASE = 300  # Seconds (a lock of question expires if the session doesn't extend it)
     SESSION_ID = sha3_256(urandom(256)).hexdigest()
+    SESSION_QUEUE_CONNECT_ATTEMPTS = 5  # Attempts with exponential backoff (in queue_solution.QueueClient.connect)
+    SESSION_QUEUE_CONNECT_TIMEOUT = 5  # Seconds
     STATIC_DIRECTORY = "static"
     TEST_SCAN_INTERVAL = 900  # Seconds
     TEST_SOLVER_SESSION_QUEUE_HOST = None
+    THUMBNAIL_SIZE = None  # Pixels (thumbnails of larger images are made if it's set and Pillow is installed)
     WEBSITE = "https://www.intuit.ru"
 
     @staticmethod
@@ -72,6 +83,21 @@ class Config:
         """Returns datetime which contains a moment of the course update timeout"""
         return sub_timedelta(timedelta(minutes=cls.COURSE_SCAN_INTERVAL))
 
+    @classmethod
+    def get_question_lock_lease_out_moment(cls) -> datetime:
+        """Returns datetime which contains a moment of the question lock expiration"""
+        return sub_timedelta(timedelta(seconds=cls.QUESTION_LOCK_LEASE))
+
+    @classmethod
+    def get_courses_full_scan_timeout_moment(cls) -> datetime:
+        """Returns datetime which contains a moment of the full scan of courses pages timeout"""
+        return sub_timedelta(timedelta(minutes=cls.COURSES_FULL_SCAN_INTERVAL))
+
+    @classmethod
+    def get_image_revalidate_moment(cls) -> datetime:
+        """Returns datetime which contains a moment of the image revalidation timeout"""
+        return sub_timedelta(timedelta(minutes=cls.IMAGE_REVALIDATE_INTERVAL))
+
     @classmethod
     def get_test_scan_timeout_moment(cls) -> datetime:
         """Returns datetime a moment of the timeout gone"""
@@ -1,2 +1,5 @@
 from antiintuit.database.exceptions import *
+from antiintuit.database.notifications import *
 from antiintuit.database.tables import *
+from antiintuit.database.migrations import *
+from antiintuit.database.query_plans import *
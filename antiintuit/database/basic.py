@@ -66,4 +66,9 @@ class VariantsModel(BaseModel):
     @variants.setter
     def variants(self, variants: list):
         """Writes variants from list of handled text variants"""
-        self._variants = ujson.dumps(variants, ensure_ascii=False)
+        self._variants = self.dump_variants(variants)
+
+    @staticmethod
+    def dump_variants(variants: list) -> str:
+        """Returns variants as JSON text which is written in the variants field"""
+        return ujson.dumps(variants, ensure_ascii=False)
@@ -0,0 +1,261 @@
+from datetime import datetime, timedelta
+
+from peewee import CharField, DateTimeField, Entity, IntegerField, MySQLDatabase, PostgresqlDatabase, fn
+from playhouse.migrate import SchemaMigrator, make_index_name, migrate
+
+from antiintuit.database.basic import BaseModel
+from antiintuit.config import Config
+from antiintuit.database.tables import (Account, Answer, Course, DeletedAccount, Image, JobState, Question, Subscribe,
+                                       Test, TestQuestion)
+from antiintuit.images_store import move_flat_images_to_shards
+from antiintuit.logger import get_logger
+
+__all__ = [
+    "SchemaVersion",
+    "migrate_database",
+    "migrate_answers_to_bitmask",
+    "migrate_answers_cursor",
+    "migrate_questions_state",
+    "add_hot_queries_indexes",
+    "migrate_tests_priority",
+    "migrate_accounts_counters",
+    "add_jobs_state",
+    "migrate_courses_scans_schedule",
+    "add_tests_questions",
+    "add_images_index",
+    "move_images_to_shards",
+    "migrate_tests_completeness"
+]
+
+logger = get_logger("antiintuit", "database", "migrations")
+
+
+class SchemaVersion(BaseModel):
+    version = IntegerField(unique=True)
+    name = CharField()
+    applied_at = DateTimeField(default=datetime.utcnow)
+
+
+def get_column_names(model) -> list:
+    """Returns names of the columns which the model table has in database"""
+    return [column.name for column in model._meta.database.get_columns(model._meta.table_name)]
+
+
+def add_missing_columns(model, *fields) -> int:
+    """Adds columns of the fields which the model table doesn't have and returns the number of added ones"""
+    database, table_name = model._meta.database, model._meta.table_name
+    column_names = get_column_names(model)
+    missing_fields = [field for field in fields if field.column_name not in column_names]
+    if missing_fields:
+        migrator = SchemaMigrator.from_database(database)
+        with database.atomic():
+            migrate(*[migrator.add_column(table_name, field.column_name, field) for field in missing_fields])
+        logger.info("Columns %s have been added in '%s' table.",
+                    ", ".join(map(lambda f: "'{}'".format(f.column_name), missing_fields)), table_name)
+    return len(missing_fields)
+
+
+def add_index_online(model, *fields) -> bool:
+    """Creates an index of the fields without locking of the table writing if the index doesn't exist.
+    Returns True if the index has been created."""
+    database, table_name = model._meta.database, model._meta.table_name
+    columns = [field.column_name for field in fields]
+    index_name = make_index_name(table_name, columns)
+    if index_name in (index.name for index in database.get_indexes(table_name)):
+        return False
+
+    def quote(name):
+        return database.get_sql_context().sql(Entity(name)).query()[0]
+
+    columns_sql = ", ".join(map(quote, columns))
+    if isinstance(database, PostgresqlDatabase):
+        # CONCURRENTLY can't be executed inside a transaction
+        sql = "CREATE INDEX CONCURRENTLY {} ON {} ({})"
+    elif isinstance(database, MySQLDatabase):
+        sql = "CREATE INDEX {} ON {} ({}) ALGORITHM=INPLACE LOCK=NONE"
+    else:
+        sql = "CREATE INDEX {} ON {} ({})"
+    database.execute_sql(sql.format(quote(index_name), quote(table_name), columns_sql))
+    logger.info("Index '%s' has been created.", index_name)
+    return True
+
+
+def drop_index_if_exists(model, *fields) -> bool:
+    """Drops the index of the fields if it exists. Returns True if the index has been dropped."""
+    database, table_name = model._meta.database, model._meta.table_name
+    index_name = make_index_name(table_name, [field.column_name for field in fields])
+    if index_name not in (index.name for index in database.get_indexes(table_name)):
+        return False
+    migrate(SchemaMigrator.from_database(database).drop_index(table_name, index_name))
+    logger.info("Index '%s' has been dropped.", index_name)
+    return True
+
+
+def migrate_database():
+    """Executes migrations of the database which haven't been applied yet"""
+    if not SchemaVersion.table_exists():
+        SchemaVersion.create_table()
+    applied_versions = set(version for version, in SchemaVersion.select(SchemaVersion.version).tuples())
+    for version, migration in enumerate(migrations, 1):
+        if version in applied_versions:
+            continue
+        logger.info("Migration %i (%s) will be applied.", version, migration.__name__)
+        migration()
+        SchemaVersion.create(version=version, name=migration.__name__)
+    logger.info("Database schema has version %i.", len(migrations))
+
+
+def migrate_answers_to_bitmask(batch_size: int = 500):
+    """Adds the mask column in the answer table and converts answers of single and multiple questions to bitmasks"""
+    database, table_name = Answer._meta.database, Answer._meta.table_name
+    if add_missing_columns(Answer, Answer.mask):
+        migrate(SchemaMigrator.from_database(database).drop_not_null(table_name, Answer._variants.column_name))
+    converted_count, freed_size = 0, 0
+    # Columns are selected explicitly because the tables may not have columns of the next migrations yet
+    questions = (Question
+                 .select(Question.id, Question.task_id, Question.type, Question.title, Question._variants)
+                 .where(Question.type.in_(("single", "multiple"))))
+    for question in questions.iterator():
+        answers = list(Answer
+                       .select(Answer.id, Answer._variants, Answer.mask)
+                       .where((Answer.question == question) & Answer.mask.is_null()))
+        if not answers:
+            continue
+        variants_size = sum(len(answer._variants) for answer in answers)
+        try:
+            for answer in answers:
+                answer.mask = question.get_mask_by_variants(answer.get_variants())
+                answer._variants = None
+        except KeyError:
+            logger.warning("Answers of '%s' question have variants which the question doesn't have. "
+                           "They will not be converted.", str(question))
+            continue
+        with database.atomic():
+            Answer.bulk_update(answers, [Answer.mask, Answer._variants], batch_size)
+        converted_count, freed_size = converted_count + len(answers), freed_size + variants_size
+    logger.info("%i answers have been converted to bitmasks (%i bytes of variants text are freed).",
+                converted_count, freed_size)
+
+
+def migrate_answers_cursor():
+    """Adds columns of the lazy answers recording"""
+    add_missing_columns(Question, Question.answers_cursor, Question._eliminated_candidates)
+    add_missing_columns(Answer, Answer.candidate_index)
+
+
+def migrate_questions_state():
+    """Adds columns of the maintained answers state of questions. The values are filled by the consistency checker"""
+    add_missing_columns(Question, Question.right_answer_id, Question.unchecked_count, Question.wrong_count)
+
+
+def add_hot_queries_indexes():
+    """Creates indexes which are used by frequent queries of the jobs and the API"""
+    add_index_online(Answer, Answer.question, Answer.status)
+    add_index_online(Question, Question.locked_by)
+    add_index_online(Question, Question.locked_at)
+    add_index_online(Test, Test.watcher, Test.unsolvable, Test.last_scan_at)
+    add_index_online(Test, Test.last_scan_at, Test.course)
+    add_index_online(Account, Account.reserved_until)
+    add_index_online(Subscribe, Subscribe.account, Subscribe.course)
+
+
+def migrate_tests_priority():
+    """Adds the stored priority of tests and the moment since tests of courses can be solved"""
+    add_missing_columns(Test, Test.priority)
+    add_missing_columns(Course, Course.next_eligible_at)
+    # The same formula as Test.update_priority
+    priorities_count = Test.update({Test.priority: (Test.average_rating + Test.last_rating + Test.max_rating) * 5 +
+                                                   Test.passed_count * 3 + Test.not_passed_count}).execute()
+    logger.info("Priorities of %i tests have been calculated.", priorities_count)
+    last_scans = (Test
+                  .select(Test.course, fn.MAX(Test.last_scan_at))
+                  .where(Test.last_scan_at > Config.get_test_scan_timeout_moment())
+                  .group_by(Test.course)
+                  .tuples())
+    for course_id, last_scan_at in last_scans:
+        if isinstance(last_scan_at, str):
+            last_scan_at = Test.last_scan_at.python_value(last_scan_at)
+        next_eligible_at = last_scan_at + timedelta(seconds=Config.TEST_SCAN_INTERVAL)
+        Course.update({Course.next_eligible_at: next_eligible_at}).where(Course.id == course_id).execute()
+    add_index_online(Course, Course.next_eligible_at)
+    add_index_online(Test, Test.priority, Test.max_rating, Test.average_rating, Test.last_scan_at, Test.created_at)
+
+
+def migrate_accounts_counters():
+    """Adds columns of the maintained counters of accounts. The values are filled by the consistency checker"""
+    for model in (Account, DeletedAccount):
+        add_missing_columns(model, model.subscriptions_count, model.watched_tests_count)
+    add_index_online(Account, Account.subscriptions_count, Account.reserved_until)
+    add_index_online(Account, Account.watched_tests_count, Account.reserved_until)
+
+
+def add_jobs_state():
+    """Creates the table of values which jobs keep between runs"""
+    if not JobState.table_exists():
+        JobState.create_table()
+        logger.info("Model '%s' has been created.", JobState.__name__)
+
+
+def migrate_courses_scans_schedule(batch_size: int = 500):
+    """Adds columns of the scans schedule of courses and schedules the next scans by the last ones"""
+    add_missing_columns(Course, Course.next_scan_at, Course.scan_interval)
+    courses = list(Course.select(Course.id, Course.last_scan_at).where(Course.scan_interval == 0))
+    for course in courses:
+        course.scan_interval = Config.COURSE_SCAN_INTERVAL
+        course.next_scan_at = course.last_scan_at + timedelta(minutes=Config.COURSE_SCAN_INTERVAL)
+    with Course._meta.database.atomic():
+        Course.bulk_update(courses, [Course.scan_interval, Course.next_scan_at], batch_size)
+    logger.info("Next scans of %i courses have been scheduled.", len(courses))
+
+
+def add_tests_questions():
+    """Creates the table of questions met in tests and adds the completeness of tests.
+    Tests are complete only after their questions are met again, so they are solved as before until then."""
+    if not TestQuestion.table_exists():
+        TestQuestion.create_table()
+        logger.info("Model '%s' has been created.", TestQuestion.__name__)
+    add_missing_columns(Test, Test.completeness)
+
+
+def add_images_index():
+    """Creates the index of downloaded images. Images which are already downloaded are indexed when they are
+    met again"""
+    if not Image.table_exists():
+        Image.create_table()
+        logger.info("Model '%s' has been created.", Image.__name__)
+
+
+def move_images_to_shards():
+    """Moves downloaded images from the root of the static directory to subdirectories by prefixes of their names"""
+    moved_count = move_flat_images_to_shards()
+    logger.info("%i images have been moved to shards.", moved_count)
+
+
+def migrate_tests_completeness():
+    """Adds the number of attempts of tests without new questions and recalculates complete tests, because they
+    become complete only after such attempts. Tests are selected by the completeness first."""
+    add_missing_columns(Test, Test.attempts_without_new_questions)
+    complete_tests = list(Test.select().where(Test.completeness >= 1))
+    for test in complete_tests:
+        test.update_completeness()
+    logger.info("Completeness of %i complete tests has been recalculated.", len(complete_tests))
+    add_index_online(Test, Test.completeness, Test.priority, Test.max_rating, Test.average_rating, Test.last_scan_at,
+                     Test.created_at)
+    drop_index_if_exists(Test, Test.priority, Test.max_rating, Test.average_rating, Test.last_scan_at, Test.created_at)
+
+
+# The order can't be changed: the version of a migration is its position in the list
+migrations = [
+    migrate_answers_to_bitmask,
+    migrate_answers_cursor,
+    migrate_questions_state,
+    add_hot_queries_indexes,
+    migrate_tests_priority,
+    migrate_accounts_counters,
+    add_jobs_state,
+    migrate_courses_scans_schedule,
+    add_tests_questions,
+    add_images_index,
+    move_images_to_shards,
+    migrate_tests_completeness
+]
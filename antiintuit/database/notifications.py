@@ -0,0 +1,70 @@
+import select
+from time import perf_counter, sleep
+
+from peewee import PostgresqlDatabase
+
+from antiintuit.config import Config
+from antiintuit.database.basic import BaseModel
+from antiintuit.logger import get_logger
+
+__all__ = [
+    "QUESTIONS_UNLOCK_CHANNEL",
+    "is_notifications_supported",
+    "notify_questions_unlock",
+    "wait_questions_unlock"
+]
+
+logger = get_logger("antiintuit", "database", "notifications")
+QUESTIONS_UNLOCK_CHANNEL = "antiintuit_questions_unlock"
+listener_connection = None
+
+
+def is_notifications_supported() -> bool:
+    """Returns True if the database can deliver notifications (only Postgres LISTEN/NOTIFY is supported)"""
+    return isinstance(BaseModel._meta.database, PostgresqlDatabase)
+
+
+def notify_questions_unlock(session_id: str):
+    """Notifies waiting sessions that the session has released its questions ("*" means all sessions)"""
+    if is_notifications_supported():
+        BaseModel._meta.database.execute_sql("SELECT pg_notify(%s, %s)", (QUESTIONS_UNLOCK_CHANNEL, session_id))
+
+
+def get_listener_connection():
+    """Returns the connection which listens the unlock channel and True if it has been just created"""
+    global listener_connection
+    if listener_connection is not None and not listener_connection.closed:
+        return listener_connection, False
+    # The listener has its own connection in the autocommit mode because notifications are delivered only between
+    # transactions
+    listener_connection = BaseModel._meta.database._connect()
+    listener_connection.autocommit = True
+    with listener_connection.cursor() as cursor:
+        cursor.execute("LISTEN " + QUESTIONS_UNLOCK_CHANNEL)
+    logger.debug("Session '%s' listens '%s' channel.", Config.SESSION_ID, QUESTIONS_UNLOCK_CHANNEL)
+    return listener_connection, True
+
+
+def wait_questions_unlock(session_id: str, timeout: float) -> bool:
+    """Waits until the session releases its questions, but not longer than timeout seconds.
+    Returns True if the notification has been received and a question has to be read again.
+    Without notifications support it sleeps INTERVAL_BETWEEN_SESSION_CHECK seconds (polling)."""
+    timeout = max(timeout, 0)
+    if not is_notifications_supported():
+        sleep(min(Config.INTERVAL_BETWEEN_SESSION_CHECK, timeout))
+        return False
+    connection, is_new = get_listener_connection()
+    if is_new:
+        # A question could be unlocked before the listening was started
+        return True
+    deadline = perf_counter() + timeout
+    while True:
+        connection.poll()
+        while connection.notifies:
+            notify = connection.notifies.pop(0)
+            if notify.payload in (session_id, "*"):
+                return True
+        time_left = deadline - perf_counter()
+        if time_left <= 0:
+            return False
+        select.select([connection], [], [], time_left)
@@ -0,0 +1,42 @@
+import re
+
+from peewee import MySQLDatabase, PostgresqlDatabase
+
+__all__ = [
+    "explain_query",
+    "get_full_scans"
+]
+
+
+def explain_query(query) -> list:
+    """Returns the plan of the query as list of strings (one string for one step)"""
+    database = query.model._meta.database
+    sql, params = query.sql()
+    if isinstance(database, MySQLDatabase):
+        cursor = database.execute_sql("EXPLAIN " + sql, params)
+        columns = [column[0] for column in cursor.description]
+        steps = [dict(zip(columns, row)) for row in cursor.fetchall()]
+        return ["{} type={} key={}".format(step["table"], step["type"], step["key"]) for step in steps]
+    elif isinstance(database, PostgresqlDatabase):
+        cursor = database.execute_sql("EXPLAIN " + sql, params)
+        return [row[0] for row in cursor.fetchall()]
+    else:
+        cursor = database.execute_sql("EXPLAIN QUERY PLAN " + sql, params)
+        return [row[-1] for row in cursor.fetchall()]
+
+
+def get_full_scans(query) -> list:
+    """Returns names of the tables which are read by the query with the full scan"""
+    database = query.model._meta.database
+    if isinstance(database, MySQLDatabase):
+        pattern = r"^(?P<table>\S+) type=ALL "
+    elif isinstance(database, PostgresqlDatabase):
+        pattern = r"Seq Scan on (?P<table>\S+)"
+    else:
+        pattern = r"^SCAN (TABLE )?(?P<table>\w+)( AS \w+)?$"
+    full_scans = list()
+    for step in explain_query(query):
+        matches = re.search(pattern, step.strip())
+        if matches is not None:
+            full_scans.append(matches.group("table"))
+    return full_scans
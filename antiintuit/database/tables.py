@@ -1,11 +1,13 @@
 from datetime import datetime, timedelta
 
+import ujson
 from peewee import (CharField, ForeignKeyField, TextField, DateTimeField,
-                    BooleanField, DateField, IntegerField)
+                    BooleanField, DateField, IntegerField, BigIntegerField, FloatField, fn)
 
 from antiintuit.basic import sub_timedelta
 from antiintuit.config import Config
 from antiintuit.database.basic import BaseModel, VariantsModel
+from antiintuit.database.notifications import notify_questions_unlock
 from antiintuit.logger import get_logger
 
 __all__ = [
@@ -16,6 +18,9 @@ __all__ = [
     "Test",
     "Question",
     "Answer",
+    "TestQuestion",
+    "JobState",
+    "Image",
     "create_tables"
 ]
 
@@ -27,7 +32,15 @@ class Account(BaseModel):
     last_name = CharField()
     email = CharField()
     password = CharField()
-    reserved_until = DateTimeField(default=datetime(1, 1, 1))
+    reserved_until = DateTimeField(default=datetime(1, 1, 1), index=True)
+    subscriptions_count = IntegerField(default=0, help_text="The field contains the number of subscribed courses")
+    watched_tests_count = IntegerField(default=0, help_text="The field contains the number of watched tests")
+
+    class Meta:
+        indexes = (
+            (("subscriptions_count", "reserved_until"), False),
+            (("watched_tests_count", "reserved_until"), False),
+        )
 
     @property
     def describe(self) -> str:
@@ -38,9 +51,21 @@ class Account(BaseModel):
             self.reserved_until = datetime.utcnow()
             self.save()
 
+    def add_to_counters(self, subscriptions_delta: int = 0, watched_tests_delta: int = 0):
+        """Changes the numbers of subscribed courses and watched tests of the account"""
+        values = dict()
+        for field, delta in ((Account.subscriptions_count, subscriptions_delta),
+                             (Account.watched_tests_count, watched_tests_delta)):
+            if delta:
+                values[field] = field + delta
+                setattr(self, field.name, getattr(self, field.name) + delta)
+        if values and self.get_id() is not None:
+            Account.update(values).where(Account.id == self.id).execute()
+
     def delete_instance(self, database_only=False, recursive=False, delete_nullable=False):
         Subscribe.delete().where(Subscribe.account == self).execute()
         Test.update({Test.watcher: None}).where(Test.watcher == self).execute()
+        self.subscriptions_count, self.watched_tests_count = 0, 0
         DeletedAccount.create_from_account(self, not database_only)
         super().delete_instance(recursive, delete_nullable)
 
@@ -60,6 +85,11 @@ class Course(BaseModel):
     title = CharField()
     published_on = DateField()
     last_scan_at = DateTimeField(default=datetime(1, 1, 1))
+    next_eligible_at = DateTimeField(default=datetime(1, 1, 1), index=True,
+                                     help_text="The field contains a moment since tests of the course can be solved")
+    next_scan_at = DateTimeField(default=datetime(1, 1, 1), index=True,
+                                 help_text="The field contains a moment since tests of the course can be scanned")
+    scan_interval = IntegerField(default=0, help_text="The field contains minutes between scans of the course tests")
 
     @property
     def publish_id_numbers(self):
@@ -73,8 +103,15 @@ class Course(BaseModel):
     def describe(self) -> str:
         return "[{}][{}] {}".format(self.id, self.publish_id, self.title)
 
-    def update_last_scan(self):
+    def update_last_scan(self, has_changes: bool = True):
+        """Updates the last scan time and schedules the next scan. The interval between scans is doubled (up to
+        COURSE_MAX_SCAN_INTERVAL) while scans don't find changes and is reset to COURSE_SCAN_INTERVAL otherwise."""
         self.last_scan_at = datetime.utcnow()
+        if has_changes or self.scan_interval == 0:
+            self.scan_interval = Config.COURSE_SCAN_INTERVAL
+        else:
+            self.scan_interval = min(self.scan_interval * 2, Config.COURSE_MAX_SCAN_INTERVAL)
+        self.next_scan_at = self.last_scan_at + timedelta(minutes=self.scan_interval)
         self.save()
 
 
@@ -82,6 +119,11 @@ class Subscribe(BaseModel):
     account = ForeignKeyField(Account, backref="subscriptions")
     course = ForeignKeyField(Course, backref="subscriptions")
 
+    class Meta:
+        indexes = (
+            (("account", "course"), False),
+        )
+
 
 class Test(BaseModel):
     publish_id = CharField(unique=True)
@@ -96,6 +138,19 @@ class Test(BaseModel):
     last_rating = IntegerField(default=0)
     max_rating = IntegerField(default=0)
     unsolvable = BooleanField(default=False)
+    priority = IntegerField(default=0, help_text="The field contains the passing score of the test. "
+                                                 "Tests with the lower score are solved first")
+    completeness = FloatField(default=0, help_text="The field contains the fraction of the test questions which "
+                                                   "have right answers. Complete tests are solved last")
+    attempts_without_new_questions = IntegerField(default=0, help_text="The field contains the number of the last "
+                                                                       "attempts which haven't met new questions")
+
+    class Meta:
+        indexes = (
+            (("watcher", "unsolvable", "last_scan_at"), False),
+            (("last_scan_at", "course"), False),
+            (("completeness", "priority", "max_rating", "average_rating", "last_scan_at", "created_at"), False),
+        )
 
     @property
     def publish_id_numbers(self):
@@ -115,8 +170,15 @@ class Test(BaseModel):
         return self.passed_count + self.not_passed_count
 
     def update_last_update(self):
+        """Updates the last update time of the test and postpones solving of tests of its course"""
         self.last_scan_at = datetime.utcnow()
         self.save()
+        next_eligible_at = self.last_scan_at + timedelta(seconds=Config.TEST_SCAN_INTERVAL)
+        Course.update({Course.next_eligible_at: next_eligible_at}).where(Course.id == self.course_id).execute()
+
+    def update_priority(self):
+        self.priority = ((self.average_rating + self.last_rating + self.max_rating) * 5 +
+                         self.passed_count * 3 + self.not_passed_count)
 
     def update_stats(self, passed, grade):
         """Updates the average rating, amount of the passes and the last update time"""
@@ -131,18 +193,46 @@ class Test(BaseModel):
             self.passed_count += 1
         else:
             self.not_passed_count += 1
+        self.update_priority()
         self.update_last_update()
         logger.debug("'%s' test has been updated (average rating: %i, passed tests: %i, not passed tests %i).",
                      str(self), self.average_rating, self.passed_count, self.not_passed_count)
 
-    def set_watcher(self, watcher: Account):
+    def update_completeness(self):
+        """Updates the fraction of known questions by questions which have been met in the test.
+        Attempts draw questions from a larger pool, so until COMPLETE_TEST_ATTEMPTS attempts in a row haven't met
+        new questions the test is supposed to have one more question than have been met."""
+        known_count, met_count = (TestQuestion
+                                  .select(fn.COUNT(Question.right_answer_id), fn.COUNT(TestQuestion.id))
+                                  .join(Question)
+                                  .where(TestQuestion.test == self)
+                                  .tuples()
+                                  .get())
+        questions_count = max(met_count, self.questions_count, 1)
+        if self.attempts_without_new_questions < Config.COMPLETE_TEST_ATTEMPTS:
+            questions_count = max(questions_count, met_count + 1)
+        self.completeness = known_count / questions_count
+        (Test
+         .update({Test.completeness: self.completeness,
+                  Test.attempts_without_new_questions: self.attempts_without_new_questions})
+         .where(Test.id == self.id)).execute()
+
+    def set_watcher(self, watcher: Account or None):
+        previous_watcher_id = self.watcher_id
         self.watcher = watcher
         self.save()
+        if previous_watcher_id == self.watcher_id:
+            return
+        if previous_watcher_id is not None:
+            (Account
+             .update({Account.watched_tests_count: Account.watched_tests_count - 1})
+             .where(Account.id == previous_watcher_id)).execute()
+        if watcher is not None:
+            watcher.add_to_counters(watched_tests_delta=1)
 
     def set_as_unsolvable(self):
         self.unsolvable = True
-        self.watcher = None
-        self.save()
+        self.set_watcher(None)
 
 
 class Question(VariantsModel):
@@ -151,47 +241,173 @@ class Question(VariantsModel):
     last_update_at = DateTimeField(default=datetime(1, 1, 1))
     type = CharField()
     course = ForeignKeyField(Course, backref="questions")
-    locked_by = CharField(null=True, default=None)
-    locked_at = DateTimeField(default=None, null=True)
+    locked_by = CharField(null=True, default=None, index=True)
+    locked_at = DateTimeField(default=None, null=True, index=True)
     original_html = TextField(default=None)
+    answers_cursor = IntegerField(null=True, default=None,
+                                  help_text="The field contains an index of the next answer candidate which isn't "
+                                            "recorded yet. It's empty if all answers of the question are recorded")
+    _eliminated_candidates = TextField(null=True, default=None,
+                                       help_text="The field contains a list of indexes of wrong candidates in JSON")
+    right_answer_id = IntegerField(null=True, default=None, help_text="The field contains id of the right answer")
+    unchecked_count = IntegerField(default=0, help_text="The field contains the number of unchecked answers "
+                                                        "including not recorded candidates")
+    wrong_count = IntegerField(default=0, help_text="The field contains the number of wrong answers")
 
     @staticmethod
     def unlock_all_session_question():
-        return (Question
-                .update({Question.locked_by: None, Question.locked_at: None})
-                .where(Question.locked_by == Config.SESSION_ID)
-                ).execute()
+        unlocked = (Question
+                    .update({Question.locked_by: None, Question.locked_at: None})
+                    .where(Question.locked_by == Config.SESSION_ID)
+                    ).execute()
+        if unlocked:
+            notify_questions_unlock(Config.SESSION_ID)
+        return unlocked
 
     @property
     def describe(self) -> str:
         return "[{}][{}][{}] {}".format(self.id, self.task_id, self.type, self.title)
 
+    @property
+    def is_lazy(self) -> bool:
+        """Returns True if answers of the question are recorded only when they are needed"""
+        return self.answers_cursor is not None
+
+    @property
+    def eliminated_candidates(self) -> set:
+        """Returns indexes of candidates which are known as wrong answers"""
+        return set(ujson.loads(self._eliminated_candidates or "[]"))
+
+    def reset_answers_cursor(self, candidates_count: int):
+        """Switches the question to recording answers only when they are needed"""
+        self.answers_cursor, self._eliminated_candidates = 0, "[]"
+        self.unchecked_count = candidates_count
+        (Question
+         .update({Question.answers_cursor: self.answers_cursor,
+                  Question._eliminated_candidates: self._eliminated_candidates,
+                  Question.unchecked_count: self.unchecked_count})
+         .where(Question.id == self.id)).execute()
+
+    def move_answers_cursor(self, next_index: int):
+        self.answers_cursor = next_index
+        Question.update({Question.answers_cursor: next_index}).where(Question.id == self.id).execute()
+
+    def eliminate_candidate(self, index: int):
+        eliminated_candidates = self.eliminated_candidates
+        eliminated_candidates.add(index)
+        self._eliminated_candidates = ujson.dumps(sorted(eliminated_candidates))
+        (Question
+         .update({Question._eliminated_candidates: self._eliminated_candidates})
+         .where(Question.id == self.id)).execute()
+        logger.debug("Candidate %i of '%s' question has been eliminated.", index, str(self))
+
+    def get_parsed_variants(self) -> list:
+        """Returns variants which are parsed once for the current value of the field (they mustn't be changed).
+        Masks of all answers of the question are decoded by them."""
+        parsed_variants = self.__dict__.get("_parsed_variants")
+        if parsed_variants is None or parsed_variants[0] is not self._variants:
+            parsed_variants = self._parsed_variants = (self._variants, self.variants)
+        return parsed_variants[1]
+
+    def get_variants_by_mask(self, mask: int) -> list:
+        """Returns the question variants selected by bits of the mask"""
+        return [list(variant) for index, variant in enumerate(self.get_parsed_variants()) if mask >> index & 1]
+
+    def get_mask_by_variants(self, variants: list) -> int:
+        """Returns the bitmask of the question variants (compares them by an input name and a value)"""
+        indexes = {tuple(variant[:2]): index for index, variant in enumerate(self.get_parsed_variants())}
+        mask = 0
+        for variant in variants:
+            mask |= 1 << indexes[tuple(variant[:2])]
+        return mask
+
     @property
     def is_right_answer_exists(self) -> bool:
-        return Answer.select().where((Answer.question == self) & (Answer.status == "R")).count() == 1
+        return self.right_answer_id is not None
 
     @property
     def unchanged_answers_count(self) -> int:
-        return Answer.select().where((Answer.question == self) & (Answer.status == "U")).count()
+        return self.unchecked_count
+
+    def add_unchecked_answers(self, answers_count: int):
+        self.unchecked_count += answers_count
+        (Question
+         .update({Question.unchecked_count: Question.unchecked_count + answers_count})
+         .where(Question.id == self.id)).execute()
+
+    def change_answer_status(self, answer, previous_status: str):
+        """Updates the answers state of the question after the status of the answer has been changed"""
+        counters_fields, values = {"U": Question.unchecked_count, "W": Question.wrong_count}, dict()
+        for status, delta in ((previous_status, -1), (answer.status, 1)):
+            if status in counters_fields:
+                field = counters_fields[status]
+                values[field] = field + delta
+                setattr(self, field.name, getattr(self, field.name) + delta)
+        if answer.status == "R":
+            values[Question.right_answer_id] = self.right_answer_id = answer.id
+        if values:
+            Question.update(values).where(Question.id == self.id).execute()
+        if previous_status == "R":
+            (Question
+             .update({Question.right_answer_id: None})
+             .where((Question.id == self.id) & (Question.right_answer_id == answer.id))).execute()
+            if self.right_answer_id == answer.id:
+                self.right_answer_id = None
 
-    def lock(self):
-        self2 = Question.get_by_id(self.id)
-        if self2.locked_by is None:
-            self.locked_by = Config.SESSION_ID
-            self.locked_at = datetime.utcnow()
-            self.save()
+    @property
+    def lock_expires_at(self) -> datetime or None:
+        """Returns the moment when the lease of the question lock expires"""
+        if self.locked_by is None or self.locked_at is None:
+            return None
+        return self.locked_at + timedelta(seconds=Config.QUESTION_LOCK_LEASE)
+
+    @property
+    def is_locked_by_another(self) -> bool:
+        """Returns True if the question is locked by another session and the lease isn't expired"""
+        return (self.locked_by not in (None, Config.SESSION_ID) and
+                self.lock_expires_at is not None and self.lock_expires_at > datetime.utcnow())
+
+    def lock(self) -> bool:
+        """Locks the question by the current session if it's unlocked, the lease is expired or it's already locked by
+        the current session. Returns True if the current session holds the lock."""
+        locked_at = datetime.utcnow()
+        locked = (Question
+                  .update({Question.locked_by: Config.SESSION_ID, Question.locked_at: locked_at})
+                  .where((Question.id == self.id) &
+                         (Question.locked_by.is_null() |
+                          (Question.locked_by == Config.SESSION_ID) |
+                          (Question.locked_at < Config.get_question_lock_lease_out_moment())))).execute()
+        if locked:
+            if self.locked_by not in (None, Config.SESSION_ID):
+                logger.warning("The lease of '%s' session on '%s' question is expired.", self.locked_by, str(self))
+            self.locked_by, self.locked_at = Config.SESSION_ID, locked_at
             logger.debug("Question '%s' has been locked by '%s'.", str(self), self.locked_by)
             return True
+        self.locked_by, self.locked_at = (Question
+                                          .select(Question.locked_by, Question.locked_at)
+                                          .where(Question.id == self.id)
+                                          .tuples().get())
         return False
 
-    def unlock(self):
+    def unlock(self) -> bool:
+        """Unlocks the question if it's locked by the current session"""
+        unlocked = (Question
+                    .update({Question.locked_by: None, Question.locked_at: None})
+                    .where((Question.id == self.id) & (Question.locked_by == Config.SESSION_ID))).execute()
         if self.locked_by == Config.SESSION_ID:
-            self.locked_by = None
-            self.locked_at = None
-            self.save()
+            self.locked_by, self.locked_at = None, None
+        if unlocked:
+            notify_questions_unlock(Config.SESSION_ID)
             logger.debug("Question '%s' has been unlocked.", str(self))
-            return True
-        return False
+        return bool(unlocked)
+
+    @staticmethod
+    def extend_session_locks() -> int:
+        """Extends leases of all questions which are locked by the current session (heartbeat).
+        Returns the number of the extended locks."""
+        return (Question
+                .update({Question.locked_at: datetime.utcnow()})
+                .where(Question.locked_by == Config.SESSION_ID)).execute()
 
     @staticmethod
     def unlock_all_questions(age_minutes: int = None):
@@ -204,9 +420,17 @@ class Question(VariantsModel):
                         .update({Question.locked_by: None, Question.locked_at: None})
                         .where(Question.locked_at < age_moment)).execute()
             logger.info("%i old questions (max age: %i) have been unlocked", unlocked, age_minutes)
+        if unlocked:
+            notify_questions_unlock("*")
 
     def delete_answers(self):
         logger.debug("The answers of '%s' question will be deleted.", str(self))
+        self.answers_cursor, self._eliminated_candidates = None, None
+        self.right_answer_id, self.unchecked_count, self.wrong_count = None, 0, 0
+        (Question
+         .update({Question.answers_cursor: None, Question._eliminated_candidates: None,
+                  Question.right_answer_id: None, Question.unchecked_count: 0, Question.wrong_count: 0})
+         .where(Question.id == self.id)).execute()
         return Answer.delete().where(Answer.question == self).execute()
 
     def delete_instance(self, recursive=False, delete_nullable=False):
@@ -215,20 +439,55 @@ class Question(VariantsModel):
         logger.debug("'%s' question has been deleted.", str(self))
 
     def get_next_answer(self):
-        """Returns the first right or unchecked answer of the question"""
+        """Returns the first right or unchecked answer of the question among recorded ones"""
         try:
-            return (Answer
-                    .select()
-                    .where(Answer.question == self)
-                    .order_by(Answer.status).limit(1)).get()
+            if self.right_answer_id is not None:
+                answer = Answer.get_by_id(self.right_answer_id)
+            else:
+                answer = (Answer
+                          .select()
+                          .where(Answer.question == self)
+                          .order_by(Answer.status, Answer.id).limit(1)).get()
         except Answer.DoesNotExist:
             return None
+        answer.question = self
+        return answer
 
 
 class Answer(VariantsModel):
+    _variants = TextField(null=True, help_text="The field contains a dict of variants in JSON as handled text. "
+                                               "It's empty if the answer is stored as mask")
+    mask = BigIntegerField(null=True, help_text="The field contains a bitmask of the question variants "
+                                                "for single and multiple questions")
     status = CharField(max_length=1, default="U",
                        help_text="The field contains a status of the answer. Can be Right(R), Wrong(W) or Unchecked(U)")
     question = ForeignKeyField(Question, backref="answers")
+    candidate_index = IntegerField(null=True, default=None,
+                                   help_text="The field contains an index of the answer among candidates of "
+                                             "the question if the answer has been recorded by the cursor")
+
+    class Meta:
+        indexes = (
+            (("question", "status"), False),
+        )
+
+    @property
+    def variants(self) -> list:
+        """Returns variants as list of handled text variants"""
+        return self.get_variants()
+
+    @variants.setter
+    def variants(self, variants: list):
+        """Writes variants from list of handled text variants"""
+        self.mask = None
+        self._variants = self.dump_variants(variants)
+
+    def get_variants(self, question: Question = None) -> list:
+        """Returns variants and decodes the mask by variants of the question (if it's specified) if necessary"""
+        if self.mask is None:
+            return super().variants
+        question = question or self.question
+        return question.get_variants_by_mask(self.mask)
 
     @property
     def describe(self) -> str:
@@ -236,8 +495,12 @@ class Answer(VariantsModel):
 
     def set_as(self, status: str):
         if status in ("U", "R", "W"):
-            self.status = status
-            self.save()
+            previous_status, question = self.status, self.question
+            with self._meta.database.atomic():
+                self.status = status
+                self.save()
+                if previous_status != status:
+                    question.change_answer_status(self, previous_status)
             logger.debug("The status of '%s' answer set up as '%s'.", str(self), self.status)
 
     def set_as_right(self):
@@ -249,10 +512,64 @@ class Answer(VariantsModel):
             logger.warning("The '%s' answer of the '%s' question in the '%s' course had 'R' status, "
                            "but it will be changed to 'W'.", str(self), str(question), str(question.course))
         self.set_as("W")
+        if self.candidate_index is not None:
+            self.question.eliminate_candidate(self.candidate_index)
+
+
+class TestQuestion(BaseModel):
+    """Questions which have been met in tests"""
+    test = ForeignKeyField(Test, backref="tests_questions")
+    question = ForeignKeyField(Question, backref="tests_questions")
+
+    class Meta:
+        indexes = (
+            (("test", "question"), True),
+        )
+
+
+class JobState(BaseModel):
+    """Values which jobs keep between runs (e.g. marks of incremental scans)"""
+    name = CharField(unique=True)
+    _value = TextField(help_text="The field contains the value in JSON")
+
+    @staticmethod
+    def get_value(name: str, default=None):
+        job_state = JobState.get_or_none(JobState.name == name)
+        return default if job_state is None else ujson.loads(job_state._value)
+
+    @staticmethod
+    def set_value(name: str, value):
+        dumped_value = ujson.dumps(value, ensure_ascii=False)
+        with JobState._meta.database.atomic():
+            if not JobState.update({JobState._value: dumped_value}).where(JobState.name == name).execute():
+                JobState.create(name=name, _value=dumped_value)
+
+
+class Image(BaseModel):
+    """Index of downloaded images by their source URLs"""
+    url = CharField(unique=True)
+    name = CharField(help_text="The field contains the file name in the static directory (the hash of the content)")
+    etag = CharField(null=True, default=None)
+    last_modified = CharField(null=True, default=None)
+    checked_at = DateTimeField(default=datetime.utcnow, help_text="The field contains the moment of the last "
+                                                                  "download or revalidation")
+
+    @property
+    def is_stale(self) -> bool:
+        return self.checked_at < Config.get_image_revalidate_moment()
+
+    def get_conditional_headers(self) -> dict:
+        """Returns headers of the request which revalidates the image"""
+        headers = dict()
+        if self.etag is not None:
+            headers["If-None-Match"] = self.etag
+        if self.last_modified is not None:
+            headers["If-Modified-Since"] = self.last_modified
+        return headers
 
 
 def create_tables():
-    for model in Account, DeletedAccount, Course, Test, Question, Answer, Subscribe:
+    for model in Account, DeletedAccount, Course, Test, Question, Answer, Subscribe, TestQuestion, JobState, Image:
         if not model.table_exists():
             model.create_table()
             logger.info("Model '%s' has been created.", model.__name__)
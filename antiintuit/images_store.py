@@ -0,0 +1,89 @@
+import os
+import re
+from pathlib import Path
+
+from antiintuit.config import Config
+from antiintuit.logger import get_logger
+
+try:
+    from PIL import Image as PillowImage
+except ImportError:
+    # Thumbnails aren't made without Pillow
+    PillowImage = None
+
+__all__ = [
+    "IMAGE_NAME_PATTERN",
+    "get_image_path",
+    "find_image_path",
+    "get_thumbnail_path",
+    "make_thumbnail",
+    "move_flat_images_to_shards"
+]
+
+logger = get_logger("antiintuit", "images_store")
+# Names of images are hashes of their contents with extensions
+IMAGE_NAME_PATTERN = re.compile(r"^[0-9a-f]{64}\.[0-9a-z]*$")
+
+
+def get_sharded_path(directory: Path, name: str) -> Path:
+    """Returns the path of the file in two levels of subdirectories by the prefix of its name (ab/cd/abcd...)"""
+    return directory.joinpath(name[:2], name[2:4], name)
+
+
+def get_image_path(name: str, create_directories: bool = False) -> Path:
+    """Returns the path of the image in the static directory"""
+    path = get_sharded_path(Config.get_static_directory_path(), name)
+    if create_directories:
+        path.parent.mkdir(parents=True, exist_ok=True)
+    return path
+
+
+def find_image_path(name: str) -> Path or None:
+    """Returns the path of the existing image or None. Images which haven't been moved to shards yet are found too."""
+    if IMAGE_NAME_PATTERN.match(name) is None:
+        return None
+    for path in get_image_path(name), Config.get_static_directory_path().joinpath(name):
+        if path.is_file():
+            return path
+    return None
+
+
+def get_thumbnail_path(name: str) -> Path:
+    return get_sharded_path(Config.get_static_directory_path().joinpath("thumbnails"), name)
+
+
+def make_thumbnail(name: str) -> Path or None:
+    """Makes the thumbnail of the image if thumbnails are enabled and the image is larger than THUMBNAIL_SIZE.
+    Returns the path of the thumbnail or None if the image doesn't need it."""
+    if Config.THUMBNAIL_SIZE is None or PillowImage is None:
+        return None
+    thumbnail_path = get_thumbnail_path(name)
+    if thumbnail_path.exists():
+        return thumbnail_path
+    try:
+        with PillowImage.open(str(get_image_path(name))) as image:
+            if max(image.size) <= Config.THUMBNAIL_SIZE:
+                return None
+            image_format = image.format
+            image.thumbnail((Config.THUMBNAIL_SIZE, Config.THUMBNAIL_SIZE))
+            thumbnail_path.parent.mkdir(parents=True, exist_ok=True)
+            temp_path = thumbnail_path.with_name("." + thumbnail_path.name)
+            image.save(str(temp_path), format=image_format)
+    except (OSError, ValueError) as ex:
+        logger.warning("Thumbnail of image '%s' can't be made: %s", name, str(ex))
+        return None
+    os.replace(str(temp_path), str(thumbnail_path))
+    logger.debug("Thumbnail of image '%s' has been made.", name)
+    return thumbnail_path
+
+
+def move_flat_images_to_shards() -> int:
+    """Moves images from the root of the static directory to shards and returns the number of moved images"""
+    with os.scandir(str(Config.get_static_directory_path())) as entries:
+        # The directory isn't changed while it's being read
+        images_entries = [entry for entry in entries
+                          if entry.is_file() and IMAGE_NAME_PATTERN.match(entry.name) is not None]
+    for entry in images_entries:
+        os.replace(entry.path, str(get_image_path(entry.name, create_directories=True)))
+        make_thumbnail(entry.name)
+    return len(images_entries)
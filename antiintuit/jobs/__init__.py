@@ -1 +1 @@
-from antiintuit.jobs import accounts_manager, courses_manager, tests_manager, tests_solver
+from antiintuit.jobs import accounts_manager, consistency_checker, courses_manager, tests_manager, tests_solver
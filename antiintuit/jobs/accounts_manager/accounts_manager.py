@@ -4,7 +4,6 @@ from random import randint
 from time import sleep
 
 import requests
-from bs4 import BeautifulSoup
 
 from antiintuit.basic import get_session
 from antiintuit.config import Config
@@ -12,6 +11,7 @@ from antiintuit.database import Account, DeletedAccount
 from antiintuit.jobs.accounts_manager.exceptions import *
 from antiintuit.jobs.accounts_manager.temp_mailbox import get_random_mailbox, TempMailBoxException
 from antiintuit.logger import exception, get_logger
+from antiintuit.parsing import find_element, parse_html
 
 __all__ = [
     "get_authorized_session",
@@ -93,8 +93,7 @@ def get_random_password(size=None) -> str:
 def get_form_hidden_data(session: requests.Session, url, form_id) -> dict:
     """Return dictionary with hidden data of the form."""
     page_response = session.get(url, verify=Config.INTUIT_SSL_VERIFY)
-    page_bs = BeautifulSoup(page_response.text, "html.parser")
-    form_bs = page_bs.find("form", id=form_id)
+    form_bs = find_element(page_response.text, "form", id=form_id)
     hidden_inputs_bs = form_bs.find_all("input", {"type": "hidden"})
     hidden_data = dict(map(lambda hid: (hid["name"], hid["value"]), hidden_inputs_bs))
     return hidden_data
@@ -129,10 +128,9 @@ def get_authorized_session(account: Account, session: requests.Session = None) -
         "destination": "intuituser/userpage"
     })
     page_response = session.post("{}/intuit".format(Config.WEBSITE), verify=Config.INTUIT_SSL_VERIFY, data=data)
-    response_bs = BeautifulSoup(page_response.text, "html.parser")
-    title_bs = response_bs.find("title")
+    title_bs = find_element(page_response.text, "title")
     if "Моя страница" not in title_bs.text:
-        messages_error_bs = response_bs.find("div", {"class": "messages error"})
+        messages_error_bs = find_element(page_response.text, "div", {"class": "messages error"})
         error_message_html = str(messages_error_bs)
         if messages_error_bs is None:
             raise AuthorizationError(
@@ -173,8 +171,7 @@ def register_session(account: Account, session: requests.Session = None) -> requ
         "op": "Регистрация"
     })
     page_response = session.post(Config.WEBSITE, verify=Config.INTUIT_SSL_VERIFY, data=data)
-    response_bs = BeautifulSoup(page_response.text, "html.parser")
-    title_bs = response_bs.find("title")
+    title_bs = find_element(page_response.text, "title")
     if "Завершение регистрации" not in title_bs.text:
         raise OperationHasDoneUnsuccessfully("Registration has done is unsuccessfully. The Page doesn't have "
                                              "information about the finish registration.")
@@ -213,8 +210,7 @@ def register_random_user() -> Account:
 
     logger.debug("Reading a confirmation message and finding a link.")
     message_body_html = intuit_message.text
-    message_body_bs = BeautifulSoup(message_body_html, "html.parser")
-    a_links = message_body_bs.find_all("a")
+    a_links = parse_html(message_body_html, "a").find_all("a")
     a_confirm_link = None
     for a_link in a_links:
         if "reg_confirm" in a_link["href"]:
@@ -0,0 +1,2 @@
+from antiintuit.jobs.consistency_checker.consistency_checker import *
+from antiintuit.jobs.consistency_checker.exceptions import *
@@ -0,0 +1,110 @@
+from collections import defaultdict
+
+from peewee import fn
+
+from antiintuit.database import Account, Answer, Question, Subscribe, Test
+from antiintuit.jobs.tests_solver.answers_generators import get_answers_generator
+from antiintuit.logger import exception, get_logger
+
+__all__ = [
+    "run_job",
+    "check_questions_state",
+    "check_accounts_counters"
+]
+
+logger = get_logger("antiintuit", "consistency_checker")
+
+
+@exception(logger)
+def run_job(repair: bool = True):
+    """Checks the maintained values in database and repairs them if it's necessary"""
+    check_questions_state(repair)
+    check_accounts_counters(repair)
+
+
+def get_answers_statistic() -> dict:
+    """Returns numbers of answers by statuses and id of the first right answer for every question"""
+    statistic = dict()
+    answers_groups = (Answer
+                      .select(Answer.question, Answer.status, fn.COUNT(Answer.id), fn.MIN(Answer.id))
+                      .group_by(Answer.question, Answer.status)
+                      .tuples())
+    for question_id, status, answers_count, first_answer_id in answers_groups:
+        question_statistic = statistic.setdefault(question_id, {"U": 0, "W": 0, "R": None})
+        question_statistic[status] = first_answer_id if status == "R" else answers_count
+    return statistic
+
+
+def get_question_state(question: Question, question_statistic: dict) -> dict:
+    """Returns values of the answers state which the question has to have"""
+    right_answer_id, wrong_count = question_statistic["R"], question_statistic["W"]
+    if question.is_lazy:
+        candidates_count = get_answers_generator(question).count()
+        unchecked_count = candidates_count - wrong_count - int(right_answer_id is not None)
+    else:
+        unchecked_count = question_statistic["U"]
+    return {"right_answer_id": right_answer_id, "unchecked_count": unchecked_count, "wrong_count": wrong_count}
+
+
+def check_questions_state(repair: bool = True) -> dict:
+    """Compares the maintained answers state of questions with answers and repairs it if repair is True"""
+    statistic = get_answers_statistic()
+    questions = Question.select(Question.id, Question.task_id, Question.title, Question.type, Question._variants,
+                                Question.answers_cursor, Question.right_answer_id, Question.unchecked_count,
+                                Question.wrong_count)
+    checked_count, inconsistent_count = 0, 0
+    for question in questions.iterator():
+        checked_count += 1
+        question_state = get_question_state(question, statistic.get(question.id, {"U": 0, "W": 0, "R": None}))
+        current_state = {name: getattr(question, name) for name in question_state}
+        if current_state == question_state:
+            continue
+        inconsistent_count += 1
+        logger.warning("Question '%s' has inconsistent answers state %s, but must be %s.",
+                       str(question), current_state, question_state)
+        if repair:
+            Question.update(question_state).where(Question.id == question.id).execute()
+    logger.info("Questions state result:\n    checked - %i\n    inconsistent - %i\n    repaired - %i",
+                checked_count, inconsistent_count, inconsistent_count if repair else 0)
+    return {"checked": checked_count, "inconsistent": inconsistent_count}
+
+
+def get_accounts_counters() -> dict:
+    """Returns numbers of subscribed courses and watched tests for every account which has them"""
+    counters = defaultdict(lambda: {"subscriptions_count": 0, "watched_tests_count": 0})
+    subscriptions_groups = (Subscribe
+                            .select(Subscribe.account, fn.COUNT(Subscribe.id))
+                            .group_by(Subscribe.account)
+                            .tuples())
+    for account_id, subscriptions_count in subscriptions_groups:
+        counters[account_id]["subscriptions_count"] = subscriptions_count
+    watched_tests_groups = (Test
+                            .select(Test.watcher, fn.COUNT(Test.id))
+                            .where(Test.watcher.is_null(False))
+                            .group_by(Test.watcher)
+                            .tuples())
+    for account_id, watched_tests_count in watched_tests_groups:
+        counters[account_id]["watched_tests_count"] = watched_tests_count
+    return counters
+
+
+def check_accounts_counters(repair: bool = True) -> dict:
+    """Compares the maintained counters of accounts with subscriptions and tests and repairs them if repair is True"""
+    counters = get_accounts_counters()
+    accounts = Account.select(Account.id, Account.first_name, Account.last_name, Account.email,
+                              Account.subscriptions_count, Account.watched_tests_count)
+    checked_count, inconsistent_count = 0, 0
+    for account in accounts.iterator():
+        checked_count += 1
+        account_counters = counters[account.id]
+        current_counters = {name: getattr(account, name) for name in account_counters}
+        if current_counters == account_counters:
+            continue
+        inconsistent_count += 1
+        logger.warning("Account '%s' has inconsistent counters %s, but must be %s.",
+                       str(account), current_counters, account_counters)
+        if repair:
+            Account.update(account_counters).where(Account.id == account.id).execute()
+    logger.info("Accounts counters result:\n    checked - %i\n    inconsistent - %i\n    repaired - %i",
+                checked_count, inconsistent_count, inconsistent_count if repair else 0)
+    return {"checked": checked_count, "inconsistent": inconsistent_count}
@@ -0,0 +1,9 @@
+from antiintuit.exceptions import AntiintuitException
+
+__all__ = [
+    "ConsistencyCheckerException"
+]
+
+
+class ConsistencyCheckerException(AntiintuitException):
+    pass
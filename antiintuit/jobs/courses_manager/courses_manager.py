@@ -1,14 +1,15 @@
-from datetime import date
+from datetime import date, datetime
 from itertools import count
 
-from bs4 import BeautifulSoup
 from requests import Session
 
 from antiintuit.basic import get_session, get_publish_id_from_link
 from antiintuit.config import Config
-from antiintuit.database import Account, Course, Subscribe
+from antiintuit.database import Account, Course, JobState, Subscribe
 from antiintuit.jobs.accounts_manager import get_authorized_session
 from antiintuit.logger import exception, get_logger
+from antiintuit.metrics import timed
+from antiintuit.parsing import find_element, parse_html
 
 __all__ = [
     "run_job",
@@ -19,30 +20,70 @@ logger = get_logger("antiintuit", "courses_manager")
 
 
 @exception(logger)
-def run_job():
-    """Checks pages of the courses list and adds they in database."""
-    new_courses, founded_courses = 0, 0
+@timed("courses_manager")
+def run_job(full_scan: bool = None):
+    """Checks pages of the courses list and adds they in database. An incremental scan stops at the first page which
+    has known free courses and doesn't have new ones. A full scan checks all pages and is executed every
+    COURSES_FULL_SCAN_INTERVAL minutes."""
+    state = JobState.get_value("courses_manager", dict())
+    if full_scan is None:
+        last_full_scan_at = state.get("last_full_scan_at")
+        full_scan = (last_full_scan_at is None or
+                     datetime.fromisoformat(last_full_scan_at) < Config.get_courses_full_scan_timeout_moment())
+    # Validators (ETag and Last-Modified) of pages are used for conditional requests only by incremental scans
+    pages_validators = dict() if full_scan else state.get("pages_validators", dict())
+    high_water_mark = state.get("high_water_mark")
+    logger.info("%s scan of courses pages is started.", "Full" if full_scan else "Incremental")
+    new_courses, founded_courses, session = 0, 0, get_session()
     for page_num in count():
         logger.debug("Scanning %i page...", page_num)
-        scanned_courses_stats = create_courses_from_page(page_num)
+        page_validators = pages_validators.setdefault(str(page_num), dict())
+        scanned_courses_stats = create_courses_from_page(page_num, session, page_validators)
+        if scanned_courses_stats["not_modified"]:
+            logger.info("Page %i hasn't been modified since the previous scan.", page_num)
+            break
         new_courses += scanned_courses_stats["new"]
         founded_courses += scanned_courses_stats["found"]
+        if scanned_courses_stats["newest"] is not None:
+            high_water_mark = max(high_water_mark or "", scanned_courses_stats["newest"].isoformat())
         logger.debug("Found on page %i courses among them %i are new.",
                      scanned_courses_stats["found"], scanned_courses_stats["new"])
         if scanned_courses_stats["found"] == 0:  # If the list is empty then pages have ended.
             break
-    logger.info("Courses result:\n    found on pages - %i\n    added new ones in database - %i",
-                founded_courses, new_courses)
+        # Paid courses aren't saved, so a page of only them doesn't mean that the following pages are known
+        if not full_scan and scanned_courses_stats["known"] > 0 and scanned_courses_stats["new"] == 0:
+            logger.info("Page %i contains only known courses.", page_num)
+            break
+    state.update({"pages_validators": pages_validators, "high_water_mark": high_water_mark})
+    if full_scan:
+        state["last_full_scan_at"] = datetime.utcnow().isoformat()
+    JobState.set_value("courses_manager", state)
+    logger.info("Courses result:\n    found on pages - %i\n    added new ones in database - %i\n"
+                "    the newest course is published on - %s", founded_courses, new_courses, high_water_mark)
 
 
-def create_courses_from_page(page: int, session: Session = None) -> dict:
-    """Creates courses on the courses page and returns the courses amount statistic as dict"""
-    session = session or get_session()
+@timed("courses_manager")
+def create_courses_from_page(page: int, session: Session = None, validators: dict = None) -> dict:
+    """Creates courses on the courses page and returns the courses amount statistic as dict.
+    Validators of the page from the previous scan are sent in a conditional request and are replaced by new ones."""
+    session, headers = session or get_session(), dict()
+    if validators:
+        if "ETag" in validators:
+            headers["If-None-Match"] = validators["ETag"]
+        if "Last-Modified" in validators:
+            headers["If-Modified-Since"] = validators["Last-Modified"]
     page_response = session.get("{}/studies/courses?idfilter=0&sort=11&sort_order=1&search_data=&"
-                                "tab=4&_page={}".format(Config.WEBSITE, page), verify=Config.INTUIT_SSL_VERIFY)
-    page_bs = BeautifulSoup(page_response.text, "html.parser")
-    courses_elements = page_bs.find_all("div", {"class": "entities-showcase-list-item"})
-    new_courses, found_courses = 0, len(courses_elements)
+                                "tab=4&_page={}".format(Config.WEBSITE, page), headers=headers,
+                                verify=Config.INTUIT_SSL_VERIFY)
+    if page_response.status_code == 304:
+        return {"new": 0, "known": 0, "found": 0, "newest": None, "not_modified": True}
+    if validators is not None:
+        validators.clear()
+        validators.update({name: page_response.headers[name] for name in ("ETag", "Last-Modified")
+                           if name in page_response.headers})
+    courses_filter = {"class": "entities-showcase-list-item"}
+    courses_elements = parse_html(page_response.text, "div", courses_filter).find_all("div", courses_filter)
+    found_courses, courses_rows = len(courses_elements), dict()
     for course_element in courses_elements:
         # Fill date
         date_text = course_element.find("div", {"class": "td date"}).text
@@ -57,39 +98,36 @@ def create_courses_from_page(page: int, session: Session = None) -> dict:
         publish_course_id = get_publish_id_from_link(a_title_bs["href"])
         if publish_course_id is None:
             continue
-        course = Course.get_or_none(Course.publish_id == publish_course_id)
-        if course is None:
-            Course.create(publish_id=publish_course_id,
-                          published_on=publish_course_date,
-                          title=title)
-            new_courses += 1
-            logger.info("New course '%s' has added", str(course))
-        else:
-            logger.debug("Course '%s' is already exists.", str(course))
+        courses_rows[publish_course_id] = {"publish_id": publish_course_id,
+                                           "published_on": publish_course_date,
+                                           "title": title}
+    new_courses = create_new_courses(list(courses_rows.values()))
+    newest = max((row["published_on"] for row in courses_rows.values()), default=None)
 
-    return {"new": new_courses, "found": found_courses}
+    return {"new": new_courses, "known": len(courses_rows) - new_courses, "found": found_courses, "newest": newest,
+            "not_modified": False}
 
 
+@timed("courses_manager")
 def subscribe_to_course(account: Account, course: Course, session: Session = None) -> Session:
     """Subscribe account to course"""
     session = session or get_authorized_session(account)
     info_page_response = session.get(course.link, verify=Config.INTUIT_SSL_VERIFY)
-    info_page_bs = BeautifulSoup(info_page_response.text, "html.parser")
-    subscribe_anchor_bs = info_page_bs.find("a", {"class": "red ajax-command-anchor"})
+    subscribe_anchor_bs = find_element(info_page_response.text, "a", {"class": "red ajax-command-anchor"})
     request_data = subscribe_anchor_bs["request_data"].split("&")
     request_data_dict = dict(map(lambda record: record.split("="), request_data))
     # Getting a dialog page with the submit
     dialog_json = session.post("{}/int_studies/json/signin_free_dialog".format(Config.WEBSITE),
                                data=request_data_dict, verify=Config.INTUIT_SSL_VERIFY).json()
     dialog_page = dialog_json["data"]
-    dialog_bs = BeautifulSoup(dialog_page, "html.parser")
-    sign_in_form_bs = dialog_bs.find("form", {"action": "/int_studies/json/signin_free_dialog"})
+    sign_in_form_bs = find_element(dialog_page, "form", {"action": "/int_studies/json/signin_free_dialog"})
     sign_in_form_inputs_bs = sign_in_form_bs.find_all("input")
     sign_in_data = dict(map(lambda inp: (inp["name"], inp["value"]), sign_in_form_inputs_bs))
     session.post("{}/int_studies/json/signin".format(Config.WEBSITE), data=sign_in_data,
                  verify=Config.INTUIT_SSL_VERIFY)
     if account.get_id() is not None:
         Subscribe.create(account=account, course=course)
+        account.add_to_counters(subscriptions_delta=1)
     logger.info("Account '%s' has subscribed to '%s' course.", str(account), str(course))
     return session
 
@@ -104,5 +142,26 @@ def unsubscribe_from_course(subscribe: Subscribe, session: Session = None) -> Se
                  "type": publish_id_numbers[0], "identity": publish_id_numbers[1]}
     session.post(unsubscribe_url, post_data, verify=Config.INTUIT_SSL_VERIFY)
     subscribe.delete_instance()
+    account.add_to_counters(subscriptions_delta=-1)
     logger.info("Account '%s' has unsubscribed from '%s' course.", str(account), str(course))
     return session
+
+
+def create_new_courses(courses_rows: list) -> int:
+    """Inserts courses which don't exist in database by one query and returns the number of the new ones"""
+    if not courses_rows:
+        return 0
+    publish_ids = [row["publish_id"] for row in courses_rows]
+    existing_publish_ids = set(publish_id for publish_id, in (Course
+                                                              .select(Course.publish_id)
+                                                              .where(Course.publish_id.in_(publish_ids))
+                                                              .tuples()))
+    new_courses_rows = [row for row in courses_rows if row["publish_id"] not in existing_publish_ids]
+    if new_courses_rows:
+        with Course._meta.database.atomic():
+            # Courses which have been added by another job meanwhile are ignored
+            Course.insert_many(new_courses_rows).on_conflict_ignore().execute()
+    for row in new_courses_rows:
+        logger.info("New course '[%s] %s' has added", row["publish_id"], row["title"])
+    logger.debug("%i courses already exist.", len(existing_publish_ids))
+    return len(new_courses_rows)
@@ -1,8 +1,9 @@
+import heapq
 import re
-from datetime import timedelta
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta
 
-from bs4 import BeautifulSoup
-from peewee import fn, JOIN, SQL
+from peewee import Case, chunked
 from requests import Session
 
 from antiintuit.basic import get_publish_id_from_link
@@ -11,27 +12,32 @@ from antiintuit.database import Account, Course, Subscribe, Test
 from antiintuit.jobs.accounts_manager import get_authorized_session
 from antiintuit.jobs.courses_manager import subscribe_to_course
 from antiintuit.logger import exception, get_logger
+from antiintuit.metrics import timed
+from antiintuit.parsing import find_element
 
 __all__ = [
-    "run_job"
+    "run_job",
+    "get_courses_scans_queue_query",
+    "get_subscribed_accounts_query",
+    "get_watchers_assignments",
+    "get_unwatched_tests_query",
+    "get_course_watchers_query"
 ]
 
 logger = get_logger("antiintuit", "tests_manager")
 
 
 @exception(logger)
+@timed("tests_manager")
 def run_job(course: Course = None):
     # Getting the tests of the first found course
     if course is None:
-        course = (Course
-                  .select()
-                  .order_by(Course.last_scan_at, Course.published_on.desc())
-                  .limit(1)).get()
-        if course.last_scan_at > Config.get_course_scan_timeout_moment():
-            next_in = course.last_scan_at - Config.get_course_scan_timeout_moment()
-            logger.info("All courses in timeout. Timeout is %s. Next course is '%s' will be in %s.",
-                        str(timedelta(minutes=Config.COURSE_SCAN_INTERVAL)).split(".")[0], str(course),
-                        str(next_in).split(".")[0])
+        course = get_courses_scans_queue_query().get()
+        if course.next_scan_at > datetime.utcnow():
+            next_in = course.next_scan_at - datetime.utcnow()
+            logger.info("All courses in timeout. Next course is '%s' will be in %s (interval is %s).",
+                        str(course), str(next_in).split(".")[0],
+                        str(timedelta(minutes=course.scan_interval)).split(".")[0])
             return
     logger.info("Selected '%s' course.", str(course))
     account, session = get_account_for_course(course).values()
@@ -41,78 +47,159 @@ def run_job(course: Course = None):
     appoint_accounts_to_tests()
 
 
+def get_courses_scans_queue_query():
+    """Returns the query of courses in order of the next scans"""
+    return Course.select().order_by(Course.next_scan_at, Course.published_on.desc())
+
+
 def get_account_for_course(course: Course) -> dict:
     """Returns an account subscribed on a course and authorized session (or None)"""
     try:
         session = None
-        account = (Account
-                   .select()
-                   .join(Subscribe)
-                   .where((Account.reserved_until < Config.get_account_reserve_out_moment()) &
-                          (Subscribe.course == course))
-                   .order_by(Account.reserved_until)).get()
+        account = get_subscribed_accounts_query(course).get()
     except Account.DoesNotExist:
         account = (Account
-                   .select(Account, fn.COUNT(Subscribe.id).alias("count"))
-                   .join(Subscribe, JOIN.LEFT_OUTER, on=(Subscribe.account == Account.id))
+                   .select()
                    .where(Account.reserved_until < Config.get_account_reserve_out_moment())
-                   .group_by(Account.id)
-                   .order_by("count", Account.reserved_until)).get()
+                   .order_by(Account.subscriptions_count, Account.reserved_until)
+                   .limit(1)).get()
         session = subscribe_to_course(account, course)
     return {"account": account, "session": session}
 
 
+def get_subscribed_accounts_query(course: Course):
+    """Returns the query of not reserved accounts subscribed on the course"""
+    return (Account
+            .select()
+            .join(Subscribe)
+            .where((Account.reserved_until < Config.get_account_reserve_out_moment()) &
+                   (Subscribe.course == course))
+            .order_by(Account.reserved_until))
+
+
+@timed("tests_manager")
 def create_tests_of_course(course: Course, account: Account, session: Session = None) -> dict:
     """Adds tests of the course in database and updates dates"""
     session = session or get_authorized_session(account)
     info_page_response = session.get(course.link, verify=Config.INTUIT_SSL_VERIFY)
-    info_page_bs = BeautifulSoup(info_page_response.text, "html.parser")
-    menu_bs = info_page_bs.find("ul", id="non-collapsible-item-1")
-    new_tests_count, found_tests_count = 0, 0
+    menu_bs = find_element(info_page_response.text, "ul", id="non-collapsible-item-1")
+    new_tests_count, tests_rows = 0, dict()
     if menu_bs is not None:
         anchors_list_bs = menu_bs.find_all("a")
         for anchor in anchors_list_bs:
             if "/test/" in anchor["href"]:
                 publish_test_id = get_publish_id_from_link(anchor["href"])
                 questions_count = int(re.search(r"^\d+", anchor["title"]).group())
-                title = anchor.text
-                test = Test.get_or_none(publish_id=publish_test_id)
-                if test is None:
-                    test = Test.create(
-                        publish_id=publish_test_id,
-                        title=title,
-                        course=course,
-                        questions_count=questions_count)
-                    logger.info("New test '%s' has added", str(test))
-                    new_tests_count += 1
-                else:
-                    logger.debug("Test '%s' already exists", str(test))
-                found_tests_count += 1
+                tests_rows[publish_test_id] = {"publish_id": publish_test_id,
+                                               "title": anchor.text,
+                                               "course": course.id,
+                                               "questions_count": questions_count}
+        new_tests_count = create_new_tests(list(tests_rows.values()))
     else:
         logger.info("Course '%s' doesn't have the menu with links.", str(course))
 
-    course.update_last_scan()
-    return {"new": new_tests_count, "found": found_tests_count}
+    course.update_last_scan(new_tests_count > 0)
+    return {"new": new_tests_count, "found": len(tests_rows)}
+
+
+def create_new_tests(tests_rows: list) -> int:
+    """Inserts tests which don't exist in database by one query and returns the number of the new ones"""
+    if not tests_rows:
+        return 0
+    publish_ids = [row["publish_id"] for row in tests_rows]
+    existing_publish_ids = set(publish_id for publish_id, in (Test
+                                                              .select(Test.publish_id)
+                                                              .where(Test.publish_id.in_(publish_ids))
+                                                              .tuples()))
+    new_tests_rows = [row for row in tests_rows if row["publish_id"] not in existing_publish_ids]
+    if new_tests_rows:
+        with Test._meta.database.atomic():
+            # Tests which have been added by another job meanwhile are ignored
+            Test.insert_many(new_tests_rows).on_conflict_ignore().execute()
+    for row in new_tests_rows:
+        logger.info("New test '[%s] %s' has added", row["publish_id"], row["title"])
+    logger.debug("%i tests already exist.", len(existing_publish_ids))
+    return len(new_tests_rows)
 
 
-def appoint_accounts_to_tests():
+@timed("tests_manager")
+def appoint_accounts_to_tests(batch_size: int = 500):
     """Appoints watching accounts for tests without watchers"""
-    tests = (Test
-             .select()
-             .where(Test.watcher.is_null() & (Test.unsolvable == False))
-             .order_by(Test.last_scan_at))
-    for test in tests:
-        course_watchers = (Test.
-                           select(Test.watcher)
-                           .where(Test.watcher.is_null(False) &
-                                  (Test.course == test.course)))
-        account = (Account
-                   .select(Account, fn.COUNT(Test.id).alias("tests_count"))
-                   .join(Test, JOIN.LEFT_OUTER, on=(Test.watcher_id == Account.id))
-                   .where((Account.reserved_until < Config.get_account_reserve_out_moment()) &
-                          (Account.id.not_in(course_watchers)))
-                   .group_by(Account.id)
-                   .order_by(SQL("`tests_count`"), Account.reserved_until)
-                   .limit(1)).get()
-        test.set_watcher(account)
-        logger.info("Account '%s' appointed to watch for '%s' test.", str(account), str(test))
+    assignments = get_watchers_assignments()
+    accounts_tests_counts = Counter()
+    with Test._meta.database.atomic():
+        for tests_ids in chunked(assignments, batch_size):
+            accounts_tests_counts.update(set_watchers(tests_ids, assignments))
+        for accounts_ids in chunked(accounts_tests_counts, batch_size):
+            watched_tests_counts = [(account_id, Account.watched_tests_count + accounts_tests_counts[account_id])
+                                    for account_id in accounts_ids]
+            (Account
+             .update({Account.watched_tests_count: Case(Account.id, watched_tests_counts)})
+             .where(Account.id.in_(accounts_ids))).execute()
+    logger.info("%i accounts appointed to watch for tests.", sum(accounts_tests_counts.values()))
+
+
+def set_watchers(tests_ids: list, assignments: dict) -> Counter:
+    """Sets watchers of the tests which still don't have them (another job could appoint them meanwhile).
+    Returns numbers of the actually appointed tests by watchers."""
+    query = (Test
+             .update({Test.watcher: Case(Test.id, [(test_id, assignments[test_id]) for test_id in tests_ids])})
+             .where(Test.id.in_(tests_ids) & Test.watcher.is_null()))
+    if Test._meta.database.returning_clause:
+        return Counter(watcher_id for _, watcher_id in query.returning(Test.id, Test.watcher).tuples().execute())
+    query.execute()
+    # Without RETURNING the updated tests are selected again inside the same transaction
+    return Counter(watcher_id for test_id, watcher_id in (Test
+                                                          .select(Test.id, Test.watcher)
+                                                          .where(Test.id.in_(tests_ids))
+                                                          .tuples())
+                   if watcher_id == assignments[test_id])
+
+
+def get_watchers_assignments() -> dict:
+    """Returns watchers (ids) for tests (ids) without watchers. Every test gets the not reserved account which watches
+    the least number of tests, and an account watches no more than one test of a course."""
+    unwatched_tests = list(get_unwatched_tests_query().select(Test.id, Test.course).tuples())
+    # Heap of accounts by the number of watched tests and the reservation time
+    accounts_heap = list(Account
+                         .select(Account.watched_tests_count, Account.reserved_until, Account.id)
+                         .where(Account.reserved_until < Config.get_account_reserve_out_moment())
+                         .tuples())
+    heapq.heapify(accounts_heap)
+    courses_watchers = defaultdict(set)
+    unwatched_courses = get_unwatched_tests_query().select(Test.course).order_by()
+    for course_id, watcher_id in (Test
+                                  .select(Test.course, Test.watcher)
+                                  .where(Test.watcher.is_null(False) & Test.course.in_(unwatched_courses))
+                                  .tuples()):
+        courses_watchers[course_id].add(watcher_id)
+    assignments = dict()
+    for test_id, course_id in unwatched_tests:
+        course_watchers, skipped_accounts = courses_watchers[course_id], list()
+        while accounts_heap and accounts_heap[0][2] in course_watchers:
+            skipped_accounts.append(heapq.heappop(accounts_heap))
+        if accounts_heap:
+            tests_count, reserved_until, account_id = accounts_heap[0]
+            heapq.heapreplace(accounts_heap, (tests_count + 1, reserved_until, account_id))
+            assignments[test_id] = account_id
+            course_watchers.add(account_id)
+        else:
+            logger.warning("There isn't an account which can watch for the test %i.", test_id)
+        for account in skipped_accounts:
+            heapq.heappush(accounts_heap, account)
+    return assignments
+
+
+def get_unwatched_tests_query():
+    """Returns the query of solvable tests without watchers"""
+    return (Test
+            .select()
+            .where(Test.watcher.is_null() & (Test.unsolvable == False))
+            .order_by(Test.last_scan_at))
+
+
+def get_course_watchers_query(course: Course):
+    """Returns the query of watchers of the course tests"""
+    return (Test
+            .select(Test.watcher)
+            .where(Test.watcher.is_null(False) & (Test.course == course)))
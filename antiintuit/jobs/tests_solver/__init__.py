@@ -1,2 +1,3 @@
 from antiintuit.jobs.tests_solver.exceptions import *
+from antiintuit.jobs.tests_solver.answers_generators import *
 from antiintuit.jobs.tests_solver.tests_solver import *
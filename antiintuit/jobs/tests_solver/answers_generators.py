@@ -0,0 +1,206 @@
+from itertools import combinations, islice, product
+from math import factorial
+
+from antiintuit.database import Answer, Question
+from antiintuit.jobs.tests_solver.exceptions import IncorrectTestType
+
+__all__ = [
+    "AnswersGenerator",
+    "DefaultAnswersGenerator",
+    "CorrelationAnswersGenerator",
+    "TemplateAnswersGenerator",
+    "get_answers_generator"
+]
+
+
+class AnswersGenerator:
+    """Strategy of generation of answers (candidates) for a question. Iteration over the strategy yields
+    unsaved answers in a deterministic order except answers which are already marked as wrong."""
+
+    def __init__(self, question: Question):
+        self.question = question
+
+    def __iter__(self):
+        wrong_answers_keys = self.get_wrong_answers_keys()
+        for answer in self.generate():
+            if self.get_answer_key(answer) not in wrong_answers_keys:
+                yield answer
+
+    def get_wrong_answers_keys(self) -> set:
+        """Returns keys of the question answers which are marked as wrong"""
+        wrong_answers = Answer.select().where((Answer.question == self.question) & (Answer.status == "W"))
+        return set(map(self.get_answer_key, wrong_answers))
+
+    def get_answer_key(self, answer: Answer):
+        """Returns a hashable value which identifies the answer among answers of the question"""
+        raise NotImplementedError("get_answer_key function isn't overloaded.")
+
+    def generate(self):
+        """Yields all answers of the question"""
+        raise NotImplementedError("generate function isn't overloaded.")
+
+    def count(self) -> int:
+        """Returns the number of all answers of the question"""
+        return sum(1 for _ in self.generate())
+
+    def get(self, index: int) -> Answer or None:
+        """Returns the answer which has the index in the generation order without generating previous ones"""
+        return next(islice(self.generate(), index, None), None)
+
+
+class DefaultAnswersGenerator(AnswersGenerator):
+    """Generates answers as bitmasks of variants combinations for multiple or single question"""
+
+    def get_answer_key(self, answer: Answer) -> int:
+        if answer.mask is None:
+            return self.question.get_mask_by_variants(answer.get_variants())
+        return answer.mask
+
+    def generate(self):
+        variants_count = len(self.question.variants)
+        max_combinations_range = variants_count if self.question.type == "multiple" else 1
+        for range_size in range(1, max_combinations_range + 1):
+            for indexes_combination in combinations(range(variants_count), range_size):
+                yield Answer(mask=sum(1 << index for index in indexes_combination), question=self.question)
+
+    def count(self) -> int:
+        variants_count = len(self.question.variants)
+        return 2 ** variants_count - 1 if self.question.type == "multiple" else variants_count
+
+    def get(self, index: int) -> Answer or None:
+        variants_count = len(self.question.variants)
+        max_combinations_range = variants_count if self.question.type == "multiple" else 1
+        for range_size in range(1, max_combinations_range + 1):
+            combinations_count = get_combinations_count(variants_count, range_size)
+            if index < combinations_count:
+                indexes_combination = get_combination_by_index(variants_count, range_size, index)
+                return Answer(mask=sum(1 << element for element in indexes_combination), question=self.question)
+            index -= combinations_count
+        return None
+
+
+class CorrelationAnswersGenerator(AnswersGenerator):
+    """Generates answers for a correlation question. Only one-to-one matchings of items and options are generated
+    if it's possible, otherwise all combinations of options are generated."""
+
+    def get_answer_key(self, answer: Answer) -> tuple:
+        return tuple(variant[2][0] for variant in answer.get_variants(self.question))
+
+    @property
+    def is_one_to_one(self) -> bool:
+        """Returns True if every item of the question can be matched with its own option"""
+        return has_one_to_one_matching([variant[2] for variant in self.question.variants])
+
+    @property
+    def has_same_options(self) -> bool:
+        """Returns True if all items of the question have the same options"""
+        options_lists = [variant[2] for variant in self.question.variants]
+        return all(options == options_lists[0] for options in options_lists)
+
+    def get_answer(self, options_combination) -> Answer:
+        answer_variants = [(name, title, option)
+                           for (name, title, _), option in zip(self.question.variants, options_combination)]
+        return Answer(variants=answer_variants, question=self.question)
+
+    def generate(self):
+        options_lists = [variant[2] for variant in self.question.variants]
+        if self.is_one_to_one:
+            options_combinations = get_one_to_one_matchings(options_lists)
+        else:
+            options_combinations = product(*options_lists)
+        yield from map(self.get_answer, options_combinations)
+
+    def count(self) -> int:
+        variants = self.question.variants
+        if not self.has_same_options:
+            return super().count()
+        options_count = len(variants[0][2]) if variants else 0
+        if not self.is_one_to_one:
+            return options_count ** len(variants)
+        return factorial(options_count) // factorial(options_count - len(variants))
+
+    def get(self, index: int) -> Answer or None:
+        variants = self.question.variants
+        if not self.has_same_options or not self.is_one_to_one:
+            return super().get(index)
+        if index >= self.count():
+            return None
+        options, options_combination = list(variants[0][2]), list()
+        for position in range(len(variants)):
+            block_size = factorial(len(options) - 1) // factorial(len(options) - len(variants) + position)
+            option_index, index = divmod(index, block_size)
+            options_combination.append(options.pop(option_index))
+        return self.get_answer(options_combination)
+
+
+class TemplateAnswersGenerator(AnswersGenerator):
+    """Generates the one answer for a template question"""
+
+    def get_answer_key(self, answer: Answer):
+        return None
+
+    def generate(self):
+        yield Answer(variants=self.question.variants, question=self.question)
+
+
+def get_one_to_one_matchings(options_lists: list, used_values: frozenset = frozenset()):
+    """Yields combinations of options (one option of each list) in which every option value is used once"""
+    if not options_lists:
+        yield tuple()
+        return
+    for option in options_lists[0]:
+        if option[0] not in used_values:
+            for matching in get_one_to_one_matchings(options_lists[1:], used_values | {option[0]}):
+                yield (option,) + matching
+
+
+def has_one_to_one_matching(options_lists: list) -> bool:
+    """Returns True if every list can get its own option value (Kuhn's algorithm of the bipartite matching)"""
+    matched_lists = dict()  # Index of the list by the matched option value
+
+    def find_augmenting_path(list_index: int, visited_values: set) -> bool:
+        for option in options_lists[list_index]:
+            if option[0] in visited_values:
+                continue
+            visited_values.add(option[0])
+            if option[0] not in matched_lists or find_augmenting_path(matched_lists[option[0]], visited_values):
+                matched_lists[option[0]] = list_index
+                return True
+        return False
+
+    return all(find_augmenting_path(list_index, set()) for list_index in range(len(options_lists)))
+
+
+def get_combinations_count(n: int, k: int) -> int:
+    """Returns the number of k-combinations of n elements"""
+    return factorial(n) // (factorial(k) * factorial(n - k)) if 0 <= k <= n else 0
+
+
+def get_combination_by_index(n: int, k: int, index: int) -> tuple:
+    """Returns k-combination of range(n) which has the index in the lexicographic order"""
+    combination, start = list(), 0
+    for remaining in range(k, 0, -1):
+        for element in range(start, n):
+            combinations_count = get_combinations_count(n - element - 1, remaining - 1)
+            if index < combinations_count:
+                combination.append(element)
+                start = element + 1
+                break
+            index -= combinations_count
+    return tuple(combination)
+
+
+answers_generators = {
+    "single": DefaultAnswersGenerator,
+    "multiple": DefaultAnswersGenerator,
+    "correlation": CorrelationAnswersGenerator,
+    "template": TemplateAnswersGenerator
+}
+
+
+def get_answers_generator(question: Question) -> AnswersGenerator:
+    """Returns the answers generation strategy by the question type"""
+    if question.type not in answers_generators:
+        raise IncorrectTestType("Question '{}' has incorrect '{}' type and system can't generate new answers.".format(
+            question.title, question.type))
+    return answers_generators[question.type](question)
@@ -0,0 +1,92 @@
+import os
+from datetime import datetime
+from hashlib import sha3_256
+from tempfile import NamedTemporaryFile
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from antiintuit.basic import get_image_extension
+from antiintuit.config import Config
+from antiintuit.database import Image
+from antiintuit.images_store import find_image_path, get_image_path, make_thumbnail
+from antiintuit.logger import get_logger
+from antiintuit.metrics import Counter
+
+__all__ = [
+    "IMAGES_CACHE_REQUESTS",
+    "get_images_session",
+    "get_image_name",
+    "save_image"
+]
+
+logger = get_logger("antiintuit", "tests_solver", "images")
+# Results: "hit" (without requests), "revalidated" (304 response), "miss" (downloaded)
+IMAGES_CACHE_REQUESTS = Counter("antiintuit_images_cache_requests_total", "Requests of images by results of the cache",
+                                ("result",))
+images_session = None
+
+
+def get_images_session() -> requests.Session:
+    """Returns the session of the process which keeps connections for downloads of images"""
+    global images_session
+    if images_session is None:
+        images_session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=4, max_retries=2)
+        images_session.mount("http://", adapter)
+        images_session.mount("https://", adapter)
+    return images_session
+
+
+def get_image_name(url: str) -> str:
+    """Returns the file name of the image in the static directory by its source URL.
+    The image is downloaded only if the index doesn't have the URL or the file. An indexed image is revalidated by a
+    conditional request if it has been checked earlier than IMAGE_REVALIDATE_INTERVAL minutes ago."""
+    image = Image.get_or_none(Image.url == url)
+    headers = dict()
+    if image is not None and find_image_path(image.name) is not None:
+        if not image.is_stale:
+            IMAGES_CACHE_REQUESTS.inc("hit")
+            return image.name
+        headers = image.get_conditional_headers()
+    with get_images_session().get(url, headers=headers, stream=True, verify=Config.INTUIT_SSL_VERIFY) as response:
+        if response.status_code == 304:
+            IMAGES_CACHE_REQUESTS.inc("revalidated")
+            Image.update({Image.checked_at: datetime.utcnow()}).where(Image.id == image.id).execute()
+            return image.name
+        IMAGES_CACHE_REQUESTS.inc("miss")
+        name = save_image(response)
+        if not response.ok:
+            logger.warning("Image '%s' has been received with %i status code.", url, response.status_code)
+            return name
+        values = {Image.name: name, Image.checked_at: datetime.utcnow(), Image.etag: response.headers.get("ETag"),
+                  Image.last_modified: response.headers.get("Last-Modified")}
+    if image is None:
+        # The image could be indexed by another session meanwhile, then its entry is kept
+        Image.insert({Image.url: url, **values}).on_conflict_ignore().execute()
+    else:
+        Image.update(values).where(Image.id == image.id).execute()
+    return name
+
+
+def save_image(response: requests.Response) -> str:
+    """Streams the content of the response in the images store and returns the file name (the hash of the content).
+    The file appears under its name only when it's fully written."""
+    static_path = Config.get_static_directory_path()
+    content_hash = sha3_256()
+    with NamedTemporaryFile(dir=str(static_path), prefix=".download-", delete=False) as temp_file:
+        try:
+            for chunk in response.iter_content(64 * 1024):
+                content_hash.update(chunk)
+                temp_file.write(chunk)
+        except BaseException:
+            temp_file.close()
+            os.remove(temp_file.name)
+            raise
+    name = "{}.{}".format(content_hash.hexdigest(), get_image_extension(response.headers.get("Content-Type", "")))
+    image_path = get_image_path(name, create_directories=True)
+    os.chmod(temp_file.name, 0o644)
+    os.replace(temp_file.name, str(image_path))
+    logger.debug("Saved image at '%s'.", str(image_path.absolute()))
+    make_thumbnail(name)
+    return name
@@ -1,53 +1,141 @@
 import socket
+from collections import defaultdict, deque
 from random import random
-from time import sleep
+from statistics import median
+from time import perf_counter, sleep
 
 import ujson
 
 from antiintuit.config import Config
-from antiintuit.logger import get_logger, get_host_and_port, is_open_connection
+from antiintuit.logger import get_logger, get_host_and_port
 
 __all__ = [
+    "QueueClient",
+    "get_queue_client",
     "wait_in_the_queue",
+    "renew_place_in_the_queue",
     "get_out_of_the_queue"
 ]
 
 logger = get_logger("antiintuit", "tests_solver", "queue_solution")
+queue_client = None
 
 
-def send_message(host, port, message):
-    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
-        sock.connect((host, port))
-        sock.sendall(bytes(message + "\n", "utf-8"))
-        received = ujson.loads(str(sock.recv(1024), "utf-8"))
-    logger.debug("Sent: %s\nReceived: %s", message, repr(received))
-    return received
+class QueueClient:
+    """Client of the Session Queue which keeps one persistent connection and sends newline-delimited messages"""
+
+    def __init__(self, host: str, port: int):
+        self.host, self.port = host, port
+        self.sock, self.sock_file = None, None
+        # The last latencies (in seconds) of requests by operations
+        self.latencies = defaultdict(lambda: deque(maxlen=1000))
+
+    def connect(self):
+        """Connects to the Session Queue with exponential backoff between attempts"""
+        self.close()
+        for attempt in range(Config.SESSION_QUEUE_CONNECT_ATTEMPTS):
+            try:
+                self.sock = socket.create_connection((self.host, self.port), Config.SESSION_QUEUE_CONNECT_TIMEOUT)
+                # Responses on CHK are long-polled, so reading doesn't have a timeout
+                self.sock.settimeout(None)
+                self.sock_file = self.sock.makefile("rb")
+                return
+            except OSError as ex:
+                backoff = min(0.5 * 2 ** attempt, 30)
+                logger.warning("No connection to Session Queue (%s:%i): %s. Next attempt in %.1f seconds.",
+                               self.host, self.port, str(ex), backoff)
+                sleep(backoff)
+        raise ConnectionError("Couldn't connect to Session Queue ({}:{}).".format(self.host, self.port))
+
+    def close(self):
+        if self.sock_file is not None:
+            self.sock_file.close()
+        if self.sock is not None:
+            self.sock.close()
+        self.sock, self.sock_file = None, None
+
+    def request(self, message: str):
+        """Sends the message and returns the response. The message is sent again through a new connection
+        if the connection is lost before the response."""
+        for attempt in range(2):
+            if self.sock is None:
+                self.connect()
+            started_at = perf_counter()
+            try:
+                self.sock.sendall(bytes(message + "\n", "utf-8"))
+                line = self.sock_file.readline()
+                if not line:
+                    raise ConnectionError("Session Queue has closed the connection.")
+            except OSError as ex:
+                self.close()
+                if attempt:
+                    raise
+                logger.warning("Connection to Session Queue has been lost: %s. Reconnecting...", str(ex))
+                continue
+            self.latencies[message.split(":")[0]].append(perf_counter() - started_at)
+            received = ujson.loads(str(line, "utf-8"))
+            logger.debug("Sent: %s\nReceived: %s", message, repr(received))
+            return received
+
+    def get_latency_stats(self) -> dict:
+        """Returns the number of requests, median and maximum latencies (in seconds) by operations"""
+        return {operation: {"count": len(latencies), "median": median(latencies), "max": max(latencies)}
+                for operation, latencies in self.latencies.items() if latencies}
+
+
+def get_queue_client() -> QueueClient or None:
+    """Returns the client of the process or None if the Session Queue isn't configured or isn't used because tests are
+    claimed by the database"""
+    global queue_client
+    if Config.TEST_SOLVER_SESSION_QUEUE_HOST is None or Config.CLAIM_TESTS_IN_DATABASE:
+        return None
+    if queue_client is None:
+        queue_client = QueueClient(*get_host_and_port(Config.TEST_SOLVER_SESSION_QUEUE_HOST, 26960))
+    return queue_client
 
 
 def wait_in_the_queue():
-    if Config.TEST_SOLVER_SESSION_QUEUE_HOST is None:
-        sleep_time = random.random() * Config.MAX_LATENCY_FOR_OUT_OF_SYNC
+    client = get_queue_client()
+    if client is None:
+        sleep_time = random() * Config.MAX_LATENCY_FOR_OUT_OF_SYNC
         logger.debug("Session '%s' is sleeping during %f", Config.SESSION_ID, sleep_time)
         sleep(sleep_time)
         return
-    host, port = get_host_and_port(Config.TEST_SOLVER_SESSION_QUEUE_HOST, 26960)
-    if not is_open_connection(host, port):
-        logger.warning("No connection to Session Queue (%s:%i)", host, port)
-        return
     message = "CHK:" + Config.SESSION_ID
-    received = send_message(host, port, message)
-    while not isinstance(received, dict) or not received["allow"]:
-        logger.debug("The session '%s' is in the queue and has %i position.", Config.SESSION_ID, received["pos"])
-        sleep(2)
-        received = send_message(host, port, message)
+    try:
+        # The Session Queue responds only when the session reaches the head of the queue
+        received = client.request(message)
+        while not isinstance(received, dict) or not received["allow"]:
+            logger.debug("The session '%s' is in the queue and has %i position.", Config.SESSION_ID, received["pos"])
+            received = client.request(message)
+    except ConnectionError as ex:
+        logger.warning(str(ex))
+        return
+    logger.debug("Session Queue latencies: %s", repr(client.get_latency_stats()))
+
+
+def renew_place_in_the_queue():
+    """Extends the lease of the session in the Session Queue, otherwise the session will be evicted"""
+    client = get_queue_client()
+    if client is None:
+        return
+    try:
+        received = client.request("RNW:" + Config.SESSION_ID)
+    except ConnectionError as ex:
+        logger.warning(str(ex))
+        return
+    if not received:
+        logger.warning("The session '%s' isn't in the Session Queue.", Config.SESSION_ID)
 
 
 def get_out_of_the_queue():
-    if Config.TEST_SOLVER_SESSION_QUEUE_HOST is not None:
-        host, port = get_host_and_port(Config.TEST_SOLVER_SESSION_QUEUE_HOST, 26960)
-        if is_open_connection(host, port):
-            message = "DEL:" + Config.SESSION_ID
-            received = send_message(host, port, message)
-            assert received is True, "Received not True from the Session Queue"
-        else:
-            logger.warning("No connection to Session Queue (%s:%i)", host, port)
+    client = get_queue_client()
+    if client is not None:
+        try:
+            received = client.request("DEL:" + Config.SESSION_ID)
+        except ConnectionError as ex:
+            logger.warning(str(ex))
+            return
+        if received is not True:
+            # The session is evicted by the Session Queue when its lease expires
+            logger.warning("The session '%s' hasn't been in the Session Queue.", Config.SESSION_ID)
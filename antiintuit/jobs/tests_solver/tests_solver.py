@@ -1,33 +1,38 @@
 import re
 from datetime import datetime, timedelta
-from hashlib import sha3_256
-from itertools import combinations, product, count
-from time import sleep
+from itertools import chain, count
+from time import perf_counter, sleep
 
 import peewee
-import requests
 from bs4 import BeautifulSoup
-from peewee import SQL
+from peewee import chunked
 from requests import Session
 
-from antiintuit.basic import get_image_extension, get_publish_id_from_link
+from antiintuit.basic import get_publish_id_from_link
 from antiintuit.config import Config
 from antiintuit.database import *
 from antiintuit.jobs.accounts_manager import get_authorized_session
 from antiintuit.jobs.courses_manager import subscribe_to_course
+from antiintuit.jobs.tests_solver.answers_generators import get_answers_generator
 from antiintuit.jobs.tests_solver.exceptions import *
+from antiintuit.jobs.tests_solver.images import get_image_name
 from antiintuit.jobs.tests_solver.queue_solution import *
 from antiintuit.logger import exception, get_logger
+from antiintuit.metrics import measure, start_metrics_server, timed
+from antiintuit.parsing import find_element, parse_html
 
 __all__ = [
     "run_job",
-    "run_endless_job_loop"
+    "run_endless_job_loop",
+    "get_test_for_solving_query",
+    "claim_test"
 ]
 
 logger = get_logger("antiintuit", "tests_solver")
 
 
 def run_endless_job_loop():
+    start_metrics_server()
     iteration_count = count(1)
     while True:
         logger.info("It will be %i iteration without errors", next(iteration_count))
@@ -35,6 +40,7 @@ def run_endless_job_loop():
 
 
 @exception(logger)
+@timed("tests_solver")
 def run_job(test: Test = None, account: Account = None):
     """Get a test and pass it."""
     test_course_account, session = None, None
@@ -81,8 +87,8 @@ def pass_test(test_course_account: dict, session: Session, no_accept=True):
                        len(questions), test.questions_count)
     else:
         logger.info("Test is finished and having %i questions.", len(questions))
-    test_page_bs = get_test_page_bs(test.publish_id, session)
-    is_test_passed, grade = update_answers(questions, answers, test_page_bs, session).values()
+    test_page_bs = get_test_page_bs(test, session)
+    is_test_passed, grade = update_answers(questions, answers, test_page_bs, session, test).values()
     logger.info("Test '%s' is%s passed with grade %i/100.", str(test), "" if is_test_passed else " not", grade)
     if not no_accept and is_test_passed:
         accept_test(test, account, session)
@@ -94,29 +100,22 @@ def pass_test(test_course_account: dict, session: Session, no_accept=True):
 def get_test_course_account(self_test: Test = None, account: Account = None):
     """Returns course and account of the first suitable test"""
     try:
-        if self_test is None:
-            wait_in_the_queue()
-            skip_courses_query = (Test
-                                  .select(Test.course)
-                                  .where(Test.last_scan_at > Config.get_test_scan_timeout_moment()))
-            test = (Test
-                    .select(Test,
-                            ((Test.average_rating + Test.last_rating + Test.max_rating) * 5 +
-                             Test.passed_count * 3 + Test.not_passed_count).alias("passing_score"))
-                    .join(Account, on=(Account.id == Test.watcher))
-                    .where(Test.watcher.is_null(False) &
-                           (Account.reserved_until < Config.get_account_reserve_out_moment()) &
-                           (Test.course.not_in(skip_courses_query)))
-                    .order_by(SQL("`passing_score`"), Test.max_rating, Test.average_rating,
-                              Test.last_scan_at, Test.created_at)
-                    .limit(1)).get()
+        if self_test is None and Config.CLAIM_TESTS_IN_DATABASE:
+            test = claim_test()
+        elif self_test is None:
+            with measure("tests_solver", "queue_wait"):
+                wait_in_the_queue()
+            test = get_test_for_solving_query().get()
+            renew_place_in_the_queue()
         else:
             test = self_test
         course, subscribe = test.course, None
         if account is None:
             account = test.watcher
-            account.reserve()
-            test.update_last_update()
+            if self_test is not None or not Config.CLAIM_TESTS_IN_DATABASE:
+                # A claimed test and its watcher are already reserved
+                account.reserve()
+                test.update_last_update()
             if self_test is None:
                 get_out_of_the_queue()
             subscribe = Subscribe.get_or_none((Subscribe.account == account) & (Subscribe.course == course))
@@ -135,6 +134,59 @@ def get_test_course_account(self_test: Test = None, account: Account = None):
     }
 
 
+def get_test_for_solving_query():
+    """Returns the query of the first suitable test for solving"""
+    return (Test
+            .select()
+            .join(Account, on=(Account.id == Test.watcher))
+            .switch(Test)
+            .join(Course, on=(Course.id == Test.course))
+            .where(Test.watcher.is_null(False) &
+                   (Account.reserved_until < Config.get_account_reserve_out_moment()) &
+                   (Course.next_eligible_at <= datetime.utcnow()))
+            # Complete tests are solved only if tests with unknown questions can't be solved now
+            .order_by(Test.completeness, Test.priority, Test.max_rating, Test.average_rating, Test.last_scan_at,
+                      Test.created_at)
+            .limit(1))
+
+
+@timed("tests_solver")
+def claim_test(attempts: int = 10) -> Test:
+    """Selects the first suitable test and reserves it and its watcher in one transaction without the Session Queue.
+    Postgres and MySQL skip tests which are being claimed by other sessions, other databases retry a conditional
+    reservation. Raises Test.DoesNotExist if there isn't a suitable test."""
+    database = Test._meta.database
+    if isinstance(database, (peewee.PostgresqlDatabase, peewee.MySQLDatabase)):
+        with database.atomic():
+            # Rows of the test, its course and its watcher are locked until the end of the transaction
+            test = get_test_for_solving_query().for_update("FOR UPDATE SKIP LOCKED").get()
+            Account.update({Account.reserved_until: datetime.utcnow()}).where(Account.id == test.watcher_id).execute()
+            test.update_last_update()
+        return test
+    for _ in range(attempts):
+        test = get_test_for_solving_query().get()
+        with database.atomic() as transaction:
+            claimed_at = datetime.utcnow()
+            is_account_reserved = (Account
+                                   .update({Account.reserved_until: claimed_at})
+                                   .where((Account.id == test.watcher_id) &
+                                          (Account.reserved_until < Config.get_account_reserve_out_moment()))
+                                   ).execute()
+            next_eligible_at = claimed_at + timedelta(seconds=Config.TEST_SCAN_INTERVAL)
+            is_course_reserved = is_account_reserved and (Course
+                                                          .update({Course.next_eligible_at: next_eligible_at})
+                                                          .where((Course.id == test.course_id) &
+                                                                 (Course.next_eligible_at <= claimed_at))
+                                                          ).execute()
+            if is_course_reserved:
+                test.last_scan_at = claimed_at
+                test.save()
+                return test
+            transaction.rollback()
+        logger.debug("Test '%s' has been claimed by another session.", str(test))
+    raise Test.DoesNotExist("Couldn't claim a test in {} attempts.".format(attempts))
+
+
 def get_passed_questions_and_answers(test: Test, course: Course, account: Account, session: Session):
     """Returns questions and answers of the current test passing"""
     questions, answers, similar_iterations_count = list(), list(), 0
@@ -144,6 +196,7 @@ def get_passed_questions_and_answers(test: Test, course: Course, account: Accoun
         logger.debug("%i of %i question", len(questions) + 1, test.questions_count)
         if similar_iterations_count == Config.MAX_ITERATIONS_OF_RECEIVING_QUESTIONS:
             raise MaxIterationsReached("For '{}' test iteration maximum number has been reached.".format(str(test)))
+        Question.extend_session_locks()
         question_form_bs = get_question_form(post_data, session)
         if question_form_bs is None:
             break
@@ -158,12 +211,15 @@ def get_passed_questions_and_answers(test: Test, course: Course, account: Accoun
                            "Waiting %i seconds...", str(question), similar_iterations_count, latency_time)
             sleep(latency_time)
             continue
-        answer = question.get_next_answer()
+        answer = get_next_answer(question)
         if answer is None:
             logger.warning("Question '%s' doesn't have answers and they will be deleted and recreated.",
                            str(question))
             question.delete_answers()
-            answer = generate_answers(question)[0]
+            answer = generate_answers(question)
+        elif answer.status == "W" and not question.is_lazy:
+            # Candidates of a lazy question are exhausted when it has only wrong answers
+            answer = record_unknown_candidates(question) or answer
         logger.info("Answer '%s' (status: '%s') has been selected as answer on '%s' question.",
                     str(answer), answer.status, str(question))
 
@@ -183,10 +239,11 @@ def get_passed_questions_and_answers(test: Test, course: Course, account: Accoun
 def get_test_page_bs(test: Test, session: Session) -> BeautifulSoup:
     """Returns test page as BeautifulSoup"""
     test_page_response = session.get(test.link, verify=Config.INTUIT_SSL_VERIFY)
-    test_page_bs = BeautifulSoup(test_page_response.text, "html.parser")
+    test_page_bs = parse_html(test_page_response.text)
     return test_page_bs
 
 
+@timed("tests_solver")
 def start_test(test: Test, course: Course, account: Account, session: Session) -> dict:
     """Starts to pass an test and returns post data for the first question"""
     repeat_test(test, account, session)
@@ -207,13 +264,15 @@ def start_test(test: Test, course: Course, account: Account, session: Session) -
     return post_data
 
 
+@timed("tests_solver")
 def get_question_form(post_data: dict, session: Session) -> BeautifulSoup:
     """Returns a form of the question from a page"""
     question_json = session.post("{}/int_studies/json/callback_display_test_task".format(Config.WEBSITE),
                                  data=post_data, verify=Config.INTUIT_SSL_VERIFY).json()
-    question_bs = BeautifulSoup(question_json["data"], "html.parser")
-    question_form_bs = question_bs.find("form", id="test-task-form")
+    question_form_bs = find_element(question_json["data"], "form", id="test-task-form")
     if question_form_bs is None:
+        # The page without the question is parsed in full to find out the reason
+        question_bs = parse_html(question_json["data"])
         laboratory_work_form = question_bs.find("form", {"class": "laboratory-work-form"})
         error_bs = question_bs.find("div", {"class": "eoi"})
         if 'попытка сдачи теста будет доступна через' in error_bs.text:
@@ -226,6 +285,7 @@ def get_question_form(post_data: dict, session: Session) -> BeautifulSoup:
     return question_form_bs
 
 
+@timed("tests_solver")
 def get_or_create_question(question_form_bs: BeautifulSoup, course: Course) -> Question:
     """Finds a question by hash or create the new question if it not exist"""
     task_id = get_question_publish_id(question_form_bs)
@@ -256,20 +316,23 @@ def get_or_create_question(question_form_bs: BeautifulSoup, course: Course) -> Q
         generate_answers(question)
     else:
         logger.debug("Question '%s' exists.", str(question))
-        end_session_checks_datetime = datetime.utcnow() + timedelta(seconds=Config.MAX_LATENCY_FOR_SESSION_CHECKS)
-        while question.locked_by is not None and question.locked_by != Config.SESSION_ID:
-            time_left = end_session_checks_datetime - datetime.utcnow()
-            if time_left <= timedelta():
-                logger.warning("Question '%s' is locked too much time. Question will be forcibly selected.",
-                               str(question))
+        while True:
+            if question.is_locked_by_another:
+                time_left = question.lock_expires_at - datetime.utcnow()
+                logger.debug("Question '%s' is locked by another's SESSION_ID during '%s' yet. Waiting...",
+                             str(question), str(time_left).split(".")[0])
+                # Locks of the current test passing mustn't expire while the session is waiting
+                Question.extend_session_locks()
+                with measure("tests_solver", "lock_wait"):
+                    wait_questions_unlock(question.locked_by,
+                                          min(time_left.total_seconds(), Config.QUESTION_LOCK_LEASE / 2))
+                question = Question.get_by_id(question.id)
+            elif question.is_right_answer_exists or question.type not in ("multiple", "single", "correlation"):
+                break
+            elif question.lock():
+                logger.debug("Question doesn't have a right answer and has been locked by Session '%s'.",
+                             Config.SESSION_ID)
                 break
-            logger.debug("Question '%s' is locked by another's SESSION_ID during '%s' yet. Waiting...",
-                         str(question), str(time_left).split(".")[0])
-            sleep(Config.INTERVAL_BETWEEN_SESSION_CHECK)
-            question = Question.get_or_none(Question.task_id == task_id)
-        if not question.is_right_answer_exists and question.type in ("multiple", "single", "correlation"):
-            logger.debug("Question doesn't have a right answer and will be locked by Session '%s'.", Config.SESSION_ID)
-            question.lock()
         # This condition can be removed when questions don't have one without original_html
         if question.original_html is None:
             question.original_html = str(question_form_bs)
@@ -277,6 +340,7 @@ def get_or_create_question(question_form_bs: BeautifulSoup, course: Course) -> Q
     return question
 
 
+@timed("tests_solver")
 def wait_timeout(started_at: datetime):
     """Wait pause between answers requests"""
     timeout = Config.INTERVAL_BETWEEN_QUESTIONS
@@ -288,52 +352,69 @@ def wait_timeout(started_at: datetime):
         sleep(time_for_sleep)
 
 
-def generate_answers(question: Question) -> list or str:
-    if question.type in ("multiple", "single"):
-        answers = generate_default_answers(question)
-    elif question.type == "correlation":
-        answers = generate_correlation_answers(question)
-    elif question.type == "template":
-        answers = [Answer.create(variants=question.variants, question=question)]
-    else:
-        raise IncorrectTestType("Question '{}' has incorrect '{}' type and system can't generate new answers.".format(
-            question.title, question.type))
-    logger.info("Question '%s' has been created with %i answers and locked by '%s'.", str(question),
-                len(answers), Config.SESSION_ID)
-    return answers
-
-
-def generate_default_answers(question: Question):
-    """Generates combinations of answers for multiple or single question and records them in database"""
-    variants, answers = question.variants, []
-    max_combinations_range = 1
-    if question.type == "multiple":
-        max_combinations_range = len(variants)
-    elif question.type != "single":
-        raise IncorrectTestType("Question '{}' has incorrect '{}' type and system can't generate answers.".format(
-            question.title, question.type))
-    for range_size in range(1, max_combinations_range + 1):
-        for answer_combination in combinations(variants, range_size):
-            answers.append(Answer.create(variants=list(answer_combination), question=question))
-    logger.debug("Generated %i answers for %s question.", len(answers), str(question))
-    return answers
-
-
-def generate_correlation_answers(question: Question):
-    """Generates combinations of answers for a correlation question and records them in database"""
-    variants, answers = question.variants, list()
-    all_variants = list()
-    for variant in variants:
-        variant, answer_variants = list(variant), list()
-        options = variant[2]
-        for option in options:
-            variant[2] = option
-            answer_variants.append(tuple(variant))
-        all_variants.append(answer_variants)
-    all_variants = product(*all_variants)
-    answers = [Answer.create(variants=vs, question=question) for vs in all_variants]
-    logger.debug("Generated %i answers for %s question.", len(answers), str(question))
-    return answers
+@timed("tests_solver")
+def generate_answers(question: Question) -> Answer:
+    """Generates answers of the question by the strategy of its type, records them and returns the first one.
+    In the lazy mode only the cursor of the question is set and only the first answer is recorded."""
+    answers_generator = get_answers_generator(question)
+    if Config.LAZY_ANSWERS_GENERATION:
+        question.reset_answers_cursor(answers_generator.count())
+        return get_next_answer(question)
+    return create_answers(question, iter(answers_generator))
+
+
+def record_unknown_candidates(question: Question) -> Answer or None:
+    """Records candidates of the question which aren't known as wrong answers and returns the first one.
+    Returns None if all candidates are known as wrong."""
+    answers = iter(get_answers_generator(question))
+    first_answer = next(answers, None)
+    if first_answer is None:
+        logger.warning("All candidates of '%s' question are known as wrong answers.", str(question))
+        return None
+    logger.warning("Question '%s' has only wrong answers and candidates which aren't known yet will be recorded.",
+                   str(question))
+    return create_answers(question, chain((first_answer,), answers))
+
+
+def get_next_answer(question: Question) -> Answer or None:
+    """Returns the first right or unchecked answer of the question. The next candidate of a lazy question is
+    recorded if the question doesn't have such recorded answers."""
+    answer = question.get_next_answer()
+    if not question.is_lazy or (answer is not None and answer.status != "W"):
+        return answer
+    answers_generator = get_answers_generator(question)
+    eliminated_candidates, candidate_index = question.eliminated_candidates, question.answers_cursor
+    while candidate_index in eliminated_candidates:
+        candidate_index += 1
+    next_answer = answers_generator.get(candidate_index)
+    if next_answer is None:
+        logger.warning("All candidates of '%s' question have been checked.", str(question))
+        return answer
+    with Answer._meta.database.atomic():
+        next_answer.candidate_index = candidate_index
+        next_answer.save()
+        question.move_answers_cursor(candidate_index + 1)
+    logger.debug("Candidate %i has been recorded for '%s' question.", candidate_index, str(question))
+    return next_answer
+
+
+def create_answers(question: Question, answers) -> Answer:
+    """Records answers by batches inside one transaction and returns the first answer"""
+    started_at = perf_counter()
+    with Answer._meta.database.atomic():
+        first_answer = next(answers, None)
+        if first_answer is None:
+            raise TestSolverException("Question '{}' doesn't have answers which aren't wrong.".format(str(question)))
+        first_answer.save()
+        answers_count = 1
+        for answers_batch in chunked(answers, Config.ANSWERS_INSERT_BATCH_SIZE):
+            Answer.bulk_create(answers_batch)
+            answers_count += len(answers_batch)
+        question.add_unchecked_answers(answers_count)
+    elapsed_time = perf_counter() - started_at
+    logger.info("Question '%s' has been created with %i answers (%.0f rows/sec) and locked by '%s'.", str(question),
+                answers_count, answers_count / elapsed_time if elapsed_time > 0 else answers_count, Config.SESSION_ID)
+    return first_answer
 
 
 def get_answer_for_post_request(answer: Answer, question: Question = None) -> dict:
@@ -341,11 +422,11 @@ def get_answer_for_post_request(answer: Answer, question: Question = None) -> di
     question = question or answer.question
     if question.type in ("single", "multiple", "template"):
         return dict(
-            map(lambda var: (var[0], var[1]), answer.variants)
+            map(lambda var: (var[0], var[1]), answer.get_variants(question))
         )
     elif question.type == "correlation":
         return dict(
-            map(lambda var: (var[0], var[2][0]), answer.variants)
+            map(lambda var: (var[0], var[2][0]), answer.get_variants(question))
         )
     else:
         raise IncorrectTestType("Question '{}' has incorrect '{}' type and system can't send answers.".format(
@@ -427,15 +508,41 @@ def get_question_publish_id(form: BeautifulSoup) -> int:
     return int(data["idtask_edi_eoi"])
 
 
-def update_answers(questions: list, answers: list, test_page_bs: BeautifulSoup, session: Session) -> dict:
+def update_tests_completeness(test: Test, questions: list):
+    """Links the questions with the test and updates the completeness of tests which contain the questions.
+    A new question of the test makes it incomplete again."""
+    if questions:
+        met_questions_ids = set(question_id for question_id, in (TestQuestion
+                                                                 .select(TestQuestion.question)
+                                                                 .where(TestQuestion.test == test)
+                                                                 .tuples()))
+        new_questions = [question for question in questions if question.id not in met_questions_ids]
+        if new_questions:
+            TestQuestion.insert_many([{"test": test, "question": question} for question in new_questions]) \
+                .on_conflict_ignore().execute()
+            test.attempts_without_new_questions = 0
+        else:
+            test.attempts_without_new_questions += 1
+        tests_ids = (TestQuestion
+                     .select(TestQuestion.test)
+                     .where(TestQuestion.question.in_(questions) & (TestQuestion.test != test))
+                     .distinct())
+        for linked_test in Test.select().where(Test.id.in_(tests_ids)):
+            linked_test.update_completeness()
+    test.update_completeness()
+    logger.debug("'%s' test has %.0f%% of questions with known answers.", str(test), test.completeness * 100)
+
+
+@timed("tests_solver")
+def update_answers(questions: list, answers: list, test_page_bs: BeautifulSoup, session: Session,
+                   test: Test = None) -> dict:
     """Updates answers statuses and returns True if test has passed"""
     results_answers_anchor = test_page_bs.find("a", {"destination_block_id": "course-test-dialog"})
     answers_results_post_data = dict(map(lambda v: v.split("="), results_answers_anchor["request_data"].split("&")))
     answers_results_url = "{}/int_studies/json/callback_display_test_task_list".format(Config.WEBSITE)
     answers_results_json = session.post(answers_results_url, answers_results_post_data,
                                         verify=Config.INTUIT_SSL_VERIFY).json()
-    answers_results_bs = BeautifulSoup(answers_results_json["data"], "html.parser")
-    test_task_list = answers_results_bs.find("div", id="test_task_list")
+    test_task_list = find_element(answers_results_json["data"], "div", id="test_task_list")
     right_answers_count, questions_count = 0, len(questions)
     for num, question, answer in zip(count(1), questions, answers):
         # Checking id in an answers list and a question
@@ -452,7 +559,7 @@ def update_answers(questions: list, answers: list, test_page_bs: BeautifulSoup,
                         num, questions_count, str(answer), str(question))
             if question.type != "template" and question.unchanged_answers_count == 1:
                 logger.debug("Question has the one unchecked answer. Previously it will be marked as right.")
-                prev_answer = question.get_next_answer()
+                prev_answer = get_next_answer(question)
                 prev_answer.set_as_right()
         elif "correct" in answer_span["class"]:
             right_answers_count += 1
@@ -461,6 +568,8 @@ def update_answers(questions: list, answers: list, test_page_bs: BeautifulSoup,
             logger.info("%i of %i: Answer '%s' of '%s' question is correct.",
                         num, questions_count, str(answer), str(question))
     Question.unlock_all_session_question()
+    if test is not None:
+        update_tests_completeness(test, questions)
     results_table = test_page_bs.find("table", id="test-results-table")
     results_table_trs = results_table.find_all("td", {"class": "value"})
     passed_result_text = results_table_trs[-1].text
@@ -480,17 +589,7 @@ def get_handled_content(element: BeautifulSoup) -> str:
         if child.name == "img" and child.has_attr("src"):
             del child["style"]
             img_src = "{}{}".format(Config.WEBSITE, child["src"])
-            img_response = requests.get(img_src, verify=Config.INTUIT_SSL_VERIFY)
-            img_hash = sha3_256(img_response.content).hexdigest()
-            img_name = "{}.{}".format(img_hash, get_image_extension(img_response.headers["Content-Type"]))
-            img_path = Config.get_static_directory_path().joinpath(img_name)
-            child["src"] = "{" + img_name + "}"
-            if not img_path.exists():
-                with img_path.open("wb") as image_file:
-                    image_file.write(img_response.content)
-                    logger.debug("Saved new image at '%s'.", str(img_path.absolute()))
-            else:
-                logger.debug("Image '%s' already exist.", str(img_path.absolute()))
+            child["src"] = "{" + get_image_name(img_src) + "}"
         elif child.name is not None:
             child = child.text
         content += str(child)
@@ -0,0 +1,172 @@
+from bisect import bisect_left
+from contextlib import nullcontext
+from functools import wraps
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Lock, Thread
+from time import perf_counter
+
+from antiintuit.config import Config
+from antiintuit.logger import get_logger
+
+__all__ = [
+    "Counter",
+    "Histogram",
+    "STAGE_DURATION",
+    "is_metrics_enabled",
+    "measure",
+    "timed",
+    "get_metrics_text",
+    "start_metrics_server"
+]
+
+logger = get_logger("antiintuit", "metrics")
+metrics_server = None
+# All metrics of the process in order of their creation
+registry = list()
+
+
+def render_labels(label_names: tuple, labels_values: tuple) -> str:
+    return ",".join('{}="{}"'.format(name, str(value).replace("\\", "\\\\").replace('"', '\\"'))
+                    for name, value in zip(label_names, labels_values))
+
+
+class Counter:
+    """Counter of events by labels which is rendered in the Prometheus text format.
+    Counters are cheap, so they are counted even if metrics aren't served."""
+
+    def __init__(self, name: str, description: str, label_names: tuple = ()):
+        self.name, self.description, self.label_names = name, description, label_names
+        self.values, self.lock = dict(), Lock()
+        registry.append(self)
+
+    def inc(self, *labels_values: str, amount: int = 1):
+        with self.lock:
+            self.values[labels_values] = self.values.get(labels_values, 0) + amount
+
+    def get(self, *labels_values: str) -> int:
+        return self.values.get(labels_values, 0)
+
+    def render(self) -> str:
+        lines = ["# HELP {} {}".format(self.name, self.description), "# TYPE {} counter".format(self.name)]
+        with self.lock:
+            values = sorted(self.values.items())
+        for labels_values, value in values:
+            lines.append("{}{{{}}} {}".format(self.name, render_labels(self.label_names, labels_values), value))
+        return "\n".join(lines) + "\n"
+
+
+class Histogram:
+    """Histogram of values by labels which is rendered in the Prometheus text format"""
+
+    def __init__(self, name: str, description: str, label_names: tuple,
+                 buckets: tuple = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)):
+        self.name, self.description, self.label_names = name, description, label_names
+        self.buckets = tuple(sorted(buckets))
+        # Counts of values in buckets (the last one is +Inf), the sum and the count of values by labels values
+        self.series, self.lock = dict(), Lock()
+        registry.append(self)
+
+    def observe(self, value: float, *labels_values: str):
+        with self.lock:
+            series = self.series.get(labels_values)
+            if series is None:
+                series = self.series[labels_values] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][bisect_left(self.buckets, value)] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self) -> str:
+        lines = ["# HELP {} {}".format(self.name, self.description), "# TYPE {} histogram".format(self.name)]
+        with self.lock:
+            series_items = [(labels, list(counts), total, count)
+                            for labels, (counts, total, count) in sorted(self.series.items())]
+        for labels_values, counts, total, count in series_items:
+            labels = render_labels(self.label_names, labels_values)
+            cumulative_count = 0
+            for bound, bucket_count in zip(self.buckets + ("+Inf",), counts):
+                cumulative_count += bucket_count
+                lines.append('{}_bucket{{{}{}le="{}"}} {}'.format(self.name, labels, "," if labels else "",
+                                                                  bound, cumulative_count))
+            lines.append("{}_sum{{{}}} {}".format(self.name, labels, total))
+            lines.append("{}_count{{{}}} {}".format(self.name, labels, count))
+        return "\n".join(lines) + "\n"
+
+
+STAGE_DURATION = Histogram("antiintuit_stage_duration_seconds", "Duration of stages of jobs", ("job", "stage"))
+
+
+def is_metrics_enabled() -> bool:
+    """Metrics are collected only if the port of the metrics endpoint is set"""
+    return Config.METRICS_PORT is not None
+
+
+def measure(job: str, stage: str):
+    """Returns the context manager which observes the duration of its block as the stage of the job"""
+    if not is_metrics_enabled():
+        return nullcontext()
+    return StageTimer(job, stage)
+
+
+def timed(job: str, stage: str = None):
+    """Decorator which observes durations of the function as the stage of the job (the function name by default).
+    Without metrics the function is returned as is."""
+
+    def decorator(func):
+        if not is_metrics_enabled():
+            return func
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with StageTimer(job, stage or func.__name__):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+class StageTimer:
+    __slots__ = ("job", "stage", "started_at")
+
+    def __init__(self, job: str, stage: str):
+        self.job, self.stage, self.started_at = job, stage, None
+
+    def __enter__(self):
+        self.started_at = perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        STAGE_DURATION.observe(perf_counter() - self.started_at, self.job, self.stage)
+
+
+def get_metrics_text() -> str:
+    """Returns all metrics of the process in the Prometheus text format"""
+    return "".join(metric.render() for metric in registry)
+
+
+class MetricsRequestHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = bytes(get_metrics_text(), "utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug("Metrics request from %s: %s", self.address_string(), format % args)
+
+
+def start_metrics_server() -> ThreadingHTTPServer or None:
+    """Starts the metrics endpoint on METRICS_PORT in a background thread if it's set and isn't started yet"""
+    global metrics_server
+    if not is_metrics_enabled() or metrics_server is not None:
+        return metrics_server
+    metrics_server = ThreadingHTTPServer(("", int(Config.METRICS_PORT)), MetricsRequestHandler)
+    metrics_server.daemon_threads = True
+    Thread(target=metrics_server.serve_forever, name="metrics-server", daemon=True).start()
+    logger.info("Metrics are served on %i port.", int(Config.METRICS_PORT))
+    return metrics_server
@@ -0,0 +1,32 @@
+from bs4 import BeautifulSoup, SoupStrainer
+
+from antiintuit.metrics import timed
+
+__all__ = [
+    "HTML_PARSER",
+    "parse_html",
+    "find_element"
+]
+
+try:
+    import lxml  # noqa: F401
+
+    HTML_PARSER = "lxml"
+except ImportError:
+    # The pure-Python parser is several times slower, but it doesn't need the C library
+    HTML_PARSER = "html.parser"
+
+
+@timed("parsing")
+def parse_html(markup: str, name=None, attrs: dict = None, **kwargs) -> BeautifulSoup:
+    """Parses the markup by the fastest available parser.
+    If name, attrs or kwargs are given (as for BeautifulSoup.find) only the matched elements are built."""
+    if name is None and not attrs and not kwargs:
+        return BeautifulSoup(markup, HTML_PARSER)
+    return BeautifulSoup(markup, HTML_PARSER, parse_only=SoupStrainer(name, attrs or {}, **kwargs))
+
+
+def find_element(markup: str, name, attrs: dict = None, **kwargs):
+    """Returns the first element of the markup which matches the arguments (as BeautifulSoup.find) or None.
+    Other elements of the markup aren't built."""
+    return parse_html(markup, name, attrs, **kwargs).find(name, attrs or {}, **kwargs)
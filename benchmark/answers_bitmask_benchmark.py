@@ -0,0 +1,135 @@
+"""Benchmark of the answers table before and after the conversion of answers to bitmasks
+(migrations.migrate_answers_to_bitmask).
+
+The database is filled with multiple questions and all their answers in the former representation (JSON copies of
+the selected variants). The size of the answers table and timings of the query of answers of questions, of
+get_answer_for_post_request and of the API serializer (get_model_dict) are reported before and after
+the migration. The script exits with 1 if post data or serialized variants of answers change after the migration.
+The database is a temporary SQLite file unless DATABASE_* variables are given (an empty database has to be given
+then).
+
+    python benchmark/answers_bitmask_benchmark.py --questions 50 --variants 10
+"""
+import argparse
+import logging
+import sys
+import tempfile
+from datetime import datetime
+from itertools import combinations
+from os import environ
+from pathlib import Path
+from time import perf_counter
+
+sys.path.insert(0, str(Path(__file__).absolute().parent.parent))
+
+
+def fill_database(questions_count: int, variants_count: int):
+    """Inserts multiple questions and all combinations of their variants as answers with JSON variants"""
+    from antiintuit.database import Answer, Course, Question, create_tables, migrate_database
+    from benchmark.queries_plans import insert_rows
+
+    create_tables()
+    migrate_database()
+    course = Course.create(publish_id="bitmask/1", title="Course", published_on=datetime.utcnow().date())
+    for task_id in range(questions_count):
+        variants = [["answer[{}]".format(num), str(num), "Вариант ответа номер {} на вопрос {}".format(num, task_id)]
+                    for num in range(variants_count)]
+        question = Question.create(task_id=task_id, title="Question {}".format(task_id), type="multiple",
+                                   course=course, variants=variants, original_html="")
+        insert_rows(Answer, [{"question": question.id, "_variants": Answer.dump_variants(list(selected)),
+                              "mask": None, "status": "W" if size < variants_count else "U"}
+                             for size in range(1, variants_count + 1)
+                             for selected in combinations(variants, size)])
+
+
+def get_table_size(model) -> int:
+    """Returns bytes of the table and its indexes"""
+    from peewee import MySQLDatabase, PostgresqlDatabase
+
+    database, table_name = model._meta.database, model._meta.table_name
+    if isinstance(database, PostgresqlDatabase):
+        return database.execute_sql("SELECT pg_total_relation_size(%s)", (table_name,)).fetchone()[0]
+    elif isinstance(database, MySQLDatabase):
+        return database.execute_sql("SELECT data_length + index_length FROM information_schema.tables "
+                                    "WHERE table_schema = DATABASE() AND table_name = %s", (table_name,)).fetchone()[0]
+    indexes_names = [index.name for index in database.get_indexes(table_name)]
+    names = [table_name] + indexes_names
+    return database.execute_sql("SELECT SUM(pgsize) FROM dbstat WHERE name IN ({})".format(
+        ", ".join("?" * len(names))), names).fetchone()[0]
+
+
+def compact_table(model):
+    """Returns free space of deleted values to the database, as operators do after the migration"""
+    from peewee import MySQLDatabase, PostgresqlDatabase
+
+    database, table_name = model._meta.database, model._meta.table_name
+    if isinstance(database, PostgresqlDatabase):
+        database.execute_sql("VACUUM FULL {}".format(table_name))
+    elif isinstance(database, MySQLDatabase):
+        database.execute_sql("OPTIMIZE TABLE {}".format(table_name))
+    else:
+        database.execute_sql("VACUUM")
+
+
+def measure(label: str) -> tuple:
+    """Returns figures of the answers table and post data with serialized variants of all answers"""
+    from antiintuit.api.functions import attach_questions, get_model_dict
+    from antiintuit.database import Answer, Question
+    from antiintuit.jobs.tests_solver.tests_solver import get_answer_for_post_request
+
+    database, questions = Answer._meta.database, list(Question.select())
+    query_seconds, post_seconds, serializer_seconds, results = 0, 0, 0, list()
+    for question in questions:
+        answers_query = Answer.select().where(Answer.question == question).order_by(Answer.id)
+        # Rows are fetched by the cursor, so the time doesn't include building models
+        started_at = perf_counter()
+        database.execute(answers_query).fetchall()
+        query_seconds += perf_counter() - started_at
+        answers = list(answers_query)
+        started_at = perf_counter()
+        posts_data = [get_answer_for_post_request(answer, question) for answer in answers]
+        post_seconds += perf_counter() - started_at
+        # The API serializes answers as get_data_for_sending does for /questions/<id>/answers
+        started_at = perf_counter()
+        attach_questions(answers)
+        variants = [get_model_dict(answer)["variants"] for answer in answers]
+        serializer_seconds += perf_counter() - started_at
+        results.append((posts_data, variants))
+    rows_count = Answer.select().count()
+    figures = (label, rows_count, get_table_size(Answer), query_seconds, post_seconds, serializer_seconds)
+    return figures, results
+
+
+def print_report(figures: list):
+    print("{:<10}{:>10}{:>14}{:>16}{:>12}{:>12}{:>16}".format("answers", "rows", "table, KiB", "bytes/row",
+                                                              "query, s", "post, s", "serializer, s"))
+    for label, rows_count, size, query_seconds, post_seconds, serializer_seconds in figures:
+        print("{:<10}{:>10}{:>14.0f}{:>16.1f}{:>12.3f}{:>12.3f}{:>16.3f}".format(
+            label, rows_count, size / 1024, size / rows_count, query_seconds, post_seconds, serializer_seconds))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark of the conversion of answers to bitmasks")
+    parser.add_argument("--questions", type=int, default=50, help="Multiple questions")
+    parser.add_argument("--variants", type=int, default=10, help="Variants of questions (2^N-1 answers each)")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as temp_directory:
+        environ.setdefault("DATABASE_NAME", str(Path(temp_directory).joinpath("bitmask.db")))
+        environ["STATIC_DIRECTORY"] = str(Path(temp_directory).joinpath("static"))
+        from antiintuit.database import Answer, migrate_answers_to_bitmask
+
+        logging.getLogger("antiintuit").setLevel(logging.CRITICAL)
+        fill_database(args.questions, args.variants)
+        compact_table(Answer)
+        before_figures, before_results = measure("JSON")
+        started_at = perf_counter()
+        migrate_answers_to_bitmask()
+        migration_seconds = perf_counter() - started_at
+        compact_table(Answer)
+        after_figures, after_results = measure("bitmask")
+    print_report([before_figures, after_figures])
+    print("Migration: {:.3f} s".format(migration_seconds))
+    if after_results != before_results:
+        print("Post data or variants of answers have changed after the migration.", file=sys.stderr)
+        sys.exit(1)
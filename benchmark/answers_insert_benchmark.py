@@ -0,0 +1,121 @@
+"""Benchmark of recording answers (candidates) of new questions (tests_solver.create_answers).
+
+Candidates of "multiple" and "correlation" questions are recorded by one INSERT per answer (autocommitted as before
+the batched path) and by batched INSERTs inside one transaction with several batch sizes
+(ANSWERS_INSERT_BATCH_SIZE). The report contains rows per second of every mode and the speedup against
+the row-by-row mode. The script exits with 1 if a question doesn't get all its candidates. The database is
+a temporary SQLite file unless DATABASE_* variables are given (e.g. MariaDB or Postgres, an empty database has
+to be given then).
+
+    python benchmark/answers_insert_benchmark.py --variants 10 --items 5 --questions 5 --batch-sizes 50 100 500
+"""
+import argparse
+import logging
+import sys
+import tempfile
+from datetime import datetime
+from itertools import count
+from os import environ
+from pathlib import Path
+from time import perf_counter
+
+sys.path.insert(0, str(Path(__file__).absolute().parent.parent))
+
+tasks_ids = count(1)
+
+
+def create_question(course, question_type: str, variants_count: int):
+    """Creates a question with distinct variants (correlation items have the same options)"""
+    from antiintuit.database import Question
+
+    if question_type == "correlation":
+        options = [[str(num), "Option {}".format(num)] for num in range(variants_count)]
+        variants = [["item{}".format(num), "Item {}".format(num), options] for num in range(variants_count)]
+    else:
+        variants = [["answer", str(num), "Variant {}".format(num)] for num in range(variants_count)]
+    task_id = next(tasks_ids)
+    return Question.create(task_id=task_id, title="Question {}".format(task_id), type=question_type, course=course,
+                           variants=variants, original_html="")
+
+
+def record_row_by_row(question) -> int:
+    """Records candidates by one autocommitted INSERT per answer"""
+    from antiintuit.jobs.tests_solver.answers_generators import get_answers_generator
+
+    answers_count = 0
+    for answer in get_answers_generator(question):
+        answer.save()
+        answers_count += 1
+    question.add_unchecked_answers(answers_count)
+    return answers_count
+
+
+def record_by_batches(question) -> int:
+    from antiintuit.jobs.tests_solver.answers_generators import get_answers_generator
+    from antiintuit.jobs.tests_solver.tests_solver import create_answers
+
+    create_answers(question, iter(get_answers_generator(question)))
+    return question.unchecked_count
+
+
+def run_benchmark(course, question_type: str, variants_count: int, questions_count: int, batch_size: int or None):
+    """Returns recorded rows, seconds and questions without all candidates. The batch size None means
+    the row-by-row mode."""
+    from antiintuit.config import Config
+    from antiintuit.database import Answer
+    from antiintuit.jobs.tests_solver.answers_generators import get_answers_generator
+
+    if batch_size is not None:
+        Config.ANSWERS_INSERT_BATCH_SIZE = batch_size
+    rows_count, elapsed, incomplete_questions = 0, 0, 0
+    for _ in range(questions_count):
+        question = create_question(course, question_type, variants_count)
+        started_at = perf_counter()
+        recorded_count = record_row_by_row(question) if batch_size is None else record_by_batches(question)
+        elapsed += perf_counter() - started_at
+        rows_count += recorded_count
+        if recorded_count != get_answers_generator(question).count() or \
+                Answer.select().where(Answer.question == question).count() != recorded_count:
+            incomplete_questions += 1
+    return rows_count, elapsed, incomplete_questions
+
+
+def prepare_database():
+    from antiintuit.database import Course, create_tables, migrate_database
+
+    create_tables()
+    migrate_database()
+    return Course.create(publish_id="answers/1", title="Course", published_on=datetime.utcnow().date())
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark of recording answers of new questions")
+    parser.add_argument("--variants", type=int, default=10, help="Variants of multiple questions (2^N-1 answers)")
+    parser.add_argument("--items", type=int, default=5, help="Items of correlation questions (N! answers)")
+    parser.add_argument("--questions", type=int, default=5, help="Questions of every type in every mode")
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[50, 100, 500])
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as temp_directory:
+        environ.setdefault("DATABASE_NAME", str(Path(temp_directory).joinpath("answers.db")))
+        environ["STATIC_DIRECTORY"] = str(Path(temp_directory).joinpath("static"))
+        import antiintuit  # noqa: F401
+
+        logging.getLogger("antiintuit").setLevel(logging.CRITICAL)
+        benchmark_course = prepare_database()
+        failed = False
+        print("{:<14}{:<16}{:>10}{:>12}{:>10}".format("question", "mode", "rows", "rows/sec", "speedup"))
+        for benchmark_type, benchmark_variants in (("multiple", args.variants), ("correlation", args.items)):
+            row_by_row_speed = None
+            for benchmark_batch_size in [None] + args.batch_sizes:
+                rows, seconds, incomplete = run_benchmark(benchmark_course, benchmark_type, benchmark_variants,
+                                                          args.questions, benchmark_batch_size)
+                speed = rows / seconds
+                row_by_row_speed = row_by_row_speed or speed
+                mode = "row by row" if benchmark_batch_size is None else "batches of {}".format(benchmark_batch_size)
+                print("{:<14}{:<16}{:>10}{:>12.0f}{:>9.1f}x".format(benchmark_type, mode, rows, speed,
+                                                                    speed / row_by_row_speed))
+                failed = failed or incomplete > 0
+    if failed:
+        print("Every question has to get all its candidates.", file=sys.stderr)
+        sys.exit(1)
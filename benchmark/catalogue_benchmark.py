@@ -0,0 +1,139 @@
+"""Benchmark of ingesting the catalogue of courses and tests of courses against the local stand-in of the website
+(replay_server.py).
+
+Every mode starts from an empty catalogue, makes a full scan of the catalogue pages (courses_manager.run_job),
+repeats it when all courses are known and adds tests of every course (tests_manager.create_tests_of_course).
+Courses and tests of a page are recorded by one lookup and one batched INSERT per page, and by the former lookup
+and INSERT per row. The report contains the time of every pass, the time of recording rows in the database and
+queries. The script exits with 1 if the database doesn't get all courses and tests of the stand-in. The database is
+a temporary SQLite file unless DATABASE_* variables are given (e.g. MariaDB, an empty database has to be given then).
+
+    python benchmark/catalogue_benchmark.py --courses 1000 --tests-per-course 5
+"""
+import argparse
+import importlib
+import logging
+import sys
+import tempfile
+from functools import wraps
+from os import environ
+from pathlib import Path
+from time import perf_counter
+
+sys.path.insert(0, str(Path(__file__).absolute().parent.parent))
+from benchmark.replay_server import Site, start_server  # noqa: E402
+from benchmark.solver_benchmark import QueriesCounter  # noqa: E402
+
+
+def create_new_courses_by_rows(courses_rows: list) -> int:
+    """Records courses as the courses manager did before batched inserts: a lookup and an INSERT per course"""
+    from antiintuit.database import Course
+
+    new_courses = 0
+    for row in courses_rows:
+        if Course.get_or_none(Course.publish_id == row["publish_id"]) is None:
+            Course.create(**row)
+            new_courses += 1
+    return new_courses
+
+
+def create_new_tests_by_rows(tests_rows: list) -> int:
+    """Records tests as the tests manager did before batched inserts: a lookup and an INSERT per test"""
+    from antiintuit.database import Test
+
+    new_tests = 0
+    for row in tests_rows:
+        if Test.get_or_none(Test.publish_id == row["publish_id"]) is None:
+            Test.create(**row)
+            new_tests += 1
+    return new_tests
+
+
+def measure_recording(function, database_seconds: dict):
+    """Returns the function which adds its time to the database time of the current pass"""
+
+    @wraps(function)
+    def wrapper(*args, **kwargs):
+        started_at = perf_counter()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            database_seconds["current"] += perf_counter() - started_at
+
+    return wrapper
+
+
+def run_passes(queries_counter: QueriesCounter, create_new_courses, create_new_tests) -> list:
+    """Returns names, seconds, database seconds and queries of the passes from an empty catalogue.
+    Rows of pages are recorded by the given functions."""
+    from antiintuit.basic import get_session
+    from antiintuit.database import Course, JobState, Test
+
+    courses_manager = importlib.import_module("antiintuit.jobs.courses_manager.courses_manager")
+    tests_manager = importlib.import_module("antiintuit.jobs.tests_manager.tests_manager")
+    database_seconds = {"current": 0}
+    courses_manager.create_new_courses = measure_recording(create_new_courses, database_seconds)
+    tests_manager.create_new_tests = measure_recording(create_new_tests, database_seconds)
+    with Test._meta.database.atomic():
+        Test.delete().execute()
+        Course.delete().execute()
+        JobState.delete().execute()
+
+    def add_tests_of_courses():
+        session = get_session()
+        for course in Course.select():
+            tests_manager.create_tests_of_course(course, None, session)
+
+    passes = list()
+    for name, function in (("catalogue", lambda: courses_manager.run_job(full_scan=True)),
+                           ("known catalogue", lambda: courses_manager.run_job(full_scan=True)),
+                           ("tests of courses", add_tests_of_courses)):
+        database_seconds["current"] = 0
+        started_at, queries_at = perf_counter(), queries_counter.count
+        function()
+        passes.append((name, perf_counter() - started_at, database_seconds["current"],
+                       queries_counter.count - queries_at))
+    return passes
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark of ingesting the catalogue of courses and tests")
+    parser.add_argument("--courses", type=int, default=1000)
+    parser.add_argument("--tests-per-course", type=int, default=5)
+    parser.add_argument("--courses-per-page", type=int, default=20)
+    args = parser.parse_args()
+
+    site = Site(args.courses, args.tests_per_course, questions_count=1, pool_size=1,
+                courses_per_page=args.courses_per_page, images_rate=0)
+    server = start_server(site)
+    with tempfile.TemporaryDirectory() as temp_directory:
+        environ.setdefault("DATABASE_NAME", str(Path(temp_directory).joinpath("catalogue.db")))
+        environ.update({
+            "WEBSITE": "http://{}:{}".format(*server.server_address),
+            "INTUIT_SSL_VERIFY": "false",
+            "STATIC_DIRECTORY": str(Path(temp_directory).joinpath("static")),
+        })
+        from antiintuit.database import Course, Test, create_tables, migrate_database
+        from antiintuit.jobs.courses_manager.courses_manager import create_new_courses
+        from antiintuit.jobs.tests_manager.tests_manager import create_new_tests
+
+        logging.getLogger("antiintuit").setLevel(logging.CRITICAL)
+        create_tables()
+        migrate_database()
+        benchmark_queries_counter = QueriesCounter()
+        peewee_logger = logging.getLogger("peewee")
+        peewee_logger.setLevel(logging.DEBUG)
+        peewee_logger.addHandler(benchmark_queries_counter)
+        failed = False
+        print("{:<14}{:<20}{:>10}{:>14}{:>10}".format("mode", "pass", "seconds", "database, s", "queries"))
+        for mode, recorders in (("rows", (create_new_courses_by_rows, create_new_tests_by_rows)),
+                                ("batches", (create_new_courses, create_new_tests))):
+            for pass_name, seconds, database_seconds, queries in run_passes(benchmark_queries_counter, *recorders):
+                print("{:<14}{:<20}{:>10.3f}{:>14.3f}{:>10}".format(mode, pass_name, seconds, database_seconds,
+                                                                    queries))
+            failed = failed or (Course.select().count() != args.courses or
+                                Test.select().count() != args.courses * args.tests_per_course)
+    server.shutdown()
+    if failed:
+        print("All courses and tests of the stand-in have to be recorded.", file=sys.stderr)
+        sys.exit(1)
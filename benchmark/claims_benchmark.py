@@ -0,0 +1,139 @@
+"""Multi-process benchmark of claiming tests in the database (tests_solver.claim_test) without the Session Queue.
+
+The database is filled with courses which have one test each and distinct watchers, then every process claims tests
+until there isn't a suitable one. A claimed test isn't suitable until the reservation of its watcher and its course
+expire (ACCOUNT_RESERVE_TIMEOUT and TEST_SCAN_INTERVAL are much longer than a run), so every test has to be claimed
+exactly once. The report contains claims per second for every number of processes, and the script exits with 1 if
+a test has been claimed twice. The database is a temporary SQLite file unless DATABASE_* variables are given
+(an empty database has to be given then).
+
+    python benchmark/claims_benchmark.py --tests 1000 --processes 1 2 4 8
+"""
+import argparse
+import logging
+import multiprocessing
+import sys
+import tempfile
+from collections import Counter
+from datetime import datetime
+from os import environ
+from pathlib import Path
+from time import perf_counter
+
+sys.path.insert(0, str(Path(__file__).absolute().parent.parent))
+
+
+def prepare_database(tests_count: int):
+    from peewee import chunked
+
+    from antiintuit.database import Account, Course, Test, create_tables, migrate_database
+
+    create_tables()
+    migrate_database()
+    database = Test._meta.database
+    with database.atomic():
+        for nums in chunked(range(tests_count), 500):
+            Account.insert_many([{"first_name": "Иван", "last_name": "Иванов", "password": "password",
+                                  "email": "claims{}@example.com".format(num)} for num in nums]).execute()
+            Course.insert_many([{"publish_id": "claims/{}".format(num), "title": "Course {}".format(num),
+                                 "published_on": datetime.utcnow().date()} for num in nums]).execute()
+    accounts_ids = [account_id for account_id, in Account.select(Account.id).order_by(Account.id).tuples()]
+    courses_ids = [course_id for course_id, in Course.select(Course.id).order_by(Course.id).tuples()]
+    with database.atomic():
+        for rows in chunked(zip(courses_ids, accounts_ids), 500):
+            Test.insert_many([{"publish_id": "claims/{}/1".format(course_id), "title": "Test", "course": course_id,
+                               "watcher": account_id, "questions_count": 10, "priority": course_id % 7}
+                              for course_id, account_id in rows]).execute()
+    database.close()
+
+
+def reset_reservations():
+    """Makes all tests suitable for solving again"""
+    from antiintuit.database import Account, Course, Test
+
+    with Test._meta.database.atomic():
+        Account.update({Account.reserved_until: datetime(1, 1, 1)}).execute()
+        Course.update({Course.next_eligible_at: datetime(1, 1, 1)}).execute()
+    Test._meta.database.close()
+
+
+def claim_tests(start_event, results_queue):
+    """Claims tests until there isn't a suitable one and puts claimed tests and failed claims in the queue.
+    Errors of the database (a lock timeout) are counted as failed claims."""
+    from peewee import OperationalError
+
+    from antiintuit.database import Test
+    from antiintuit.jobs.tests_solver import claim_test, get_test_for_solving_query
+
+    logging.getLogger("antiintuit").setLevel(logging.CRITICAL)
+    claims, failed_claims = list(), 0
+    start_event.wait()
+    try:
+        while True:
+            try:
+                test = claim_test()
+            except (Test.DoesNotExist, OperationalError):
+                # All attempts can be lost to other processes while suitable tests still exist
+                if not get_test_for_solving_query().exists():
+                    break
+                failed_claims += 1
+                continue
+            claims.append((test.id, test.watcher_id, test.course_id))
+    finally:
+        results_queue.put({"claims": claims, "failed_claims": failed_claims})
+
+
+def run_benchmark(processes_count: int) -> dict:
+    context = multiprocessing.get_context("spawn")
+    start_event, results_queue = context.Event(), context.Queue()
+    processes = [context.Process(target=claim_tests, args=(start_event, results_queue))
+                 for _ in range(processes_count)]
+    for process in processes:
+        process.start()
+    started_at = perf_counter()
+    start_event.set()
+    results = [results_queue.get() for _ in processes]
+    elapsed = perf_counter() - started_at
+    for process in processes:
+        process.join()
+    claims = [claim for result in results for claim in result["claims"]]
+    tests_claims, watchers_claims = Counter(claim[0] for claim in claims), Counter(claim[1] for claim in claims)
+    return {"processes": processes_count, "seconds": elapsed, "claims": len(claims),
+            "failed_claims": sum(result["failed_claims"] for result in results),
+            "double_claimed_tests": sum(1 for count in tests_claims.values() if count > 1),
+            "double_reserved_watchers": sum(1 for count in watchers_claims.values() if count > 1)}
+
+
+def print_report(results: list):
+    print("{:>10}{:>10}{:>12}{:>16}{:>16}".format("processes", "claims", "claims/sec", "failed claims",
+                                                  "double claims"))
+    for result in results:
+        print("{processes:>10}{claims:>10}{:>12.1f}{failed_claims:>16}{:>16}".format(
+            result["claims"] / result["seconds"],
+            result["double_claimed_tests"] + result["double_reserved_watchers"], **result))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Multi-process benchmark of claiming tests in the database")
+    parser.add_argument("--tests", type=int, default=1000, help="Tests (with own courses and watchers)")
+    parser.add_argument("--processes", type=int, nargs="+", default=[1, 2, 4], help="Numbers of processes")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as temp_directory:
+        environ.setdefault("DATABASE_NAME", str(Path(temp_directory).joinpath("claims.db")))
+        environ.update({"STATIC_DIRECTORY": str(Path(temp_directory).joinpath("static")),
+                        "CLAIM_TESTS_IN_DATABASE": "true", "ACCOUNT_RESERVE_TIMEOUT": "600",
+                        "TEST_SCAN_INTERVAL": "36000"})
+        import antiintuit  # noqa: F401
+
+        logging.getLogger("antiintuit").setLevel(logging.CRITICAL)
+        prepare_database(args.tests)
+        benchmark_results = list()
+        for processes in args.processes:
+            reset_reservations()
+            benchmark_results.append(run_benchmark(processes))
+    print_report(benchmark_results)
+    if any(result["claims"] != args.tests or result["double_claimed_tests"] or result["double_reserved_watchers"]
+           for result in benchmark_results):
+        print("Every test has to be claimed exactly once.", file=sys.stderr)
+        sys.exit(1)
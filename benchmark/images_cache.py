@@ -0,0 +1,90 @@
+"""Check of the images index of the tests solver against the local stand-in of the website (replay_server.py).
+
+Questions with images are parsed twice as the tests solver parses them. The second parse mustn't request images
+from the website. Then the index entries are made stale and the third parse must revalidate images by conditional
+requests (304) without downloading them. The script exits with 1 if the stand-in counts unexpected requests.
+
+    python benchmark/images_cache.py --questions 20
+"""
+import argparse
+import logging
+import sys
+import tempfile
+from datetime import datetime
+from os import environ
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).absolute().parent.parent))
+from benchmark.replay_server import Site, start_server  # noqa: E402
+
+
+def parse_questions(site: Site) -> list:
+    """Returns titles of questions of the site handled by the tests solver"""
+    from antiintuit.jobs.tests_solver.tests_solver import get_handled_content
+    from antiintuit.parsing import find_element
+
+    titles = list()
+    for test in site.tests.values():
+        for task_id in test["pool"]:
+            question_form_bs = find_element(site.render_question(test, task_id), "form", id="test-task-form")
+            titles.append(get_handled_content(question_form_bs.find("div", {"class": "question"})))
+    return titles
+
+
+def get_requests_counts(site: Site) -> dict:
+    return {"downloads": site.images_downloads, "revalidations": site.images_revalidations}
+
+
+def run_check(site: Site) -> list:
+    """Returns descriptions of failed expectations"""
+    from antiintuit.database import Image, create_tables, migrate_database
+
+    create_tables()
+    migrate_database()
+    errors = list()
+    first_titles = parse_questions(site)
+    after_first_parse = get_requests_counts(site)
+    print("First parse: {downloads} downloads, {revalidations} revalidations".format(**after_first_parse))
+    if after_first_parse["downloads"] != len(site.questions):
+        errors.append("every image has to be downloaded once by the first parse")
+
+    second_titles = parse_questions(site)
+    after_second_parse = get_requests_counts(site)
+    print("Second parse: {downloads} downloads, {revalidations} revalidations".format(**after_second_parse))
+    if after_second_parse != after_first_parse:
+        errors.append("the second parse has requested images")
+    if second_titles != first_titles:
+        errors.append("titles of the second parse differ from the first one")
+
+    Image.update({Image.checked_at: datetime(1, 1, 1)}).execute()
+    parse_questions(site)
+    after_revalidation = get_requests_counts(site)
+    print("Parse of stale entries: {downloads} downloads, {revalidations} revalidations".format(**after_revalidation))
+    if after_revalidation != {"downloads": after_second_parse["downloads"],
+                              "revalidations": after_second_parse["revalidations"] + len(site.questions)}:
+        errors.append("stale entries have to be revalidated without downloads")
+    return errors
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check of the images index of the tests solver")
+    parser.add_argument("--questions", type=int, default=20, help="Questions with images")
+    args = parser.parse_args()
+
+    site = Site(courses_count=1, tests_per_course=1, pool_size=args.questions, images_rate=1)
+    server = start_server(site)
+    with tempfile.TemporaryDirectory() as temp_directory:
+        environ.setdefault("DATABASE_NAME", str(Path(temp_directory).joinpath("images.db")))
+        environ.update({
+            "WEBSITE": "http://{}:{}".format(*server.server_address),
+            "INTUIT_SSL_VERIFY": "false",
+            "STATIC_DIRECTORY": str(Path(temp_directory).joinpath("static")),
+        })
+        from antiintuit.logger import get_logger
+
+        get_logger("antiintuit").setLevel(logging.CRITICAL)
+        failed_expectations = run_check(site)
+    server.shutdown()
+    if failed_expectations:
+        print("Failed: " + "; ".join(failed_expectations), file=sys.stderr)
+        sys.exit(1)
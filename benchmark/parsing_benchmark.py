@@ -0,0 +1,91 @@
+"""Benchmark of parsing pages of the website (antiintuit.parsing) rendered from the fixtures of the local stand-in
+(replay_server.py).
+
+Every page is parsed in full by html.parser and by lxml, and by parse_html with the element which the jobs look for
+(only the matched subtree is built). The report contains the median parse time and the peak memory per page of every
+mode. Memory is traced by tracemalloc, so it counts Python objects of the tree and not buffers of the C library.
+The script exits with 1 if a mode doesn't find the same element as html.parser.
+
+    python benchmark/parsing_benchmark.py --repeats 50
+"""
+import argparse
+import sys
+import tracemalloc
+from pathlib import Path
+from statistics import median
+from time import perf_counter
+
+sys.path.insert(0, str(Path(__file__).absolute().parent.parent))
+from benchmark.replay_server import Site  # noqa: E402
+
+
+def get_pages(site: Site) -> dict:
+    """Returns markups of pages and arguments of find_element which the jobs use for them by names of pages"""
+    course = site.courses[0]
+    test = course["tests"][0]
+    # The finished attempt of the test is rendered as the task list with results
+    results = {task_id: num % 2 == 0 for num, task_id in enumerate(test["pool"])}
+    site.attempts[test["test_number"]] = {"number": 1, "position": site.questions_count, "order": test["pool"],
+                                          "results": results}
+    return {
+        "catalogue": (site.catalogue_page(0), ("div", {"class": "entities-showcase-list-item"}), {}),
+        "course info": (site.course_info_page(course["course_id"]), ("ul", None), {"id": "non-collapsible-item-1"}),
+        "question": (site.render_question(test, test["pool"][0]), ("form", None), {"id": "test-task-form"}),
+        "task list": (site.task_list({"idtest": test["test_number"]}), ("div", None), {"id": "test_task_list"}),
+    }
+
+
+def get_parsers() -> dict:
+    """Returns functions which parse the markup and find the element by names of modes"""
+    from bs4 import BeautifulSoup
+
+    from antiintuit.parsing import HTML_PARSER, find_element
+
+    parsers = {"html.parser": lambda markup, name, attrs, kwargs: BeautifulSoup(markup, "html.parser").find(
+        name, attrs or {}, **kwargs)}
+    if HTML_PARSER == "lxml":
+        parsers["lxml"] = lambda markup, name, attrs, kwargs: BeautifulSoup(markup, "lxml").find(
+            name, attrs or {}, **kwargs)
+    parsers[HTML_PARSER + " + strainer"] = lambda markup, name, attrs, kwargs: find_element(markup, name, attrs,
+                                                                                            **kwargs)
+    return parsers
+
+
+def measure(parser, markup: str, arguments: tuple, kwargs: dict, repeats: int) -> tuple:
+    """Returns the median time, the peak memory and the found element of the parse"""
+    seconds = list()
+    for _ in range(repeats):
+        started_at = perf_counter()
+        parser(markup, *arguments, kwargs)
+        seconds.append(perf_counter() - started_at)
+    tracemalloc.start()
+    element = parser(markup, *arguments, kwargs)
+    peak_memory = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return median(seconds), peak_memory, element
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark of parsing pages of the website")
+    parser.add_argument("--repeats", type=int, default=50, help="Parses of every page in every mode")
+    parser.add_argument("--courses-per-page", type=int, default=20)
+    parser.add_argument("--questions", type=int, default=20, help="Questions of the task list")
+    args = parser.parse_args()
+
+    benchmark_site = Site(courses_count=args.courses_per_page, tests_per_course=4, questions_count=args.questions,
+                          pool_size=args.questions, courses_per_page=args.courses_per_page)
+    different_elements = list()
+    print("{:<14}{:>10}    {:<22}{:>12}{:>14}".format("page", "size, KiB", "mode", "median, ms", "peak, KiB"))
+    for page, (page_markup, page_arguments, page_kwargs) in get_pages(benchmark_site).items():
+        expected_element = None
+        for mode, mode_parser in get_parsers().items():
+            median_seconds, peak, found_element = measure(mode_parser, page_markup, page_arguments, page_kwargs,
+                                                          args.repeats)
+            print("{:<14}{:>10.1f}    {:<22}{:>12.3f}{:>14.1f}".format(page, len(page_markup) / 1024, mode,
+                                                                    median_seconds * 1000, peak / 1024))
+            expected_element = expected_element or str(found_element)
+            if found_element is None or str(found_element) != expected_element:
+                different_elements.append("{} ({})".format(page, mode))
+    if different_elements:
+        print("Elements differ from html.parser: " + ", ".join(different_elements), file=sys.stderr)
+        sys.exit(1)
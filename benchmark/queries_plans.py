@@ -0,0 +1,142 @@
+"""Checks that the hot queries of the jobs and the API use indexes.
+
+The database is filled with generated rows (the planner chooses full scans of small tables legitimately, so indexes
+are selective only on tables of a realistic size), statistics are collected and every hot query is EXPLAINed.
+The script exits with 1 if any of the queries reads a table with the full scan. The database is a temporary
+SQLite file unless DATABASE_* variables are given (an empty database has to be given then).
+
+    python benchmark/queries_plans.py --courses 2000
+"""
+import argparse
+import logging
+import sys
+import tempfile
+from datetime import datetime, timedelta
+from os import environ
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).absolute().parent.parent))
+
+
+def get_hot_queries() -> dict:
+    """Returns frequent queries of the jobs and the API which have to use indexes"""
+    from peewee import fn
+
+    from antiintuit.config import Config
+    from antiintuit.database import Account, Answer, Course, Question, Subscribe, Test
+    from antiintuit.jobs.tests_manager import (get_course_watchers_query, get_courses_scans_queue_query,
+                                               get_subscribed_accounts_query, get_unwatched_tests_query)
+    from antiintuit.jobs.tests_solver import get_test_for_solving_query
+
+    course, question, account = Course(id=1), Question(id=1), Account(id=1)
+    unlocked_values = {Question.locked_by: None, Question.locked_at: None}
+    return {
+        "tests_solver.test_for_solving": get_test_for_solving_query(),
+        "tests_solver.subscribe": Subscribe.select().where((Subscribe.account == account) &
+                                                           (Subscribe.course == course)),
+        "tests_solver.question": Question.select().where(Question.task_id == 0),
+        "tests_solver.next_answer": (Answer
+                                     .select()
+                                     .where(Answer.question == question)
+                                     .order_by(Answer.status, Answer.id).limit(1)),
+        "tests_solver.session_questions": Question.update(unlocked_values).where(
+            Question.locked_by == Config.SESSION_ID),
+        "tests_manager.subscribed_accounts": get_subscribed_accounts_query(course),
+        "tests_manager.unwatched_tests": get_unwatched_tests_query(),
+        "tests_manager.course_watchers": get_course_watchers_query(course),
+        "tests_manager.courses_scans_queue": get_courses_scans_queue_query().limit(1),
+        "questions_unlocker.old_questions": Question.update(unlocked_values).where(
+            Question.locked_at < datetime.utcnow()),
+        # /questions/<id>/answers?where:status=R
+        "api.question_answers": Answer.select().where((Answer.question == question) &
+                                                      (fn.LOWER(Answer.status) == "r")),
+        # /tests?url=<link>
+        "api.test_by_link": Test.select().where(Test.publish_id == "")
+    }
+
+
+def insert_rows(model, rows: list, batch_size: int = 500):
+    from peewee import chunked
+
+    with model._meta.database.atomic():
+        for batch in chunked(rows, batch_size):
+            model.insert_many(batch).execute()
+
+
+def fill_database(courses_count: int, accounts_count: int):
+    """Inserts courses with tests and questions, accounts with subscriptions and answers of questions"""
+    from antiintuit.database import Account, Answer, Course, Question, Subscribe, Test
+
+    started_at = datetime.utcnow()
+    insert_rows(Account, [{"first_name": "Иван", "last_name": "Иванов", "password": "password",
+                           "email": "plans{}@example.com".format(num), "reserved_until": started_at}
+                          for num in range(accounts_count)])
+    insert_rows(Course, [{"publish_id": "plans/{}".format(num), "title": "Course {}".format(num),
+                          "published_on": started_at.date(), "next_eligible_at": started_at,
+                          "next_scan_at": started_at + timedelta(minutes=num)} for num in range(courses_count)])
+    courses_ids = [course.id for course in Course.select(Course.id)]
+    accounts_ids = [account.id for account in Account.select(Account.id)]
+    insert_rows(Subscribe, [{"account": accounts_ids[num % len(accounts_ids)], "course": course_id}
+                            for num, course_id in enumerate(courses_ids)])
+    insert_rows(Test, [{"publish_id": "plans/{}/{}".format(course_id, num), "title": "Test {}".format(num),
+                        "course": course_id, "questions_count": 10,
+                        "watcher": accounts_ids[course_id % len(accounts_ids)] if num else None}
+                       for course_id in courses_ids for num in range(4)])
+    insert_rows(Question, [{"task_id": course_id * 10 + num, "title": "Question {}".format(num), "type": "single",
+                            "course": course_id, "_variants": '[["a","1"],["b","2"],["c","3"]]',
+                            "original_html": "", "locked_by": "session{}".format(num) if num == 0 else None,
+                            "locked_at": started_at if num == 0 else None}
+                           for course_id in courses_ids for num in range(10)])
+    insert_rows(Answer, [{"question": question.id, "mask": 1 << num, "status": "W" if num else "U"}
+                         for question in Question.select(Question.id) for num in range(3)])
+
+
+def collect_statistics():
+    from peewee import MySQLDatabase, PostgresqlDatabase
+
+    from antiintuit.database import Account, Answer, Course, Question, Subscribe, Test
+
+    database = Course._meta.database
+    if isinstance(database, PostgresqlDatabase):
+        database.execute_sql("ANALYZE")
+    elif isinstance(database, MySQLDatabase):
+        tables = ", ".join(model._meta.table_name for model in (Account, Answer, Course, Question, Subscribe, Test))
+        database.execute_sql("ANALYZE TABLE " + tables)
+    else:
+        database.execute_sql("ANALYZE")
+
+
+def check_queries_plans() -> dict:
+    """Returns tables which are read with the full scan by names of the hot queries"""
+    from antiintuit.database import get_full_scans
+
+    full_scans = dict()
+    for name, query in get_hot_queries().items():
+        tables = get_full_scans(query)
+        print("{:<40}{}".format(name, "full scan of " + ", ".join(tables) if tables else "indexes"))
+        if tables:
+            full_scans[name] = tables
+    return full_scans
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check of plans of the hot queries")
+    parser.add_argument("--courses", type=int, default=2000, help="Courses (with 4 tests and 10 questions each)")
+    parser.add_argument("--accounts", type=int, default=200)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as temp_directory:
+        environ.setdefault("DATABASE_NAME", str(Path(temp_directory).joinpath("plans.db")))
+        environ["STATIC_DIRECTORY"] = str(Path(temp_directory).joinpath("static"))
+        from antiintuit.database import create_tables, migrate_database
+
+        logging.getLogger("antiintuit").setLevel(logging.CRITICAL)
+
+        create_tables()
+        migrate_database()
+        fill_database(args.courses, args.accounts)
+        collect_statistics()
+        queries_full_scans = check_queries_plans()
+    if queries_full_scans:
+        print("Queries {} read tables with the full scan.".format(", ".join(queries_full_scans)), file=sys.stderr)
+        sys.exit(1)
@@ -0,0 +1,271 @@
+"""Local stand-in of the website for benchmarks and debugging without hitting the live site.
+
+Pages are rendered from the fixtures directory (string.Template files) and the server simulates courses, tests and
+attempts of tests passing, so Config.WEBSITE can point at it and the jobs run as usual:
+
+    python benchmark/replay_server.py --port 8080
+    WEBSITE=http://127.0.0.1:8080 INTUIT_SSL_VERIFY=false python -c "..."
+"""
+import argparse
+import base64
+import json
+import random
+import threading
+from datetime import date, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from itertools import count
+from pathlib import Path
+from string import Template
+from urllib.parse import parse_qsl, urlsplit
+
+FIXTURES_DIRECTORY = Path(__file__).parent.joinpath("fixtures")
+# 1x1 transparent PNG served for images of questions
+IMAGE = base64.b64decode("iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAADUlEQVR42mNkYPhfDwAChwGA60e6kgAAAABJ"
+                         "RU5ErkJggg==")
+
+
+def load_fixtures(directory: Path = FIXTURES_DIRECTORY) -> dict:
+    """Returns templates of the fixtures directory by names of files without extensions"""
+    return {path.stem: Template(path.read_text("utf-8")) for path in directory.glob("*.html")}
+
+
+class Site:
+    """Simulated courses, tests and questions. Everything is generated from the seed, so runs are repeatable.
+    Tests draw questions_count questions of the pool of the test for every attempt, like the real site."""
+
+    def __init__(self, courses_count: int = 5, tests_per_course: int = 4, questions_count: int = 10,
+                 pool_size: int = 15, courses_per_page: int = 10, images_rate: float = 0.1, seed: int = 0):
+        self.fixtures = load_fixtures()
+        self.random, self.lock = random.Random(seed), threading.Lock()
+        self.courses_per_page, self.questions_count = courses_per_page, questions_count
+        self.courses, self.tests, self.questions = list(), dict(), dict()
+        # Current attempts of tests passing by numbers of tests
+        self.attempts, self.attempts_numbers = dict(), count(1)
+        # Numbers of images requests with the full response and with the 304 response
+        self.images_downloads, self.images_revalidations = 0, 0
+        task_ids = iter(range(100000, 10000000))
+        for course_num in range(courses_count):
+            course = {"program_id": 10 + course_num % 3, "course_number": 1000 + course_num,
+                      "title": "Курс {}".format(course_num + 1),
+                      "published_on": date(2019, 1, 1) + timedelta(days=courses_count - course_num),
+                      "tests": list()}
+            course["course_id"] = "{}/{}".format(course["program_id"], course["course_number"])
+            for test_num in range(tests_per_course):
+                test_number = 1000 * course["course_number"] + test_num
+                test = {"course": course, "test_number": test_number, "title": "Тест {}".format(test_num + 1),
+                        "test_id": "{}/test/{}/{}".format(course["course_id"], test_num + 1, test_number),
+                        "pool": [next(task_ids) for _ in range(pool_size)]}
+                for task_id in test["pool"]:
+                    self.questions[task_id] = self.create_question(task_id, images_rate)
+                course["tests"].append(test)
+                self.tests[test_number] = test
+            self.courses.append(course)
+
+    def create_question(self, task_id: int, images_rate: float) -> dict:
+        question_type = self.random.choice(("single", "multiple"))
+        variants_count = self.random.randint(3, 5)
+        if question_type == "single":
+            right = {self.random.randrange(variants_count)}
+        else:
+            right = set(self.random.sample(range(variants_count), self.random.randint(1, variants_count)))
+        title = "Вопрос {} о&nbsp;<b>предмете</b> курса".format(task_id)
+        if self.random.random() < images_rate:
+            title += ' <img src="/images/{}.png" style="width: 10px">'.format(task_id)
+        return {"task_id": task_id, "type": question_type, "title": title,
+                "variants_count": variants_count, "right": right}
+
+    def render(self, name: str, page_title: str = "НОУ ИНТУИТ", in_layout: bool = True, **values) -> str:
+        content = self.fixtures[name].substitute(**values)
+        return self.fixtures["layout"].substitute(title=page_title, content=content) if in_layout else content
+
+    def render_question(self, test: dict, task_id: int) -> str:
+        question = self.questions[task_id]
+        options = list()
+        for index in range(question["variants_count"]):
+            if question["type"] == "single":
+                input_type, name = "radio", "answer"
+            else:
+                input_type, name = "checkbox", "answer[{}]".format(index)
+            options.append(self.fixtures["question_option"].substitute(
+                input_type=input_type, name=name, value=index, text="Вариант {} ответа".format(index + 1)))
+        return self.render("question_form", in_layout=False, task_id=task_id, test_number=test["test_number"],
+                           title=question["title"], type=question["type"], options="\n".join(options))
+
+    @staticmethod
+    def is_right_answer(question: dict, data: dict) -> bool:
+        if question["type"] == "single":
+            chosen = {int(data["answer"])} if "answer" in data else set()
+        else:
+            chosen = {int(value) for name, value in data.items() if name.startswith("answer[")}
+        return chosen == question["right"]
+
+    def catalogue_page(self, page: int) -> str:
+        courses = self.courses[page * self.courses_per_page:(page + 1) * self.courses_per_page]
+        items = [self.fixtures["catalogue_item"].substitute(course, hours=36,
+                                                            published_on=course["published_on"].strftime("%d.%m.%Y"))
+                 for course in courses]
+        return self.render("catalogue_page", "Курсы", items="\n".join(items))
+
+    def course_info_page(self, course_id: str) -> str or None:
+        course = next((course for course in self.courses if course["course_id"] == course_id), None)
+        if course is None:
+            return None
+        items = [self.fixtures["course_test_item"].substitute(test_id=test["test_id"], title=test["title"],
+                                                              questions_count=self.questions_count)
+                 for test in course["tests"]]
+        return self.render("course_info", course["title"], items="\n".join(items), **course)
+
+    def test_page(self, test: dict) -> str:
+        course = test["course"]
+        with self.lock:
+            attempt = self.attempts.get(test["test_number"])
+            if attempt is None or attempt["position"] < len(attempt["order"]):
+                return self.render("test_start_page", test["title"], title=test["title"],
+                                   test_number=test["test_number"], program_id=course["program_id"],
+                                   course_number=course["course_number"])
+            right_count = sum(attempt["results"].values())
+        grade = int(right_count / len(attempt["order"]) * 100)
+        return self.render("test_results_page", test["title"], title=test["title"], test_number=test["test_number"],
+                           attempt=attempt["number"], right_count=right_count, grade=grade,
+                           result="сдан" if grade >= 60 else "не сдан")
+
+    def next_question(self, data: dict) -> str:
+        """Records the answer on the previous question of the attempt and returns the next question"""
+        test = self.tests[int(data["idtest"])]
+        with self.lock:
+            attempt = self.attempts.get(test["test_number"])
+            if attempt is None or "task_id" not in data:
+                attempt = {"number": next(self.attempts_numbers), "position": 0, "results": dict(),
+                           "order": self.random.sample(test["pool"], self.questions_count)}
+                self.attempts[test["test_number"]] = attempt
+            else:
+                task_id = int(data["task_id"])
+                if attempt["position"] < len(attempt["order"]) and attempt["order"][attempt["position"]] == task_id:
+                    attempt["results"][task_id] = self.is_right_answer(self.questions[task_id], data)
+                    attempt["position"] += 1
+            if attempt["position"] >= len(attempt["order"]):
+                return self.render("test_finished", in_layout=False)
+            task_id = attempt["order"][attempt["position"]]
+        return self.render_question(test, task_id)
+
+    def task_list(self, data: dict) -> str:
+        with self.lock:
+            attempt = self.attempts[int(data["idtest"])]
+            results = list(attempt["results"].items())
+        items = [self.fixtures["task_list_item"].substitute(num=num, task_id=task_id,
+                                                            status="correct" if is_right else "incorrect")
+                 for num, (task_id, is_right) in enumerate(results, 1)]
+        return self.render("task_list", in_layout=False, items="\n".join(items))
+
+    def reset_attempt(self, data: dict):
+        with self.lock:
+            self.attempts.pop(int(data.get("idtest", 0)), None)
+
+
+class ReplayRequestHandler(BaseHTTPRequestHandler):
+    site = None
+    protocol_version = "HTTP/1.1"
+    # Headers and a body are written separately, so Nagle's algorithm would delay responses of kept-alive connections
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        query = dict(parse_qsl(url.query))
+        path = url.path.rstrip("/")
+        if path == "":
+            return self.send_html(self.site.render("front_page", token=self.site.random.getrandbits(32)))
+        elif path == "/studies/courses" and "_page" in query:
+            return self.send_html(self.site.catalogue_page(int(query["_page"])))
+        elif path.startswith("/images/"):
+            return self.send_image(path)
+        elif path.startswith("/studies/courses/") and path.endswith("/info"):
+            page = self.site.course_info_page(path[len("/studies/courses/"):-len("/info")])
+            return self.send_html(page) if page is not None else self.send_error(404)
+        elif path.startswith("/studies/courses/") and "/test/" in path:
+            test = self.site.tests.get(int(path.rsplit("/", 1)[-1]))
+            return self.send_html(self.site.test_page(test)) if test is not None else self.send_error(404)
+        self.send_error(404)
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        data = dict(parse_qsl(str(self.rfile.read(length), "utf-8"), keep_blank_values=True))
+        path = urlsplit(self.path).path.rstrip("/")
+        if path in ("", "/intuit"):
+            return self.send_html(self.site.render("user_page", "Моя страница"))
+        elif path == "/int_studies/json/signin_free_dialog":
+            return self.send_json(self.site.render("signin_dialog", in_layout=False,
+                                                   program_id=data.get("iduniver_edu_prog", ""),
+                                                   course_number=data.get("course_id", "")))
+        elif path == "/int_studies/json/signin":
+            return self.send_json("")
+        elif path == "/int_studies/json/callback_display_test_task":
+            return self.send_json(self.site.next_question(data))
+        elif path == "/int_studies/json/callback_display_test_task_list":
+            return self.send_json(self.site.task_list(data))
+        elif path in ("/int_studies/json/callback_repeat_test", "/int_studies/json/callback_accept_test"):
+            self.site.reset_attempt(data)
+            return self.send_json("")
+        self.send_error(404)
+
+    def send_html(self, page: str):
+        self.send_body(bytes(page, "utf-8"), "text/html; charset=utf-8")
+
+    def send_json(self, data: str):
+        self.send_body(bytes(json.dumps({"data": data}, ensure_ascii=False), "utf-8"), "application/json")
+
+    def send_image(self, path: str):
+        etag = '"{}"'.format(path.rsplit("/", 1)[-1])
+        with self.site.lock:
+            if self.headers.get("If-None-Match") == etag:
+                self.site.images_revalidations += 1
+            else:
+                self.site.images_downloads += 1
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        self.send_body(IMAGE, "image/png", {"ETag": etag})
+
+    def send_body(self, body: bytes, content_type: str, headers: dict = None):
+        self.send_response(200)
+        for name, value in (headers or dict()).items():
+            self.send_header(name, value)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def create_server(site: Site, host: str = "127.0.0.1", port: int = 0) -> ThreadingHTTPServer:
+    """Returns the server of the site (server_address contains the actual port)"""
+    server = ThreadingHTTPServer((host, port), type("SiteRequestHandler", (ReplayRequestHandler,), {"site": site}))
+    server.daemon_threads = True
+    return server
+
+
+def start_server(site: Site, host: str = "127.0.0.1", port: int = 0) -> ThreadingHTTPServer:
+    """Starts the server in a daemon thread and returns it"""
+    server = create_server(site, host, port)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local stand-in of the website")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--courses", type=int, default=5)
+    parser.add_argument("--tests-per-course", type=int, default=4)
+    parser.add_argument("--questions", type=int, default=10, help="Questions in an attempt of a test")
+    parser.add_argument("--pool", type=int, default=15, help="Questions of a test among which attempts draw")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    site = Site(args.courses, args.tests_per_course, args.questions, args.pool, seed=args.seed)
+    server = create_server(site, args.host, args.port)
+    print("Serving on http://{}:{}".format(*server.server_address))
+    server.serve_forever()
@@ -0,0 +1,138 @@
+"""Benchmark of the selection query of the first suitable test for solving (tests_solver.get_test_for_solving_query).
+
+The database is filled with courses with tests and watchers, tests get random ratings and passes. A half of courses
+has a recently scanned test and a half of watchers is reserved, so suitable tests are mixed with unsuitable ones.
+The stored priority is selected by the composite index and courses are filtered by their indexed eligibility moment.
+The former query calculates the passing score of every test and skips courses by the NOT IN subquery over
+Test.last_scan_at. Tests are added up to every given size and the report contains the median time of both queries.
+The script exits with 1 if the queries select different tests. The database is a temporary SQLite file unless
+DATABASE_* variables are given (an empty database has to be given then).
+
+    python benchmark/selection_benchmark.py --tests 10000 100000 1000000
+"""
+import argparse
+import logging
+import sys
+import tempfile
+from datetime import datetime, timedelta
+from os import environ
+from pathlib import Path
+from random import Random
+from statistics import median
+from time import perf_counter
+
+sys.path.insert(0, str(Path(__file__).absolute().parent.parent))
+
+
+def get_former_test_for_solving_query():
+    """Returns the selection query as it was before the stored priority of tests and the eligibility moment
+    of courses"""
+    from peewee import SQL
+
+    from antiintuit.config import Config
+    from antiintuit.database import Account, Test
+
+    skip_courses_query = (Test
+                          .select(Test.course)
+                          .where(Test.last_scan_at > Config.get_test_scan_timeout_moment()))
+    return (Test
+            .select(Test,
+                    ((Test.average_rating + Test.last_rating + Test.max_rating) * 5 +
+                     Test.passed_count * 3 + Test.not_passed_count).alias("passing_score"))
+            .join(Account, on=(Account.id == Test.watcher))
+            .where(Test.watcher.is_null(False) &
+                   (Account.reserved_until < Config.get_account_reserve_out_moment()) &
+                   (Test.course.not_in(skip_courses_query)))
+            .order_by(SQL("passing_score"), Test.max_rating, Test.average_rating,
+                      Test.last_scan_at, Test.created_at)
+            .limit(1))
+
+
+def prepare_database(accounts_count: int):
+    from antiintuit.database import Account, create_tables, migrate_database
+    from benchmark.queries_plans import insert_rows
+
+    create_tables()
+    migrate_database()
+    now = datetime.utcnow()
+    insert_rows(Account, [{"first_name": "Иван", "last_name": "Иванов", "password": "password",
+                           "email": "selection{}@example.com".format(num),
+                           "reserved_until": now if num % 2 else datetime(1, 1, 1)}
+                          for num in range(accounts_count)])
+
+
+def add_tests(tests_from: int, tests_to: int, tests_per_course: int, random: Random):
+    """Adds courses with tests up to the given number of tests. The first test of every second course has been
+    scanned recently, so tests of the course aren't suitable."""
+    from antiintuit.config import Config
+    from antiintuit.database import Account, Course, Test
+    from benchmark.queries_plans import insert_rows
+
+    now, created_at = datetime.utcnow(), datetime(2020, 1, 1)
+    scanned_at = now - timedelta(seconds=60)
+    courses_nums = range(tests_from // tests_per_course, -(-tests_to // tests_per_course))
+    insert_rows(Course, ({"publish_id": "selection/{}".format(num), "title": "Course {}".format(num),
+                          "published_on": now.date(),
+                          "last_scan_at": scanned_at if num % 2 else datetime(1, 1, 1),
+                          "next_eligible_at": (scanned_at + timedelta(seconds=Config.TEST_SCAN_INTERVAL)
+                                               if num % 2 else datetime(1, 1, 1))}
+                         for num in courses_nums))
+    courses_ids = dict(Course.select(Course.publish_id, Course.id).tuples())
+    accounts_ids = [account_id for account_id, in Account.select(Account.id).order_by(Account.id).tuples()]
+
+    def get_test_row(num: int) -> dict:
+        course_num = num // tests_per_course
+        row = {"publish_id": "selection/{}/{}".format(course_num, num), "title": "Test {}".format(num),
+               "course": courses_ids["selection/{}".format(course_num)], "questions_count": 10,
+               "watcher": accounts_ids[num % len(accounts_ids)], "created_at": created_at + timedelta(seconds=num),
+               "last_scan_at": (scanned_at if course_num % 2 and num % tests_per_course == 0
+                                else datetime(1, 1, 1)),
+               "average_rating": random.randrange(101), "last_rating": random.randrange(101),
+               "max_rating": random.randrange(101), "passed_count": random.randrange(5),
+               "not_passed_count": random.randrange(5)}
+        row["priority"] = ((row["average_rating"] + row["last_rating"] + row["max_rating"]) * 5 +
+                           row["passed_count"] * 3 + row["not_passed_count"])
+        return row
+
+    insert_rows(Test, (get_test_row(num) for num in range(tests_from, tests_to)))
+
+
+def measure(query_function, repeats: int) -> tuple:
+    """Returns the median time of the query and the id of the selected test"""
+    seconds, test = list(), None
+    for _ in range(repeats):
+        started_at = perf_counter()
+        test = query_function().first()
+        seconds.append(perf_counter() - started_at)
+    return median(seconds), test and test.id
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark of the selection query of the test for solving")
+    parser.add_argument("--tests", type=int, nargs="+", default=[10000, 100000, 1000000])
+    parser.add_argument("--tests-per-course", type=int, default=10)
+    parser.add_argument("--accounts", type=int, default=1000)
+    parser.add_argument("--repeats", type=int, default=5, help="Executions of every query at every size")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as temp_directory:
+        environ.setdefault("DATABASE_NAME", str(Path(temp_directory).joinpath("selection.db")))
+        environ["STATIC_DIRECTORY"] = str(Path(temp_directory).joinpath("static"))
+        from antiintuit.jobs.tests_solver import get_test_for_solving_query
+
+        logging.getLogger("antiintuit").setLevel(logging.CRITICAL)
+        prepare_database(args.accounts)
+        benchmark_random, tests_count, results = Random(0), 0, list()
+        for size in sorted(args.tests):
+            add_tests(tests_count, size, args.tests_per_course, benchmark_random)
+            tests_count = size
+            former_seconds, former_test_id = measure(get_former_test_for_solving_query, args.repeats)
+            seconds, test_id = measure(get_test_for_solving_query, args.repeats)
+            results.append((size, former_seconds, seconds, former_test_id, test_id))
+    print("{:>10}{:>14}{:>16}{:>10}".format("tests", "former, ms", "priority, ms", "speedup"))
+    for size, former_seconds, seconds, _, _ in results:
+        print("{:>10}{:>14.1f}{:>16.1f}{:>9.0f}x".format(size, former_seconds * 1000, seconds * 1000,
+                                                           former_seconds / seconds))
+    if any(former_test_id is None or former_test_id != test_id for _, _, _, former_test_id, test_id in results):
+        print("Both queries have to select the same test.", file=sys.stderr)
+        sys.exit(1)
@@ -0,0 +1,125 @@
+"""Load test of the Session Queue server (session-manager/session_manager.py) with concurrent clients.
+
+The server is started in a separate process. Every client has a connection and a session and in every round it
+waits until its session is allowed (CHK), renews it (RNW) and releases it (DEL) as the tests solver does.
+The report contains allowed sessions per second and latencies of requests for every number of clients.
+CHK latencies include waiting for sessions of other clients. The script exits with 1 if two sessions have been
+allowed at the same time, a release has been rejected or the queue isn't empty after the run.
+
+    python benchmark/session_queue_load.py --clients 1 10 100 --rounds 20
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import secrets
+import sys
+import tempfile
+from pathlib import Path
+from statistics import median
+from time import perf_counter
+
+SESSION_MANAGER_DIRECTORY = Path(__file__).absolute().parent.parent.joinpath("session-manager")
+
+
+def run_server(lease: float, snapshot_path: str or None, ports_queue):
+    """Serves the queue on a free port of the loopback interface and puts the port in the queue"""
+    sys.path.insert(0, str(SESSION_MANAGER_DIRECTORY))
+    from session_manager import SessionQueue, SessionsSnapshot, start_server
+
+    async def serve_queue():
+        sessions = SessionQueue(lease, SessionsSnapshot(snapshot_path) if snapshot_path else None)
+        server = await start_server(sessions, "127.0.0.1", 0)
+        ports_queue.put(server.sockets[0].getsockname()[1])
+        async with server:
+            await server.serve_forever()
+
+    asyncio.run(serve_queue())
+
+
+async def request(reader: asyncio.StreamReader, writer: asyncio.StreamWriter, message: bytes, latencies: list):
+    started_at = perf_counter()
+    writer.write(message + b"\n")
+    line = await reader.readline()
+    latencies.append(perf_counter() - started_at)
+    return line.strip()
+
+
+async def run_client(port: int, rounds: int, state: dict, latencies: dict):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    session = secrets.token_hex(32).encode()
+    try:
+        for _ in range(rounds):
+            await request(reader, writer, b"CHK:" + session, latencies["CHK"])
+            if state["holder"] is not None:
+                state["simultaneous_sessions"] += 1
+            state["holder"] = session
+            await request(reader, writer, b"RNW:" + session, latencies["RNW"])
+            state["holder"] = None
+            if await request(reader, writer, b"DEL:" + session, latencies["DEL"]) != b"true":
+                state["rejected_releases"] += 1
+            state["grants"] += 1
+    finally:
+        writer.close()
+
+
+async def get_queue_depth(port: int) -> int:
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    writer.write(b"healthz\n")
+    line = await reader.readline()
+    writer.close()
+    return json.loads(line)["depth"]
+
+
+async def run_load(port: int, clients_count: int, rounds: int) -> dict:
+    state = {"holder": None, "grants": 0, "simultaneous_sessions": 0, "rejected_releases": 0}
+    latencies = {"CHK": list(), "RNW": list(), "DEL": list()}
+    started_at = perf_counter()
+    await asyncio.gather(*[run_client(port, rounds, state, latencies) for _ in range(clients_count)])
+    elapsed = perf_counter() - started_at
+    state.pop("holder")
+    return dict(state, clients=clients_count, seconds=elapsed, latencies=latencies,
+                queue_depth=await get_queue_depth(port))
+
+
+def get_percentile(values: list, percentile: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * percentile))]
+
+
+def print_report(results: list):
+    print("{:>8}{:>8}{:>12}{:>14}{:>14}{:>14}{:>14}".format("clients", "grants", "grants/sec", "CHK max, ms",
+                                                            "RNW p50, ms", "RNW p99, ms", "DEL p99, ms"))
+    for result in results:
+        latencies = result["latencies"]
+        print("{clients:>8}{grants:>8}{:>12.1f}{:>14.2f}{:>14.2f}{:>14.2f}{:>14.2f}".format(
+            result["grants"] / result["seconds"], max(latencies["CHK"]) * 1000, median(latencies["RNW"]) * 1000,
+            get_percentile(latencies["RNW"], 0.99) * 1000, get_percentile(latencies["DEL"], 0.99) * 1000, **result))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load test of the Session Queue server")
+    parser.add_argument("--clients", type=int, nargs="+", default=[1, 10, 100], help="Numbers of concurrent clients")
+    parser.add_argument("--rounds", type=int, default=20, help="Allowed sessions of every client")
+    parser.add_argument("--lease", type=float, default=60, help="SESSION_LEASE of the server")
+    parser.add_argument("--snapshot", action="store_true", help="Save the queue in a snapshot (SNAPSHOT_PATH)")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as temp_directory:
+        context = multiprocessing.get_context("spawn")
+        server_ports_queue = context.Queue()
+        server_process = context.Process(target=run_server, daemon=True, args=(
+            args.lease, str(Path(temp_directory).joinpath("sessions.log")) if args.snapshot else None,
+            server_ports_queue))
+        server_process.start()
+        server_port = server_ports_queue.get()
+        try:
+            load_results = [asyncio.run(run_load(server_port, clients, args.rounds)) for clients in args.clients]
+        finally:
+            server_process.terminate()
+            server_process.join()
+    print_report(load_results)
+    if any(result["grants"] != result["clients"] * args.rounds or result["simultaneous_sessions"] or
+           result["rejected_releases"] or result["queue_depth"] for result in load_results):
+        print("Only one session has to be allowed at a time and every session has to be released.", file=sys.stderr)
+        sys.exit(1)
@@ -0,0 +1,189 @@
+"""End-to-end benchmark of the tests solver against the local stand-in of the website (replay_server.py).
+
+The courses manager and the tests manager fill the database from the stand-in, then run_job of the tests solver
+is executed the given number of times. The report contains tests per minute, database queries per test and the time
+split by stages of the solving. The database is a temporary SQLite file unless DATABASE_* variables are given.
+
+    python benchmark/solver_benchmark.py --jobs 50
+"""
+import argparse
+import logging
+import sys
+import tempfile
+from collections import defaultdict
+from functools import wraps
+from os import environ
+from pathlib import Path
+from time import perf_counter
+
+sys.path.insert(0, str(Path(__file__).absolute().parent.parent))
+from benchmark.replay_server import Site, start_server  # noqa: E402
+
+# Functions of tests_solver which are timed as stages. Time of a stage doesn't include nested stages.
+STAGES = {
+    "get_test_course_account": "select a test",
+    "get_authorized_session": "login",
+    "start_test": "start the test",
+    "get_question_form": "question page",
+    "get_or_create_question": "question in database",
+    "get_handled_content": "images",
+    "get_next_answer": "answer in database",
+    "generate_answers": "answer in database",
+    "get_test_page_bs": "test page",
+    "update_answers": "results",
+    "update_tests_completeness": "completeness",
+    "accept_test": "accept/repeat",
+    "repeat_test": "accept/repeat",
+}
+
+
+class QueriesCounter(logging.Handler):
+    """Counts queries which peewee logs"""
+
+    def __init__(self):
+        super().__init__(logging.DEBUG)
+        self.count = 0
+
+    def emit(self, record):
+        self.count += 1
+
+
+class StagesTimer:
+    """Accumulates time and queries of stages. A nested stage pauses its outer stage."""
+
+    def __init__(self, queries_counter: QueriesCounter):
+        self.queries_counter = queries_counter
+        self.seconds, self.queries = defaultdict(float), defaultdict(int)
+        self.stack = list()
+
+    def charge(self) -> tuple:
+        """Adds time and queries since the last enter or leave to the current stage"""
+        moment, queries_count = perf_counter(), self.queries_counter.count
+        if self.stack:
+            current_stage, started_at, queries_at = self.stack[-1]
+            self.seconds[current_stage] += moment - started_at
+            self.queries[current_stage] += queries_count - queries_at
+        return moment, queries_count
+
+    def enter(self, stage: str):
+        moment, queries_count = self.charge()
+        self.stack.append((stage, moment, queries_count))
+
+    def leave(self):
+        moment, queries_count = self.charge()
+        self.stack.pop()
+        if self.stack:
+            self.stack[-1] = (self.stack[-1][0], moment, queries_count)
+
+    def wrap(self, function, stage: str):
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            self.enter(stage)
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self.leave()
+
+        return wrapper
+
+
+def configure(website: str, directory: str, args):
+    """Sets the configuration by environment before antiintuit is imported"""
+    environ.setdefault("DATABASE_NAME", str(Path(directory).joinpath("benchmark.db")))
+    environ.update({
+        "WEBSITE": website,
+        "INTUIT_SSL_VERIFY": "false",
+        "STATIC_DIRECTORY": str(Path(directory).joinpath("static")),
+        "INTERVAL_BETWEEN_QUESTIONS": "0",
+        "LATENCY_STEP_INCREASE_BETWEEN_SIMILAR_QUESTIONS": "0",
+        # Tests are claimed by the database, so the Session Queue isn't needed
+        "CLAIM_TESTS_IN_DATABASE": "true",
+        "ACCOUNT_RESERVE_TIMEOUT": "0",
+        "TEST_SCAN_INTERVAL": "0",
+        "LAZY_ANSWERS_GENERATION": "true" if args.lazy else "false",
+    })
+
+
+def prepare_database(accounts_count: int, courses_count: int):
+    from antiintuit.database import Account, create_tables, migrate_database
+    from antiintuit.jobs import courses_manager, tests_manager
+
+    create_tables()
+    migrate_database()
+    Account.insert_many([{"first_name": "Иван", "last_name": "Иванов", "password": "password",
+                          "email": "benchmark{}@example.com".format(num)} for num in range(accounts_count)]).execute()
+    courses_manager.run_job(full_scan=True)
+    for _ in range(courses_count):
+        tests_manager.run_job()
+
+
+def run_benchmark(jobs_count: int) -> dict:
+    from antiintuit.jobs.tests_solver import tests_solver
+
+    queries_counter = QueriesCounter()
+    peewee_logger = logging.getLogger("peewee")
+    peewee_logger.setLevel(logging.DEBUG)
+    peewee_logger.addHandler(queries_counter)
+    timer = StagesTimer(queries_counter)
+    for function_name, stage in STAGES.items():
+        setattr(tests_solver, function_name, timer.wrap(getattr(tests_solver, function_name), stage))
+    solved_tests, errors = [0], 0
+    pass_test = tests_solver.pass_test
+
+    def counted_pass_test(*args, **kwargs):
+        pass_test(*args, **kwargs)
+        solved_tests[0] += 1
+
+    tests_solver.pass_test = counted_pass_test
+    started_at = perf_counter()
+    for _ in range(jobs_count):
+        timer.enter("other")
+        try:
+            tests_solver.run_job()
+        except Exception as ex:
+            errors += 1
+            print("Job has failed: {!r}".format(ex), file=sys.stderr)
+        finally:
+            timer.leave()
+    elapsed = perf_counter() - started_at
+    return {"seconds": elapsed, "tests": solved_tests[0], "errors": errors, "queries": queries_counter.count,
+            "stages_seconds": dict(timer.seconds), "stages_queries": dict(timer.queries)}
+
+
+def print_report(result: dict):
+    tests_count = max(result["tests"], 1)
+    print("Solved tests: {} ({} failed jobs) in {:.1f} s".format(result["tests"], result["errors"], result["seconds"]))
+    print("Tests per minute: {:.1f}".format(result["tests"] / result["seconds"] * 60))
+    print("Database queries per test: {:.1f}".format(result["queries"] / tests_count))
+    print("{:<22}{:>12}{:>8}{:>16}".format("Stage", "ms/test", "share", "queries/test"))
+    for stage, seconds in sorted(result["stages_seconds"].items(), key=lambda item: -item[1]):
+        print("{:<22}{:>12.1f}{:>7.1f}%{:>16.1f}".format(stage, seconds / tests_count * 1000,
+                                                         seconds / result["seconds"] * 100,
+                                                         result["stages_queries"].get(stage, 0) / tests_count))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="End-to-end benchmark of the tests solver")
+    parser.add_argument("--jobs", type=int, default=50, help="Number of run_job executions")
+    parser.add_argument("--courses", type=int, default=5)
+    parser.add_argument("--tests-per-course", type=int, default=4)
+    parser.add_argument("--questions", type=int, default=10, help="Questions in an attempt of a test")
+    parser.add_argument("--pool", type=int, default=15, help="Questions of a test among which attempts draw")
+    parser.add_argument("--accounts", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--lazy", action="store_true", help="Use the lazy answers generation")
+    parser.add_argument("--verbose", action="store_true", help="Show logs of the jobs")
+    args = parser.parse_args()
+
+    server = start_server(Site(args.courses, args.tests_per_course, args.questions, args.pool, seed=args.seed))
+    with tempfile.TemporaryDirectory() as temp_directory:
+        configure("http://{}:{}".format(*server.server_address), temp_directory, args)
+        from antiintuit.logger import setup_logger
+
+        if args.verbose:
+            setup_logger()
+        else:
+            logging.getLogger("antiintuit").setLevel(logging.CRITICAL)
+        prepare_database(args.accounts, args.courses)
+        print_report(run_benchmark(args.jobs))
+    server.shutdown()
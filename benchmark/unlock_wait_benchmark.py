@@ -0,0 +1,121 @@
+"""Benchmark of waiting for a question which is locked by another session (tests_solver.get_or_create_question).
+
+One process locks a question, holds it for a random time and unlocks it. Another process waits for the question as
+the tests solver does and measures the delay between the release and the moment when it finds out about it.
+The delay is measured with polling (every INTERVAL_BETWEEN_SESSION_CHECK seconds) and with Postgres LISTEN/NOTIFY.
+Notifications are measured only if DATABASE_* variables point at Postgres, otherwise the database is a temporary
+SQLite file.
+
+    python benchmark/unlock_wait_benchmark.py --rounds 10
+"""
+import argparse
+import logging
+import multiprocessing
+import random
+import sys
+import tempfile
+from datetime import datetime
+from os import environ
+from pathlib import Path
+from statistics import median
+from time import sleep, time
+
+sys.path.insert(0, str(Path(__file__).absolute().parent.parent))
+
+
+def setup_process(use_notifications: bool):
+    from antiintuit.database import notifications
+
+    logging.getLogger("antiintuit").setLevel(logging.CRITICAL)
+    if not use_notifications:
+        # Both the release and the waiting fall back to polling
+        notifications.is_notifications_supported = lambda: False
+
+
+def hold_question(question_id: int, rounds: int, use_notifications: bool, barrier, released_queue):
+    """Locks the question, holds it for a random time and unlocks it in every round. The time is spread over
+    the polling interval, so releases happen at random moments between checks of the waiting session."""
+    from antiintuit.config import Config
+    from antiintuit.database import Question
+
+    setup_process(use_notifications)
+    hold_random = random.Random(rounds)
+    question = Question.get_by_id(question_id)
+    for _ in range(rounds):
+        question.lock()
+        barrier.wait()
+        sleep(hold_random.uniform(0.5, 0.5 + Config.INTERVAL_BETWEEN_SESSION_CHECK))
+        question.unlock()
+        released_queue.put(time())
+        barrier.wait()
+
+
+def wait_question(question_id: int, rounds: int, use_notifications: bool, barrier, released_queue, delays_queue):
+    """Waits for the question in every round as the tests solver does and puts delays after releases in the queue"""
+    from antiintuit.config import Config
+    from antiintuit.database import Question, wait_questions_unlock
+
+    setup_process(use_notifications)
+    delays = list()
+    for _ in range(rounds):
+        barrier.wait()
+        question = Question.get_by_id(question_id)
+        while question.is_locked_by_another:
+            time_left = question.lock_expires_at - datetime.utcnow()
+            wait_questions_unlock(question.locked_by, min(time_left.total_seconds(), Config.QUESTION_LOCK_LEASE / 2))
+            question = Question.get_by_id(question_id)
+        delays.append(time() - released_queue.get())
+        barrier.wait()
+    delays_queue.put(delays)
+
+
+def run_benchmark(question_id: int, rounds: int, use_notifications: bool) -> list:
+    context = multiprocessing.get_context("spawn")
+    barrier, released_queue, delays_queue = context.Barrier(2), context.Queue(), context.Queue()
+    processes = [
+        context.Process(target=hold_question, args=(question_id, rounds, use_notifications, barrier, released_queue)),
+        context.Process(target=wait_question,
+                        args=(question_id, rounds, use_notifications, barrier, released_queue, delays_queue))
+    ]
+    for process in processes:
+        process.start()
+    delays = delays_queue.get()
+    for process in processes:
+        process.join()
+    return delays
+
+
+def prepare_database() -> int:
+    """Creates the question which is locked and waited and returns its id"""
+    from antiintuit.database import Course, Question, create_tables, migrate_database
+
+    create_tables()
+    migrate_database()
+    course = Course.create(publish_id="unlock/1", title="Course", published_on=datetime.utcnow().date())
+    question = Question.create(task_id=-1, title="Question", type="single", course=course, variants=[["a", "1"]],
+                               original_html="")
+    Question._meta.database.close()
+    return question.id
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark of waiting for a locked question")
+    parser.add_argument("--rounds", type=int, default=10, help="Releases of the question in every mode")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as temp_directory:
+        environ.setdefault("DATABASE_NAME", str(Path(temp_directory).joinpath("unlock.db")))
+        environ["STATIC_DIRECTORY"] = str(Path(temp_directory).joinpath("static"))
+        from antiintuit.config import Config
+        from antiintuit.database import is_notifications_supported
+
+        logging.getLogger("antiintuit").setLevel(logging.CRITICAL)
+        benchmark_question_id = prepare_database()
+        modes = [("polling", False)] + ([("notifications", True)] if is_notifications_supported() else [])
+        print("{:<16}{:>16}{:>16}".format("mode", "median delay, s", "max delay, s"))
+        for mode, notifications_mode in modes:
+            mode_delays = run_benchmark(benchmark_question_id, args.rounds, notifications_mode)
+            print("{:<16}{:>16.3f}{:>16.3f}".format(mode, median(mode_delays), max(mode_delays)))
+        if not is_notifications_supported():
+            print("Notifications are measured only with Postgres (polling interval is {} seconds)."
+                  .format(Config.INTERVAL_BETWEEN_SESSION_CHECK))
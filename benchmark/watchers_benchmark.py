@@ -0,0 +1,137 @@
+"""Benchmark of appointing watchers to tests (tests_manager.appoint_accounts_to_tests).
+
+The database is filled with accounts and courses with tests without watchers. Watchers are appointed by
+the in-memory assignment with bulk updates, then (after the reset) by the former per-test queries for a part of
+the tests, because they take O(tests * accounts) time. The report contains tests per second and database queries
+of every mode. The script exits with 1 if a test stays without a watcher, an account watches two tests of a course,
+counters of accounts differ from their tests or loads of accounts differ by more than one test. The database is
+a temporary SQLite file unless DATABASE_* variables are given (an empty database has to be given then).
+
+    python benchmark/watchers_benchmark.py --accounts 300 --tests 50000 --per-test-tests 300
+"""
+import argparse
+import logging
+import sys
+import tempfile
+from datetime import datetime
+from os import environ
+from pathlib import Path
+from time import perf_counter
+
+sys.path.insert(0, str(Path(__file__).absolute().parent.parent))
+from benchmark.solver_benchmark import QueriesCounter  # noqa: E402
+
+
+def prepare_database(accounts_count: int, tests_count: int, tests_per_course: int):
+    from antiintuit.database import Account, Course, Test, create_tables, migrate_database
+    from benchmark.queries_plans import insert_rows
+
+    create_tables()
+    migrate_database()
+    insert_rows(Account, [{"first_name": "Иван", "last_name": "Иванов", "password": "password",
+                           "email": "watchers{}@example.com".format(num), "reserved_until": datetime(1, 1, 1)}
+                          for num in range(accounts_count)])
+    insert_rows(Course, [{"publish_id": "watchers/{}".format(num), "title": "Course {}".format(num),
+                          "published_on": datetime.utcnow().date()}
+                         for num in range(-(-tests_count // tests_per_course))])
+    courses_ids = [course_id for course_id, in Course.select(Course.id).order_by(Course.id).tuples()]
+    insert_rows(Test, [{"publish_id": "watchers/{}".format(num), "title": "Test {}".format(num),
+                        "course": courses_ids[num // tests_per_course], "questions_count": 10}
+                       for num in range(tests_count)])
+
+
+def reset_watchers():
+    from antiintuit.database import Account, Test
+
+    with Test._meta.database.atomic():
+        Test.update({Test.watcher: None}).execute()
+        Account.update({Account.watched_tests_count: 0}).execute()
+
+
+def appoint_per_test(tests_limit: int):
+    """Appoints watchers as the tests manager did before the in-memory assignment: by a query of the least loaded
+    account and an UPDATE for every test"""
+    from peewee import JOIN, SQL, fn
+
+    from antiintuit.config import Config
+    from antiintuit.database import Account, Test
+    from antiintuit.jobs.tests_manager import get_course_watchers_query, get_unwatched_tests_query
+
+    for test in get_unwatched_tests_query().limit(tests_limit):
+        account = (Account
+                   .select(Account, fn.COUNT(Test.id).alias("tests_count"))
+                   .join(Test, JOIN.LEFT_OUTER, on=(Test.watcher == Account.id))
+                   .where((Account.reserved_until < Config.get_account_reserve_out_moment()) &
+                          (Account.id.not_in(get_course_watchers_query(test.course))))
+                   .group_by(Account.id)
+                   .order_by(SQL("tests_count"), Account.reserved_until)
+                   .limit(1)).get()
+        test.watcher = account
+        test.save()
+
+
+def measure(queries_counter: QueriesCounter, function, *args) -> tuple:
+    """Returns seconds and queries of the call"""
+    started_at, queries_at = perf_counter(), queries_counter.count
+    function(*args)
+    return perf_counter() - started_at, queries_counter.count - queries_at
+
+
+def check_watchers() -> list:
+    """Returns descriptions of failed expectations"""
+    from peewee import fn
+
+    from antiintuit.database import Account, Test
+
+    errors = list()
+    if Test.select().where(Test.watcher.is_null()).exists():
+        errors.append("tests without watchers")
+    if (Test
+            .select(Test.course, Test.watcher)
+            .group_by(Test.course, Test.watcher)
+            .having(fn.COUNT(Test.id) > 1)
+            .exists()):
+        errors.append("accounts watching two tests of a course")
+    watched_tests_counts = dict(Test.select(Test.watcher, fn.COUNT(Test.id)).group_by(Test.watcher).tuples())
+    counters = dict(Account.select(Account.id, Account.watched_tests_count).tuples())
+    if any(counter != watched_tests_counts.get(account_id, 0) for account_id, counter in counters.items()):
+        errors.append("counters of accounts differ from their tests")
+    if max(counters.values()) - min(counters.values()) > 1:
+        errors.append("loads of accounts differ by more than one test")
+    return errors
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark of appointing watchers to tests")
+    parser.add_argument("--accounts", type=int, default=300)
+    parser.add_argument("--tests", type=int, default=50000)
+    parser.add_argument("--tests-per-course", type=int, default=10)
+    parser.add_argument("--per-test-tests", type=int, default=300, help="Tests appointed by the per-test queries")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as temp_directory:
+        environ.setdefault("DATABASE_NAME", str(Path(temp_directory).joinpath("watchers.db")))
+        environ["STATIC_DIRECTORY"] = str(Path(temp_directory).joinpath("static"))
+        from antiintuit.jobs.tests_manager import tests_manager
+
+        logging.getLogger("antiintuit").setLevel(logging.CRITICAL)
+        prepare_database(args.accounts, args.tests, args.tests_per_course)
+        benchmark_queries_counter = QueriesCounter()
+        peewee_logger = logging.getLogger("peewee")
+        peewee_logger.setLevel(logging.DEBUG)
+        peewee_logger.addHandler(benchmark_queries_counter)
+
+        results = [("in-memory assignment", args.tests) +
+                   measure(benchmark_queries_counter, tests_manager.get_watchers_assignments),
+                   ("assignment + bulk updates", args.tests) +
+                   measure(benchmark_queries_counter, tests_manager.appoint_accounts_to_tests)]
+        failed_expectations = check_watchers()
+        reset_watchers()
+        results.append(("per-test queries", args.per_test_tests) +
+                       measure(benchmark_queries_counter, appoint_per_test, args.per_test_tests))
+    print("{:<28}{:>10}{:>12}{:>12}{:>10}".format("mode", "tests", "seconds", "tests/sec", "queries"))
+    for mode, tests, seconds, queries in results:
+        print("{:<28}{:>10}{:>12.3f}{:>12.0f}{:>10}".format(mode, tests, seconds, tests / seconds, queries))
+    if failed_expectations:
+        print("Failed: " + "; ".join(failed_expectations), file=sys.stderr)
+        sys.exit(1)
@@ -1,49 +1,268 @@
+import asyncio
 import logging
-import socketserver
-from os import environ
+from collections import OrderedDict
+from functools import partial
+from os import environ, fsync, replace
+from os.path import exists
 from sys import stdout
+from time import monotonic
 
 import ujson
 
+logger = logging.getLogger("antiintuit.session_manager")
 
-class SessionManagerHandler(socketserver.BaseRequestHandler):
-    def handle(self):
-        global sessions, logger
-        self.data = self.request.recv(68).strip()
-        if self.data == b"healthz" or len(self.data) == 0:
-            logger.debug("Health check from %s.", self.client_address[0])
-            self.request.sendall(bytes(True))
-            return
-        logger.debug("%s wrote: %s", self.client_address[0], repr(self.data))
-        assert len(self.data) == 68, "Incorrect data ({}) length".format(repr(self.data))
-        assert self.data[:4] in (b"CHK:", b"DEL:"), "Incorrect operation"
-        operation, session = self.data[:4], self.data[4:]
-        if operation == b"CHK:":
-            response_data = dict({"new": False, "allow": False, "pos": 0})
-            if session not in sessions:
-                sessions.append(session)
-                response_data["new"] = True
-            if sessions[0] == session:
-                response_data["allow"] = True
-            else:
-                response_data["pos"] = sessions.index(session)
+
+class SessionEntry:
+    """Place of a session in the queue"""
+    __slots__ = ("granted", "granted_at", "expires_at", "waiters")
+
+    def __init__(self, lease: float):
+        # The future is done when the session reaches the head of the queue
+        self.granted = asyncio.get_event_loop().create_future()
+        self.granted_at = None
+        self.expires_at = monotonic() + lease
+        self.waiters = 0
+
+
+class SessionsSnapshot:
+    """Append-only log of the queue changes which is used for restoring the queue order after a restart"""
+
+    def __init__(self, path: str):
+        self.path, self.records_count = path, 0
+        self.file = None
+
+    def load(self) -> list:
+        """Returns sessions of the queue in order from the log"""
+        sessions = OrderedDict()
+        if exists(self.path):
+            with open(self.path, "rb") as snapshot_file:
+                for line in snapshot_file:
+                    operation, _, session = line.strip().partition(b" ")
+                    if operation == b"ADD":
+                        sessions[session] = None
+                    elif operation == b"DEL":
+                        sessions.pop(session, None)
+                    self.records_count += 1
+        return list(sessions)
+
+    def append(self, operation: bytes, session: bytes):
+        if self.file is None:
+            self.file = open(self.path, "ab")
+        self.file.write(operation + b" " + session + b"\n")
+        self.file.flush()
+        fsync(self.file.fileno())
+        self.records_count += 1
+
+    def compact(self, sessions):
+        """Rewrites the log with only the current sessions"""
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+        temp_path = self.path + ".tmp"
+        with open(temp_path, "wb") as snapshot_file:
+            snapshot_file.writelines(b"ADD " + session + b"\n" for session in sessions)
+            snapshot_file.flush()
+            fsync(snapshot_file.fileno())
+        replace(temp_path, self.path)
+        self.records_count = len(sessions)
+
+
+class SessionQueue:
+    """Queue of tests solver sessions. Only the first session of the queue is allowed to select a test.
+    Every session has a lease which is renewed by requests of the session and by its waiting connections.
+    Sessions with expired leases are evicted."""
+
+    def __init__(self, lease: float, snapshot: SessionsSnapshot = None):
+        self.lease, self.snapshot = lease, snapshot
+        # Sessions in order of arrival
+        self.sessions = OrderedDict()
+
+    def __len__(self):
+        return len(self.sessions)
+
+    @property
+    def head(self) -> bytes or None:
+        return next(iter(self.sessions), None)
+
+    @property
+    def head_age(self) -> float or None:
+        """Returns seconds since the first session has been allowed"""
+        head = self.head
+        if head is None or self.sessions[head].granted_at is None:
+            return None
+        return monotonic() - self.sessions[head].granted_at
+
+    def restore(self):
+        """Restores the queue order from the snapshot"""
+        for session in self.snapshot.load():
+            self.sessions[session] = SessionEntry(self.lease)
+        self.grant_head()
+        if self.sessions:
+            logger.info("%i sessions have been restored from '%s'.", len(self.sessions), self.snapshot.path)
+
+    def check(self, session: bytes) -> tuple:
+        """Adds the session in the queue if it isn't there yet and renews its lease.
+        Returns True if the session is new and the entry of the session."""
+        is_new = session not in self.sessions
+        if is_new:
+            self.sessions[session] = SessionEntry(self.lease)
+            if self.snapshot is not None:
+                self.snapshot.append(b"ADD", session)
+            self.grant_head()
         else:
-            assert session in sessions, "The order hasn't this session."
-            assert sessions[0] == session, "This session isn't the first in the order."
-            sessions.pop(0)
-            response_data = True
-        logger.info("%s (%s) will response data: %s", self.client_address[0], session, ujson.dumps(response_data))
-        self.request.sendall(bytes(ujson.dumps(response_data), "utf-8"))
+            self.renew(session)
+        return is_new, self.sessions[session]
 
+    def renew(self, session: bytes) -> bool:
+        """Extends the lease of the session"""
+        entry = self.sessions.get(session)
+        if entry is None:
+            return False
+        entry.expires_at = monotonic() + self.lease
+        return True
 
-if __name__ == "__main__":
-    logger = logging.getLogger("antiintuit.session_manager")
+    def delete(self, session: bytes) -> bool:
+        """Removes the first session of the queue and allows the next one"""
+        if self.head != session:
+            return False
+        self.discard(session)
+        return True
+
+    def discard(self, session: bytes):
+        """Removes the session from any position of the queue"""
+        entry = self.sessions.pop(session, None)
+        if entry is None:
+            return
+        entry.granted.cancel()
+        if self.snapshot is not None:
+            self.snapshot.append(b"DEL", session)
+            if self.snapshot.records_count > 2 * len(self.sessions) + 1000:
+                self.snapshot.compact(self.sessions)
+        self.grant_head()
+
+    def evict_expired(self) -> int:
+        """Removes sessions which have expired leases and no waiting connections"""
+        moment = monotonic()
+        expired = [session for session, entry in self.sessions.items()
+                   if entry.waiters == 0 and entry.expires_at < moment]
+        for session in expired:
+            logger.warning("The lease of session %s is expired. The session is evicted.", session)
+            self.discard(session)
+        return len(expired)
+
+    def grant_head(self):
+        head = self.head
+        if head is not None and not self.sessions[head].granted.done():
+            entry = self.sessions[head]
+            entry.granted_at = monotonic()
+            entry.expires_at = entry.granted_at + self.lease
+            entry.granted.set_result(True)
+
+
+async def wait_granted(sessions: SessionQueue, session: bytes, entry: SessionEntry, next_line: asyncio.Future) -> bool:
+    """Waits until the session is allowed or the client closes the connection (long-poll).
+    The next request of the connection is read meanwhile to find out the disconnection."""
+    entry.waiters += 1
+    try:
+        done, _ = await asyncio.wait({entry.granted, next_line}, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        entry.waiters -= 1
+    if next_line in done and entry.granted not in done and not next_line.exception() and next_line.result():
+        # The client has pipelined the next request, so the session is kept by its lease only
+        await asyncio.wait({entry.granted})
+        done = {entry.granted}
+    if entry.granted in done and not entry.granted.cancelled():
+        return True
+    logger.info("Session %s has gone before it was allowed.", session)
+    sessions.discard(session)
+    return False
+
+
+async def get_response_data(sessions: SessionQueue, data: bytes, client_address: str, next_line: asyncio.Future):
+    """Executes the request and returns data of the response or None if the response can't be given"""
+    if data == b"healthz" or len(data) == 0:
+        logger.debug("Health check from %s.", client_address)
+        return {"depth": len(sessions), "head_age": sessions.head_age}
+    logger.debug("%s wrote: %s", client_address, repr(data))
+    if len(data) != 68 or data[:4] not in (b"CHK:", b"DEL:", b"RNW:"):
+        logger.warning("Incorrect data (%s) from %s.", repr(data), client_address)
+        return None
+    operation, session = data[:4], data[4:]
+    if operation == b"CHK:":
+        is_new, entry = sessions.check(session)
+        if not entry.granted.done():
+            logger.debug("Session %s is waiting in the queue (%i sessions).", session, len(sessions))
+        if not await wait_granted(sessions, session, entry, next_line):
+            return None
+        response_data = dict({"new": is_new, "allow": True, "pos": 0})
+    elif operation == b"RNW:":
+        response_data = sessions.renew(session)
+    else:
+        response_data = sessions.delete(session)
+        if not response_data:
+            logger.warning("Session %s isn't the first in the queue.", session)
+    logger.info("%s (%s) will response data: %s", client_address, session, ujson.dumps(response_data))
+    return response_data
+
+
+async def handle(sessions: SessionQueue, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    """Serves newline-delimited requests of the connection in order until the client closes it"""
+    client_address = writer.get_extra_info("peername")[0]
+    next_line = asyncio.ensure_future(reader.readline())
+    try:
+        while True:
+            line = await next_line
+            if not line:
+                return
+            next_line = asyncio.ensure_future(reader.readline())
+            response_data = await get_response_data(sessions, line.strip(), client_address, next_line)
+            if response_data is None:
+                return
+            writer.write(bytes(ujson.dumps(response_data) + "\n", "utf-8"))
+            await writer.drain()
+    except ConnectionError:
+        logger.debug("Connection with %s has been lost.", client_address)
+    finally:
+        next_line.cancel()
+        writer.close()
+
+
+async def evict_expired_sessions(sessions: SessionQueue, interval: float):
+    while True:
+        await asyncio.sleep(interval)
+        sessions.evict_expired()
+
+
+async def start_server(sessions: SessionQueue, host: str or None, port: int) -> asyncio.AbstractServer:
+    """Restores the queue, starts serving its clients and the eviction of expired sessions.
+    Port 0 means any free port (see sockets of the returned server)."""
+    if sessions.snapshot is not None:
+        sessions.restore()
+    server = await asyncio.start_server(partial(handle, sessions), host, port)
+    asyncio.ensure_future(evict_expired_sessions(sessions, min(sessions.lease / 4, 5)))
+    return server
+
+
+async def serve(sessions: SessionQueue, host: str or None, port: int):
+    server = await start_server(sessions, host, port)
+    async with server:
+        await server.serve_forever()
+
+
+def create_sessions_queue() -> SessionQueue:
+    """Returns the queue configured by environment variables"""
+    session_lease = float(environ.get("SESSION_LEASE", 60))  # Seconds
+    snapshot_path = environ.get("SNAPSHOT_PATH")  # The queue isn't saved if it's empty
+    return SessionQueue(session_lease, SessionsSnapshot(snapshot_path) if snapshot_path else None)
+
+
+def main():
     logger.setLevel(logging.DEBUG)
     logger.addHandler(logging.StreamHandler(stdout))
+    host, port = environ.get("HOST", ""), int(environ.get("PORT", 26960))
+    logger.debug("Server will be started with listening '%s:%i'.", host, port)
+    asyncio.run(serve(create_sessions_queue(), host or None, port))
 
-    HOST = environ.get("HOST", "")
-    PORT = int(environ.get("PORT", 26960))
-    sessions = list()
-    logger.debug("Server will be started with listening '%s:%i'.", HOST, PORT)
-    with socketserver.TCPServer((HOST, PORT), SessionManagerHandler) as server:
-        server.serve_forever()
+
+if __name__ == "__main__":
+    main()
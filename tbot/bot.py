@@ -50,7 +50,8 @@ async def search_course_by_url(message: types.Message, state: FSMContext):
 @dp.message_handler(message_is_not_digit, state=SearchForm.course)
 async def search_course_by_title(message: types.Message, state: FSMContext):
     await types.ChatActions.typing(1)
-    response = requests.get("{}/courses".format(config.host), params={"where:like:title": message.text})
+    response = requests.get("{}/courses".format(config.host),
+                            params={"where:like:title": message.text, "count": "exact"})
     if response.status_code != 200:
         await send_that_not_found(message)
     else:
@@ -72,7 +73,7 @@ async def search_question_by_title(message: types.Message, state: FSMContext):
     await types.ChatActions.typing(1)
     async with state.proxy() as data:
         response = requests.get("{}/courses/{}/questions".format(config.host, data["course"]["id"]),
-                                params={"where:like:title": message.text})
+                                params={"where:like:title": message.text, "count": "exact"})
         if response.status_code != 200:
             await send_that_not_found(message)
         else: